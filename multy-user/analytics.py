@@ -0,0 +1,212 @@
+# analytics.py - Аналитика заработка: длительность смен, ставка в час, разрезы
+#
+# Замер на синтетической истории:
+#   python analytics.py --shifts 100000
+import argparse
+import random
+import time
+from array import array
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+WEEKDAY_NAMES=["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+NO_ROLE="без роли"
+NO_PROGRAM="без программы"
+
+
+def parse_minutes(value: Optional[str]) -> int:
+    """'ЧЧ:ММ' -> минуты от полуночи; -1, если время не указано или неверно"""
+    if not value or len(value) != 5 or value[2] != ":":
+        return -1
+    try:
+        minutes=int(value[:2]) * 60 + int(value[3:])
+    except ValueError:
+        return -1
+    return minutes if 0<=minutes<1440 else -1
+
+
+def shift_minutes(start_time: Optional[str], end_time: Optional[str]) -> Optional[int]:
+    """Длительность смены в минутах; смена через полночь (22:00–03:00) — 5 часов"""
+    start=parse_minutes(start_time)
+    end=parse_minutes(end_time)
+    if start<0 or end<0:
+        return None
+    return (end - start) % 1440
+
+
+class ShiftColumns:
+    """Смены пользователя в виде колонок array вместо списка словарей.
+
+    Повторяющиеся значения (время, дата, роль, программа) разбираются один
+    раз и кодируются номерами, поэтому 100 тысяч смен занимают несколько
+    плоских массивов, а каждый разрез — один проход по ним без ветвлений.
+    """
+
+    def __init__(self):
+        self.day=array("i")  # date.toordinal()
+        self.minutes=array("i")  # длительность; 0 — время не указано
+        self.salary=array("d")
+        # Ставка считается только по сменам, где известны и время, и гонорар
+        self.paid_minutes=array("i")
+        self.paid_salary=array("d")
+        self.role=array("H")  # номер в self.roles
+        self.program=array("H")  # номер в self.programs
+        self.roles: List[str]=[]
+        self.programs: List[str]=[]
+
+    def __len__(self):
+        return len(self.day)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "ShiftColumns":
+        """Колонки из строк (date, start_time, end_time, role, program, salary)"""
+        columns=cls()
+        days: Dict[str, int]={}
+        times: Dict[str, int]={}
+        roles: Dict[Optional[str], int]={}
+        programs: Dict[Optional[str], int]={}
+
+        for day, start_time, end_time, role, program, salary in rows:
+            if not day:
+                continue  # Смена без даты не попадает ни в один разрез
+            ordinal=days.get(day)
+            if ordinal is None:
+                ordinal=days[day]=date.fromisoformat(day).toordinal()
+            start=times.get(start_time)
+            if start is None:
+                start=times[start_time]=parse_minutes(start_time)
+            end=times.get(end_time)
+            if end is None:
+                end=times[end_time]=parse_minutes(end_time)
+            role_code=roles.get(role)
+            if role_code is None:
+                role_code=roles[role]=len(columns.roles)
+                columns.roles.append(role or NO_ROLE)
+            program_code=programs.get(program)
+            if program_code is None:
+                program_code=programs[program]=len(columns.programs)
+                columns.programs.append(program or NO_PROGRAM)
+
+            minutes=(end - start) % 1440 if start>=0 and end>=0 else 0
+            paid=salary is not None and minutes>0
+            columns.day.append(ordinal)
+            columns.minutes.append(minutes)
+            columns.salary.append(salary or 0)
+            columns.paid_minutes.append(minutes if paid else 0)
+            columns.paid_salary.append(salary if paid else 0)
+            columns.role.append(role_code)
+            columns.program.append(program_code)
+        return columns
+
+
+def _summary(count: int, minutes: int, salary: float, paid_minutes: int, paid_salary: float) -> Dict[str, Any]:
+    return {
+        "count": count,
+        "hours": round(minutes / 60, 2),
+        "salary": salary,
+        "hourly_rate": round(paid_salary * 60 / paid_minutes, 2) if paid_minutes else None
+    }
+
+
+def _group(columns: ShiftColumns, codes, size: int) -> List[Dict[str, Any]]:
+    """Сводка по группам: codes[i] — номер группы i-й смены"""
+    count=[0] * size
+    minutes=[0] * size
+    salary=[0.0] * size
+    paid_minutes=[0] * size
+    paid_salary=[0.0] * size
+
+    # Без ветвлений: неизвестные время и гонорар уже записаны нулями
+    for code, duration, amount, rate_duration, rate_amount in zip(
+            codes, columns.minutes, columns.salary, columns.paid_minutes, columns.paid_salary):
+        count[code]+=1
+        minutes[code]+=duration
+        salary[code]+=amount
+        paid_minutes[code]+=rate_duration
+        paid_salary[code]+=rate_amount
+
+    return [_summary(count[i], minutes[i], salary[i], paid_minutes[i], paid_salary[i]) for i in range(size)]
+
+
+def analyze(columns: ShiftColumns) -> Dict[str, Any]:
+    """Итого, ставка в час и разрезы по роли, программе, месяцу и дню недели"""
+    # Месяц и день недели — по уникальным дням, а не по каждой смене
+    months: Dict[int, int]={}
+    month_keys: List[str]=[]
+    day_month: Dict[int, int]={}
+    for ordinal in set(columns.day):
+        day=date.fromordinal(ordinal)
+        key=day.year * 12 + day.month - 1
+        if key not in months:
+            months[key]=len(month_keys)
+            month_keys.append(f"{day.year}-{day.month:02d}")
+        day_month[ordinal]=months[key]
+
+    month_codes=array("H", [day_month[ordinal] for ordinal in columns.day])
+    # date(1, 1, 1) — понедельник, его порядковый номер 1
+    weekday_codes=array("b", [(ordinal - 1) % 7 for ordinal in columns.day])
+
+    total=_summary(len(columns), sum(columns.minutes), sum(columns.salary),
+                   sum(columns.paid_minutes), sum(columns.paid_salary))
+    by_role=_group(columns, columns.role, len(columns.roles))
+    by_program=_group(columns, columns.program, len(columns.programs))
+    by_month=_group(columns, month_codes, len(month_keys))
+    by_weekday=_group(columns, weekday_codes, 7)
+
+    return {
+        "total": total,
+        "by_role": sorted(({"role": name, **row} for name, row in zip(columns.roles, by_role)),
+                          key=lambda row: row["salary"], reverse=True),
+        "by_program": sorted(({"program": name, **row} for name, row in zip(columns.programs, by_program)),
+                             key=lambda row: row["salary"], reverse=True),
+        "by_month": sorted(({"month": name, **row} for name, row in zip(month_keys, by_month)),
+                           key=lambda row: row["month"]),
+        "by_weekday": [{"weekday": WEEKDAY_NAMES[i], **row} for i, row in enumerate(by_weekday)]
+    }
+
+
+# ====== Замер ======
+
+def synthetic_rows(count: int, seed: int = 1):
+    """Случайная история смен: дневные, вечерние и ночные эфиры"""
+    rng=random.Random(seed)
+    roles=["РЕЖ", "ЗВУК", "СВЕТ", "ОПЕР", "ВИДЕО", None]
+    programs=[f"Программа {i}" for i in range(40)] + [None]
+    start=date.today() - timedelta(days=3650)
+    for _ in range(count):
+        begin=rng.randrange(0, 24 * 4) * 15
+        end=(begin + rng.randrange(4, 14 * 4) * 15) % 1440
+        yield (
+            (start + timedelta(days=rng.randrange(3650))).isoformat(),
+            f"{begin // 60:02d}:{begin % 60:02d}",
+            f"{end // 60:02d}:{end % 60:02d}" if rng.random()>0.05 else None,
+            rng.choice(roles),
+            rng.choice(programs),
+            rng.randrange(30, 300) * 100 if rng.random()>0.1 else None
+        )
+
+
+def main():
+    parser=argparse.ArgumentParser(description="Замер аналитики на синтетической истории смен")
+    parser.add_argument("--shifts", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args=parser.parse_args()
+
+    rows=list(synthetic_rows(args.shifts))
+    timings={"columns": [], "analyze": []}
+    for _ in range(args.repeat):
+        started=time.perf_counter()
+        columns=ShiftColumns.from_rows(rows)
+        timings["columns"].append(time.perf_counter() - started)
+        started=time.perf_counter()
+        result=analyze(columns)
+        timings["analyze"].append(time.perf_counter() - started)
+
+    print(f"Смен: {len(columns)}, часов: {result['total']['hours']:.0f}, "
+          f"ставка: {result['total']['hourly_rate']} ₽/ч")
+    for stage, values in timings.items():
+        print(f"{stage}: {min(values) * 1000:.1f} мс (лучшее из {args.repeat})")
+
+
+if __name__ == "__main__":
+    main()
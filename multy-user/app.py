@@ -1,67 +1,145 @@
 from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
+from contextlib import contextmanager
+import threading
 import traceback
 import sqlite3
+import time
 import os
 
 # Определяем пути
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'shifts.db')
 
+# Ограничение одновременных подключений к БД и таймаут для проверок готовности
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "8"))
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "0.25"))
+
+_db_slots = threading.BoundedSemaphore(DB_MAX_CONNECTIONS)
+_db_lock = threading.Lock()
+_db_in_use = 0
+
+
+@contextmanager
+def get_connection():
+    """Подключение к БД с учетом лимита одновременных соединений"""
+    global _db_in_use
+    _db_slots.acquire()
+    with _db_lock:
+        _db_in_use += 1
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        with _db_lock:
+            _db_in_use -= 1
+        _db_slots.release()
+
+
 # Функции для работы с БД (вместо импорта из db.py)
 def get_all_shifts():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.execute('''
-        SELECT * FROM shifts 
-        ORDER BY date DESC, start_time DESC
-    ''')
-    shifts = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return shifts
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.execute('''
+            SELECT * FROM shifts 
+            ORDER BY date DESC, start_time DESC
+        ''')
+        return [dict(row) for row in cursor.fetchall()]
 
 def get_statistics():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.execute('''
-        SELECT COUNT(*) as total, SUM(salary) as total_salary 
-        FROM shifts
-    ''')
-    stats = dict(cursor.fetchone())
-    conn.close()
-    return stats
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.execute('''
+            SELECT COUNT(*) as total, SUM(salary) as total_salary 
+            FROM shifts
+        ''')
+        return dict(cursor.fetchone())
 
 def update_shift(user_id, shift_id, field, value):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute(f'''
-            UPDATE shifts SET {field} = ? 
-            WHERE id = ? AND user_id = ?
-        ''', (value, shift_id, user_id))
-        conn.commit()
-        affected = conn.total_changes
-        conn.close()
-        return affected > 0
+        with get_connection() as conn:
+            conn.execute(f'''
+                UPDATE shifts SET {field} = ? 
+                WHERE id = ? AND user_id = ?
+            ''', (value, shift_id, user_id))
+            conn.commit()
+            return conn.total_changes > 0
     except Exception as e:
         print(f"Ошибка обновления: {e}")
         return False
 
 def delete_shift(user_id, shift_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute('''
-            DELETE FROM shifts 
-            WHERE id = ? AND user_id = ?
-        ''', (shift_id, user_id))
-        conn.commit()
-        affected = conn.total_changes
-        conn.close()
-        return affected > 0
+        with get_connection() as conn:
+            conn.execute('''
+                DELETE FROM shifts 
+                WHERE id = ? AND user_id = ?
+            ''', (shift_id, user_id))
+            conn.commit()
+            return conn.total_changes > 0
     except Exception as e:
         print(f"Ошибка удаления: {e}")
         return False
 
 
+# ====== Проверки для балансировщика (без чтения данных) ======
+
+def _timed(checks, name, func):
+    """Выполняет проверку и записывает время выполнения в миллисекундах"""
+    started = time.perf_counter()
+    try:
+        return func()
+    finally:
+        checks[name] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def ping_db():
+    """Чтение заголовка БД без обращения к таблицам"""
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=PROBE_TIMEOUT)
+    try:
+        conn.execute("PRAGMA schema_version").fetchone()
+        return True
+    finally:
+        conn.close()
+
+
+def check_writable():
+    """Проверка, что БД можно заблокировать на запись (без записи данных)"""
+    if not os.access(DB_PATH, os.W_OK) or not os.access(BASE_DIR, os.W_OK):
+        return False
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=rw", uri=True,
+                           timeout=PROBE_TIMEOUT, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ROLLBACK")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def get_wal_size():
+    """Размер WAL-файла в байтах (0 если WAL не используется)"""
+    try:
+        return os.path.getsize(DB_PATH + "-wal")
+    except OSError:
+        return 0
+
+
+def get_pool_usage():
+    """Загрузка пула подключений к БД"""
+    with _db_lock:
+        in_use = _db_in_use
+    return {
+        "in_use": in_use,
+        "max": DB_MAX_CONNECTIONS,
+        "saturation": round(in_use / DB_MAX_CONNECTIONS, 3)
+    }
+
+
 app=Flask(__name__)
 CORS(app)  # Разрешаем CORS для API
 
@@ -218,14 +296,47 @@ def api_statistics():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/livez")
+def livez():
+    """Процесс жив (БД не проверяется)"""
+    return jsonify({"status": "alive"})
+
+
+@app.route("/readyz")
+def readyz():
+    """Готовность к обработке запросов: ping БД, запись, WAL и пул подключений"""
+    verbose="verbose" in request.args
+    checks={}
+
+    try:
+        _timed(checks, "ping_ms", ping_db)
+    except Exception as e:
+        return jsonify({"status": "unavailable", "error": str(e), "timings": checks}), 503
+
+    writable=_timed(checks, "writable_ms", check_writable)
+    pool=get_pool_usage()
+    ready=writable and pool["in_use"]<pool["max"]
+
+    result={
+        "status": "ready" if ready else "degraded",
+        "writable": writable,
+        "wal_size": get_wal_size(),
+        "pool": pool
+    }
+    if verbose:
+        result["timings"]=checks
+        result["timestamp"]=datetime.now().isoformat()
+
+    return jsonify(result), 200 if ready else 503
+
+
 @app.route("/health")
 def health():
-    """Проверка работоспособности"""
+    """Проверка работоспособности (без чтения смен)"""
     try:
-        shifts_count=len(get_all_shifts())
+        ping_db()
         return jsonify({
             "status": "healthy",
-            "shifts_count": shifts_count,
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
@@ -239,4 +350,5 @@ if __name__ == "__main__":
     print("📝 Новые endpoints:")
     print("   PUT /api/shifts/<id> - обновить смену")
     print("   DELETE /api/shifts/<id> - удалить смену")
+    print("   GET /livez, /readyz[?verbose] - проверки для балансировщика")
     app.run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
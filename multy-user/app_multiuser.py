@@ -1,8 +1,17 @@
 # app_multiuser.py - Flask приложение с авторизацией
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, make_response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, make_response, \
+    Response, stream_with_context
 from flask_cors import CORS
-from database import MultiUserDatabase
+from database import MultiUserDatabase, ShiftOverlapError, SHIFT_FIELDS
+from change_feed import ChangeFeed
+from cache import VersionedCache
+from exporters import write_ics
+from analytics import ShiftColumns, analyze
 from datetime import datetime, date, timedelta
+import calendar
+import hashlib
+import json
+import io
 import secrets
 import os
 
@@ -46,6 +55,25 @@ CORS(app)
 DB_PATH = os.getenv("DATABASE_PATH", "shifts.db")
 db = MultiUserDatabase(DB_PATH)
 
+# Лента изменений для SSE (/api/events)
+change_feed = ChangeFeed(
+    db,
+    poll_interval=float(os.getenv("SSE_POLL_INTERVAL", "0.5")),
+    max_streams=int(os.getenv("SSE_MAX_STREAMS", "100")),
+    buffer_size=int(os.getenv("SSE_BUFFER_SIZE", "64"))
+)
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+
+# Отрисованные публичные календари: (токен, формат, окно) -> (тело, ETag)
+calendar_cache = VersionedCache(max_entries=int(os.getenv("CALENDAR_CACHE_SIZE", "1024")))
+CALENDAR_MAX_AGE = int(os.getenv("CALENDAR_MAX_AGE", "300"))
+# Аналитика заработка: (пользователь, окно) -> сводка
+analytics_cache = VersionedCache(max_entries=int(os.getenv("ANALYTICS_CACHE_SIZE", "256")))
+# Статистика с трендами: (пользователь, день) -> ответ /api/statistics
+statistics_cache = VersionedCache(max_entries=int(os.getenv("STATISTICS_CACHE_SIZE", "256")))
+# Тепловая карта: (пользователь, год) -> дневные корзины
+heatmap_cache = VersionedCache(max_entries=int(os.getenv("HEATMAP_CACHE_SIZE", "1024")))
+
 # ====== ДЕКОРАТОРЫ ДЛЯ ПРОВЕРКИ АВТОРИЗАЦИИ ======
 
 def login_required(f):
@@ -182,6 +210,8 @@ def profile():
 def api_get_shifts():
     """Получение всех смен пользователя"""
     user=request.current_user
+    # Токен читаем до выборки, чтобы не пропустить изменения между запросами
+    sync_token=db.get_sync_token()
     shifts=db.get_user_shifts(user['user_id'])
 
     # Преобразуем даты в строки для JSON
@@ -189,7 +219,34 @@ def api_get_shifts():
         if shift['date']:
             shift['date']=shift['date'].isoformat()
 
-    return jsonify(shifts)
+    response=jsonify(shifts)
+    response.headers['X-Sync-Token']=str(sync_token)
+    return response
+
+
+@app.route('/api/shifts/changes', methods=['GET'])
+@api_auth_required
+def api_shift_changes():
+    """Изменения смен с момента последней синхронизации (?since=<token>)"""
+    user=request.current_user
+
+    try:
+        since=int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'Неверный токен синхронизации'}), 400
+
+    changes=db.get_shift_changes(user['user_id'], since)
+
+    for shift in changes['upserts']:
+        if shift['date']:
+            shift['date']=shift['date'].isoformat()
+
+    return jsonify({
+        'upserts': changes['upserts'],
+        'deleted': changes['deleted'],
+        'reset': changes['reset'],
+        'token': str(changes['token'])
+    })
 
 
 @app.route('/api/shifts', methods=['POST'])
@@ -199,11 +256,28 @@ def api_add_shift():
     user=request.current_user
     data=request.get_json()
 
+    # Пересечение с сохраненной сменой: 409, если не выбрано allow (сохранить обе) или merge
+    on_overlap=data.pop('on_overlap', None)
+
     # Преобразуем дату из строки
     if data.get('date'):
         data['date']=datetime.fromisoformat(data['date']).date()
 
-    success=db.add_shift(user['user_id'], data)
+    if on_overlap == 'merge':
+        conflict=db.find_overlap(user['user_id'], data)
+        if conflict:
+            try:
+                merged=db.merge_shift(user['user_id'], conflict['id'], data)
+            except ShiftOverlapError as e:
+                return _overlap_response(e)
+            if not merged:
+                return jsonify({'success': False, 'error': 'Ошибка при объединении'}), 400
+            return jsonify({'success': True, 'message': 'Смены объединены', 'shift': _shift_json(merged)})
+
+    try:
+        success=db.add_shift(user['user_id'], data, allow_overlap=on_overlap == 'allow')
+    except ShiftOverlapError as e:
+        return _overlap_response(e)
 
     if success:
         return jsonify({'success': True, 'message': 'Смена добавлена'})
@@ -217,18 +291,37 @@ def api_update_shift(shift_id):
     """Обновление смены"""
     user=request.current_user
     data=request.get_json()
+    allow_overlap=data.pop('on_overlap', None) == 'allow'
+    # Страница редактирования присылает и user_id — он не меняется
+    data={field: value for field, value in data.items() if field in SHIFT_FIELDS}
 
-    for field, value in data.items():
-        if field == 'date' and value:
-            value=datetime.fromisoformat(value).date()
+    if data.get('date'):
+        data['date']=datetime.fromisoformat(data['date']).date()
 
-        success=db.update_shift(user['user_id'], shift_id, field, value)
-        if not success:
-            return jsonify({'error': f'Ошибка при обновлении поля {field}'}), 400
+    # Все поля одной записью: пересечение проверяется для итоговой смены
+    try:
+        success=db.update_shift_fields(user['user_id'], shift_id, data, allow_overlap)
+    except ShiftOverlapError as e:
+        return _overlap_response(e)
+    if not success:
+        return jsonify({'error': 'Ошибка при обновлении смены'}), 400
 
     return jsonify({'success': True})
 
 
+def _shift_json(shift):
+    return dict(shift, date=shift['date'].isoformat() if shift['date'] else None)
+
+
+def _overlap_response(error):
+    """409 с пересекающейся сменой: клиент предлагает объединить или сохранить обе"""
+    return jsonify({
+        'success': False,
+        'error': 'Смена пересекается с уже сохраненной',
+        'conflict': _shift_json(error.conflict)
+    }), 409
+
+
 @app.route('/api/shifts/<int:shift_id>', methods=['DELETE'])
 @api_auth_required
 def api_delete_shift(shift_id):
@@ -242,15 +335,106 @@ def api_delete_shift(shift_id):
         return jsonify({'error': 'Смена не найдена'}), 404
 
 
+@app.route('/api/events')
+@api_auth_required
+def api_events():
+    """SSE-поток изменений смен текущего пользователя"""
+    user=request.current_user
+
+    # При переподключении браузер передает последний полученный токен
+    last_event_id=request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        token=int(last_event_id) if last_event_id else None
+    except ValueError:
+        token=None
+
+    sub=change_feed.subscribe(user['user_id'], token)
+    if sub is None:
+        response=jsonify({'error': 'Слишком много подключений'})
+        response.status_code=503
+        response.headers['Retry-After']='30'
+        return response
+
+    return Response(
+        stream_with_context(change_feed.stream(sub, heartbeat=SSE_HEARTBEAT)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/statistics')
 @api_auth_required
 def api_statistics():
-    """Получение статистики"""
+    """Статистика: итоги, последние 12 месяцев и тренды (окна 30/90/365 дней,
+    год к году, лучший и худший месяц программ)"""
     user=request.current_user
-    stats=db.get_user_statistics(user['user_id'])
+    today=date.today()
+    stats=statistics_cache.get_or_compute(
+        (user['user_id'], today),
+        db.get_user_version(user['user_id']),
+        lambda: {**db.get_user_statistics(user['user_id']),
+                 'trends': db.get_statistics_trends(user['user_id'], today)}
+    )
     return jsonify(stats)
 
 
+@app.route('/api/analytics')
+@api_auth_required
+def api_analytics():
+    """Часы, ставка в час и разрезы по роли, программе, месяцу и дню недели (?from=&to=)"""
+    user=request.current_user
+    try:
+        date_from=date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        date_to=date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'Неверный формат даты, нужен YYYY-MM-DD'}), 400
+
+    result=analytics_cache.get_or_compute(
+        (user['user_id'], date_from, date_to),
+        db.get_user_version(user['user_id']),
+        lambda: analyze(ShiftColumns.from_rows(db.get_shift_rows(user['user_id'], date_from, date_to)))
+    )
+    return jsonify(result)
+
+
+def _heatmap(user_id, year):
+    """Смены и заработок по дням года: по одному элементу на каждый день с 1 января"""
+    first=date(year, 1, 1)
+    days=366 if calendar.isleap(year) else 365
+    counts=[0] * days
+    salary=[0] * days
+    for day, count, amount in db.get_daily_buckets(user_id, first, date(year, 12, 31)):
+        index=(date.fromisoformat(day) - first).days
+        counts[index]=count
+        salary[index]=amount
+    return {
+        'year': year,
+        'start': first.isoformat(),
+        'counts': counts,
+        'salary': salary,
+        'total': {'count': sum(counts), 'salary': sum(salary), 'days': days - counts.count(0)}
+    }
+
+
+@app.route('/api/heatmap')
+@api_auth_required
+def api_heatmap():
+    """Тепловая карта года (?year=, по умолчанию текущий): смены и заработок по дням"""
+    user=request.current_user
+    try:
+        year=int(request.args.get('year') or date.today().year)
+        date(year, 1, 1)
+    except ValueError:
+        return jsonify({'error': 'Неверный год'}), 400
+
+    result=heatmap_cache.get_or_compute(
+        (user['user_id'], year),
+        db.get_user_version(user['user_id']),
+        lambda: _heatmap(user['user_id'], year)
+    )
+    return jsonify(result)
+
+
 @app.route('/api/user')
 @api_auth_required
 def api_user_info():
@@ -269,29 +453,69 @@ def health():
 
 # ====== ПУБЛИЧНОЕ API ДЛЯ ИНТЕГРАЦИЙ ======
 
+def _render_calendar_json(shifts):
+    """События календаря для виджетов"""
+    events=[]
+    for shift in shifts:
+        events.append({
+            'date': shift['date'].isoformat(),
+            'title': shift.get('program') or 'Смена',
+            'role': shift.get('role'),
+            'time': f"{shift.get('start_time') or ''}-{shift.get('end_time') or ''}",
+            'salary': shift.get('salary')
+        })
+    return json.dumps(events, ensure_ascii=False).encode('utf-8')
+
+
+def _render_calendar_ics(shifts, calendar_name):
+    out=io.BytesIO()
+    write_ics(out, shifts, {'calendar_name': calendar_name})
+    return out.getvalue()
+
+
+def _calendar_response(api_token, fmt):
+    """Публичный календарь из кэша; 304, если у клиента актуальная версия"""
+    try:
+        date_from=date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        date_to=date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'Неверный формат даты, нужен YYYY-MM-DD'}), 400
+
+    owner=db.get_calendar_owner(api_token)
+    if not owner:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    def render():
+        shifts=db.get_user_shifts_between(owner['user_id'], date_from, date_to)
+        if fmt == 'ics':
+            body=_render_calendar_ics(shifts, owner['full_name'] or 'Смены')
+        else:
+            body=_render_calendar_json(shifts)
+        return body, hashlib.sha1(body).hexdigest()
+
+    key=(api_token, fmt, date_from, date_to)
+    body, etag=calendar_cache.get_or_compute(key, owner['version'], render)
+
+    if etag in request.if_none_match:
+        response=make_response('', 304)
+    else:
+        response=make_response(body)
+        response.mimetype='text/calendar' if fmt == 'ics' else 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control']=f'private, max-age={CALENDAR_MAX_AGE}'
+    return response
+
+
 @app.route('/api/public/calendar/<api_token>')
 def public_calendar(api_token):
     """Публичный календарь по API токену (для виджетов)"""
-    user=db.get_user_by_api_token(api_token)
-    if not user:
-        return jsonify({'error': 'Invalid token'}), 401
+    return _calendar_response(api_token, 'json')
 
-    shifts=db.get_user_shifts(user['user_id'])
 
-    # Форматируем для календаря
-    events=[]
-    for shift in shifts:
-        if shift['date']:
-            event={
-                'date': shift['date'].isoformat(),
-                'title': shift.get('program', 'Смена'),
-                'role': shift.get('role'),
-                'time': f"{shift.get('start_time', '')}-{shift.get('end_time', '')}",
-                'salary': shift.get('salary')
-            }
-            events.append(event)
-
-    return jsonify(events)
+@app.route('/api/public/calendar/<api_token>.ics')
+def public_calendar_ics(api_token):
+    """Публичный календарь в формате iCalendar (?from=YYYY-MM-DD&to=YYYY-MM-DD)"""
+    return _calendar_response(api_token, 'ics')
 
 
 if __name__ == '__main__':
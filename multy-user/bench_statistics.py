@@ -0,0 +1,74 @@
+# bench_statistics.py - Замер запросов статистики на синтетической истории смен
+#
+#   python bench_statistics.py --shifts 20000 --users 20
+# Код возврата 1, если медиана какого-либо запроса превысила бюджет: запросы
+# /stats, подробной статистики, /api/statistics и навигатора по месяцам.
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+from analytics import synthetic_rows
+from database import MultiUserDatabase
+
+# Бюджеты времени ответа, мс (медиана на пользователя с --shifts смен)
+BUDGETS_MS={
+    "get_user_statistics": 50,
+    "get_statistics_trends": 100,
+    "get_month_summary": 50,
+}
+
+
+def fill(db: MultiUserDatabase, user_id: str, count: int, seed: int):
+    shifts=[{
+        "date": date.fromisoformat(day), "start_time": start_time, "end_time": end_time,
+        "role": role, "program": program, "salary": salary
+    } for day, start_time, end_time, role, program, salary in synthetic_rows(count, seed)]
+    db.add_shifts_batch(user_id, shifts)
+
+
+def measure(fn, repeat: int) -> float:
+    timings=[]
+    for _ in range(repeat):
+        started=time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser=argparse.ArgumentParser(description="Замер запросов статистики с бюджетами времени ответа")
+    parser.add_argument("--shifts", type=int, default=20_000, help="смен у измеряемого пользователя")
+    parser.add_argument("--users", type=int, default=20, help="соседей по базе")
+    parser.add_argument("--neighbour-shifts", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args=parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db=MultiUserDatabase(os.path.join(tmp, "bench.db"))
+        for i in range(args.users):
+            fill(db, f"neighbour-{i}", args.neighbour_shifts, seed=i + 2)
+        fill(db, "bench", args.shifts, seed=1)
+
+        checks={
+            "get_user_statistics": lambda: db.get_user_statistics("bench"),
+            "get_statistics_trends": lambda: db.get_statistics_trends("bench"),
+            "get_month_summary": lambda: db.get_month_summary("bench"),
+        }
+        failed=False
+        print(f"Смен у пользователя: {args.shifts}, соседей: {args.users} по {args.neighbour_shifts}")
+        for name, fn in checks.items():
+            elapsed=measure(fn, args.repeat)
+            budget=BUDGETS_MS[name]
+            status="ok" if elapsed<=budget else "ПРЕВЫШЕН"
+            failed|=elapsed>budget
+            print(f"{name}: {elapsed:.1f} мс (бюджет {budget} мс) {status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,35 @@
 # bot_multiuser.py - Бот с поддержкой множества пользователей
 import logging
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, RetryAfter
+from telegram.helpers import escape_markdown
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ConversationHandler, ContextTypes, \
-    CallbackQueryHandler
-from database import MultiUserDatabase  # Импортируем новую БД
+    CallbackQueryHandler, TypeHandler
+from database import MultiUserDatabase, ShiftOverlapError  # Импортируем новую БД
+from cache import VersionedCache
+from exporters import EXPORT_FORMATS, build_export
+from edit_coalescer import EditCoalescer
+from message_cleaner import MessageCleaner
+import ingress
+from update_processor import PerChatUpdateProcessor
+from sqlite_persistence import SQLitePersistence
+from idle_sweeper import CONVERSATION_TIMEOUT, IdleSweeper
+from reminders import ReminderScheduler
+from digest import MonthlyDigest, previous_month
+from analytics import NO_PROGRAM, ShiftColumns, analyze, shift_minutes
+from rate_gateway import FloodGateway, HTTP_POOL_SIZE, HTTP_POOL_TIMEOUT, PRIORITY_BACKGROUND
+from flow_metrics import CountingRequest, bind_flow, finish_flow, start_flow
 from datetime import datetime, date, timedelta
-import json
+import difflib
 import os
 import re
+import time
 from config import TELEGRAM_TOKEN
 
 # Инициализация базы данных
 DB_PATH=os.getenv("DATABASE_PATH", "shifts.db")
+# Режим кнопки "Начать смену": classic — диалог с reply-клавиатурой, inline — мастер в одном сообщении
+SHIFT_ENTRY_MODE=os.getenv("SHIFT_ENTRY_MODE", "classic")
 db=MultiUserDatabase(DB_PATH)
 
 # ====== Настройка логирования ======
@@ -21,6 +39,12 @@ logging.basicConfig(
 )
 logger=logging.getLogger(__name__)
 
+# Удаление служебных сообщений в фоне и склейка частых правок при вводе с цифровой клавиатуры
+cleaner=MessageCleaner(rate_limit_args=PRIORITY_BACKGROUND)
+edits=EditCoalescer(cleaner)
+# Частые роли и программы пользователя; запись устаревает с новой ревизией его смен
+suggestion_cache=VersionedCache(max_entries=int(os.getenv("SUGGESTION_CACHE_SIZE", "4096")))
+
 # ====== Константы ======
 EMOJI={
     "date": "🗓️",
@@ -80,6 +104,17 @@ SKIP_BUTTON=["Пропустить"]
 CANCEL_BUTTON=["❌ Отмена"]
 SKIP_AND_CANCEL=["Пропустить", "❌ Отмена"]
 
+MONTH_NAMES={
+    1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
+    5: "Май", 6: "Июнь", 7: "Июль", 8: "Август",
+    9: "Сентябрь", 10: "Октябрь", 11: "Ноябрь", 12: "Декабрь"
+}
+
+# Сколько смен показывать на одной странице просмотра
+SHIFTS_PAGE_SIZE=5
+
+REPEAT_BUTTON="🔁 Как в прошлый раз"
+
 
 # ====== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ======
 
@@ -163,7 +198,11 @@ def format_shift_display(shift):
         lines.append(f"{EMOJI['program']} {shift['program']}")
 
     if shift.get("start_time") and shift.get("end_time"):
-        lines.append(f"{EMOJI['time']} {shift['start_time']}–{shift['end_time']}")
+        line=f"{EMOJI['time']} {shift['start_time']}–{shift['end_time']}"
+        minutes=shift_minutes(shift["start_time"], shift["end_time"])
+        if minutes:
+            line+=f" ({format_minutes(minutes)})"
+        lines.append(line)
     elif shift.get("start_time"):
         lines.append(f"{EMOJI['time']} с {shift['start_time']}")
     elif shift.get("end_time"):
@@ -178,12 +217,32 @@ def format_shift_display(shift):
 def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
     """Главное меню с новой кнопкой профиля"""
     return ReplyKeyboardMarkup([
-        ["Начать смену", "Мои смены"],
-        ["Экспорт данных", "Статистика"],
-        ["👤 Профиль", "Помощь"]
+        ["Начать смену", REPEAT_BUTTON],
+        ["Мои смены", "Экспорт данных"],
+        ["Статистика", "👤 Профиль"],
+        ["Помощь"]
     ], resize_keyboard=True)
 
 
+def ranked_labels(labels, ranked):
+    """Сначала частые значения пользователя (в том числе свои варианты), затем остальные"""
+    return list(ranked) + [label for label in labels if label not in ranked]
+
+
+def ranked_keyboard(static_rows, ranked, per_row: int = 3):
+    """Клавиатура выбора с частыми значениями пользователя наверху.
+
+    static_rows — ROLE_BUTTONS или PROGRAM_BUTTONS; служебные кнопки
+    ("СВОЙ ВАРИАНТ", "Пропустить", "❌ Отмена") остаются внизу.
+    """
+    service=("СВОЙ ВАРИАНТ", "Пропустить", "❌ Отмена")
+    labels=ranked_labels([b for row in static_rows for b in row if b not in service], ranked)
+    rows=[labels[i:i + per_row] for i in range(0, len(labels), per_row)]
+    rows.append(["СВОЙ ВАРИАНТ"])
+    rows.append(["Пропустить", "❌ Отмена"])
+    return rows
+
+
 # ====== НОВЫЕ ФУНКЦИИ ДЛЯ РАБОТЫ С ПОЛЬЗОВАТЕЛЯМИ ======
 
 async def ensure_user_exists(update: Update) -> str:
@@ -204,6 +263,14 @@ async def ensure_user_exists(update: Update) -> str:
         return user['user_id']
 
 
+async def get_suggestions(update: Update) -> dict:
+    """Частые роли, программы и последняя смена пользователя (через кэш)"""
+    user_id=await ensure_user_exists(update)
+    return suggestion_cache.get_or_compute(
+        user_id, db.get_user_version(user_id), lambda: db.get_shift_suggestions(user_id)
+    )
+
+
 # ====== ОСНОВНЫЕ ОБРАБОТЧИКИ ======
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -272,7 +339,8 @@ _Нажми на токен чтобы скопировать_
     # Кнопки для дополнительных действий
     buttons=InlineKeyboardMarkup([
         [InlineKeyboardButton("🔄 Сгенерировать новый токен", callback_data="regenerate_token")],
-        [InlineKeyboardButton("📊 Подробная статистика", callback_data="detailed_stats")]
+        [InlineKeyboardButton("📊 Подробная статистика", callback_data="detailed_stats")],
+        [InlineKeyboardButton("⏰ Напоминания о сменах", callback_data="rem|show")]
     ])
 
     await update.message.reply_text(
@@ -282,6 +350,56 @@ _Нажми на токен чтобы скопировать_
     )
 
 
+# Тренды статистики: (пользователь, день) -> окна, год к году, программы; сбрасывается с новой ревизией
+trends_cache=VersionedCache(max_entries=int(os.getenv("TRENDS_CACHE_SIZE", "4096")))
+
+
+def get_statistics_trends(user_id: str) -> dict:
+    # Окна отсчитываются от сегодняшнего дня, поэтому день входит в ключ
+    today=date.today()
+    return trends_cache.get_or_compute((user_id, today), db.get_user_version(user_id),
+                                       lambda: db.get_statistics_trends(user_id, today))
+
+
+def format_month_key(month: str) -> str:
+    """'2026-10' -> 'Октябрь 2026'"""
+    year, month=month.split("-")
+    return f"{MONTH_NAMES[int(month)]} {year}"
+
+
+def render_trends(trends: dict, months: int = 3, programs: int = 3) -> str:
+    """Скользящие окна, месяцы год к году и лучший/худший месяц программ (Markdown)"""
+    text=""
+    if any(window["count"] or window["prev_count"] for window in trends["windows"]):
+        text+="\n\n*Последние дни* (в скобках — к предыдущему такому же периоду):"
+        for window in trends["windows"]:
+            text+=(f"\n• {window['days']} дн.: смен {window['count']}"
+                   f"{format_change(window['count'], window['prev_count'])}, "
+                   f"{format_amount(window['salary'])} ₽"
+                   f"{format_change(window['salary'], window['prev_salary'], format_amount, ' ₽')}")
+
+    if trends["year_over_year"]:
+        text+="\n\n*Год к году:*"
+        for row in trends["year_over_year"][:months]:
+            text+=f"\n• {format_month_key(row['month'])}: смен {row['count']}, {format_amount(row['salary'])} ₽"
+            if row["prev_count"]:
+                text+=(f" — год назад смен {row['prev_count']}, {format_amount(row['prev_salary'])} ₽"
+                       f"{format_change(row['salary'], row['prev_salary'], format_amount, ' ₽')}")
+            else:
+                text+=" — год назад смен не было"
+
+    if trends["programs"]:
+        text+="\n\n*Программы — лучший и худший месяц:*"
+        for row in trends["programs"][:programs]:
+            best=row["best"]
+            text+=(f"\n• {escape_markdown(row['program'] or NO_PROGRAM)}: "
+                   f"{format_month_key(best['month'])} — {format_amount(best['salary'])} ₽")
+            if row["worst"]:
+                worst=row["worst"]
+                text+=f" / {format_month_key(worst['month'])} — {format_amount(worst['salary'])} ₽"
+    return text
+
+
 async def statistics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать статистику пользователя"""
     user_id=await ensure_user_exists(update)
@@ -311,13 +429,83 @@ async def statistics_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         month_name=month_names.get(month, month)
         stats_text+=f"\n• {month_name} {year}: {month_stat['count']} смен, {month_stat['salary']:,} ₽"
 
+    stats_text=stats_text.replace(",", " ") + render_trends(get_statistics_trends(user_id))
+    stats_text+="\n\nЧасы и ставка в час: /analytics"
+
     await update.message.reply_text(
-        stats_text.replace(",", " "),
+        stats_text,
         parse_mode='Markdown',
         reply_markup=get_main_menu_keyboard()
     )
 
 
+# Сколько строк показывать в каждом разрезе /analytics
+ANALYTICS_TOP=5
+
+
+def format_analytics_row(title: str, row: dict) -> str:
+    line=f"• {title} — смен: {row['count']}"
+    if row["hours"]:
+        line+=f", {row['hours']:g} ч"
+    line+=f", {format_amount(row['salary'])} ₽"
+    if row["hourly_rate"]:
+        line+=f", {format_amount(row['hourly_rate'])} ₽/ч"
+    return line
+
+
+def render_analytics(result: dict, title: str) -> str:
+    """Текст /analytics: итого, ставка и разрезы"""
+    total=result["total"]
+    lines=[f"📈 Аналитика заработка — {title}", "",
+           f"Смен: {total['count']}, часов: {total['hours']:g}",
+           f"Заработок: {format_amount(total['salary'])} ₽"]
+    if total["hourly_rate"]:
+        lines.append(f"Средняя ставка: {format_amount(total['hourly_rate'])} ₽/ч")
+
+    sections=[
+        ("По ролям", [(row["role"], row) for row in result["by_role"][:ANALYTICS_TOP]]),
+        ("По программам", [(row["program"], row) for row in result["by_program"][:ANALYTICS_TOP]]),
+        ("По месяцам", [(f"{MONTH_NAMES[int(row['month'][5:])]} {row['month'][:4]}", row)
+                        for row in result["by_month"][-ANALYTICS_TOP:]]),
+        ("По дням недели", [(row["weekday"], row) for row in result["by_weekday"] if row["count"]])
+    ]
+    for name, rows in sections:
+        if rows:
+            lines+=["", f"{name}:"] + [format_analytics_row(label, row) for label, row in rows]
+
+    lines+=["", "Ставка считается по сменам, где указаны время и гонорар; смены через полночь учитываются."]
+    return "\n".join(lines)
+
+
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /analytics [год] — часы, ставка в час и разрезы заработка"""
+    try:
+        user_id=await ensure_user_exists(update)
+        date_from=date_to=None
+        title="за все время"
+        if context.args:
+            if not re.fullmatch(r"20\d\d", context.args[0]):
+                await update.message.reply_text(f"{EMOJI['warning']} Укажи год, например: /analytics 2025")
+                return
+            year=int(context.args[0])
+            date_from, date_to, title=date(year, 1, 1), date(year, 12, 31), f"{year} год"
+
+        result=analyze(ShiftColumns.from_rows(db.get_shift_rows(user_id, date_from, date_to)))
+        if not result["total"]["count"]:
+            await update.message.reply_text(f"{EMOJI['info']} Нет смен за этот период.",
+                                            reply_markup=get_main_menu_keyboard())
+            return
+
+        await update.message.reply_text(render_analytics(result, title), reply_markup=get_main_menu_keyboard())
+
+    except Exception as e:
+        logger.error(f"Ошибка в analytics_command: {e}")
+        await update.message.reply_text(
+            f"{EMOJI['warning']} Произошла ошибка.",
+            reply_markup=get_main_menu_keyboard()
+        )
+
+
 # ====== ОБРАБОТЧИКИ СОЗДАНИЯ СМЕНЫ ======
 
 async def start_shift_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -326,6 +514,12 @@ async def start_shift_creation(update: Update, context: ContextTypes.DEFAULT_TYP
         await cleanup_messages(update, context)
         context.user_data.clear()
 
+        if SHIFT_ENTRY_MODE == "inline":
+            start_flow(context.user_data, "inline")
+            await start_shift_wizard(update, context)
+            return ConversationHandler.END
+
+        start_flow(context.user_data, "classic")
         date_buttons=[
             ["Сегодня", "Завтра"],
             ["Послезавтра", "Вчера"],
@@ -413,9 +607,10 @@ async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         context.user_data["date"]=selected_date
 
+        suggestions=await get_suggestions(update)
         msg=await update.message.reply_text(
             f"{EMOJI['role']} Выбери роль:",
-            reply_markup=ReplyKeyboardMarkup(ROLE_BUTTONS, resize_keyboard=True)
+            reply_markup=ReplyKeyboardMarkup(ranked_keyboard(ROLE_BUTTONS, suggestions["role"]), resize_keyboard=True)
         )
         context.user_data["to_delete"].append(msg.message_id)
         return SELECT_ROLE
@@ -439,9 +634,11 @@ async def select_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         context.user_data["role"]=None if role.lower() == "пропустить" else role
 
+        suggestions=await get_suggestions(update)
         msg=await update.message.reply_text(
             f"{EMOJI['program']} Выбери программу:",
-            reply_markup=ReplyKeyboardMarkup(PROGRAM_BUTTONS, resize_keyboard=True)
+            reply_markup=ReplyKeyboardMarkup(ranked_keyboard(PROGRAM_BUTTONS, suggestions["program"]),
+                                             resize_keyboard=True)
         )
         context.user_data["to_delete"].append(msg.message_id)
         return SELECT_PROGRAM
@@ -502,8 +699,8 @@ async def handle_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if "❌" in char or "отмена" in char:
             return await cancel(update, context)
 
-        # Удаляем сообщение пользователя для чистоты интерфейса
-        await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
+        # Удаляем сообщение пользователя для чистоты интерфейса (пакетом)
+        edits.delete(context.bot, update.effective_chat.id, update.message.message_id)
 
         if char == "пропустить":
             return await skip_time_input(update, context, typing_type)
@@ -588,6 +785,19 @@ async def prompt_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return TYPING_SALARY
 
 
+def update_salary_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Обновить сообщение с гонораром (частые нажатия склеиваются в одну правку)"""
+    if "salary_message_id" in context.user_data:
+        edits.edit(context.bot, update.effective_chat.id, context.user_data["salary_message_id"], text)
+
+
+def drop_salary_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удалить нажатие пользователя и сообщение с гонораром одним пакетом"""
+    edits.delete(context.bot, update.effective_chat.id, update.message.message_id)
+    if "salary_message_id" in context.user_data:
+        edits.delete(context.bot, update.effective_chat.id, context.user_data.pop("salary_message_id"))
+
+
 async def enter_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода зарплаты"""
     try:
@@ -595,134 +805,59 @@ async def enter_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Проверка на отмену
         if "❌" in text or "отмена" in text:
-            # Удаляем сообщение пользователя
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-            # Удаляем сообщение с инструкцией если есть
-            if "salary_message_id" in context.user_data:
-                await safe_delete_message(context, update.effective_chat.id, context.user_data["salary_message_id"])
+            drop_salary_messages(update, context)
             return await cancel(update, context)
 
-        # НЕ удаляем сообщение пользователя до подтверждения
-
         if text == "пропустить":
-            # Удаляем сообщения при пропуске
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-            if "salary_message_id" in context.user_data:
-                await safe_delete_message(context, update.effective_chat.id, context.user_data["salary_message_id"])
+            drop_salary_messages(update, context)
             context.user_data["salary"]=None
             return await save_shift_data(update, context)
 
+        # Нажатие цифровой клавиатуры удаляем сразу (пакетом), а сообщение
+        # с суммой правим с задержкой — в Telegram уходит только итог серии
+        edits.delete(context.bot, update.effective_chat.id, update.message.message_id)
+
         if text == "очистить":
-            # Очищаем буфер
             context.user_data["salary_buffer"]=""
-            # Удаляем сообщение с командой очистки
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-            # Обновляем основное сообщение
-            if "salary_message_id" in context.user_data:
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=update.effective_chat.id,
-                        message_id=context.user_data["salary_message_id"],
-                        text=f"{EMOJI['salary']} Введи гонорар в рублях:\n"
-                             "Используй цифровую клавиатуру"
-                    )
-                except:
-                    pass
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['salary']} Введи гонорар в рублях:\n"
+                                 "Используй цифровую клавиатуру")
             return TYPING_SALARY
 
         if text == "подтвердить":
             # Обрабатываем накопленный буфер
             buffer_value=context.user_data.get("salary_buffer", "")
-            if buffer_value:
-                try:
-                    value=int(buffer_value)
-                    if value<0:
-                        # Удаляем сообщение с подтверждением
-                        await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                        # Обновляем сообщение с ошибкой
-                        if "salary_message_id" in context.user_data:
-                            try:
-                                await context.bot.edit_message_text(
-                                    chat_id=update.effective_chat.id,
-                                    message_id=context.user_data["salary_message_id"],
-                                    text=f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
-                                         "Введите новую сумму:"
-                                )
-                            except:
-                                pass
-                        context.user_data["salary_buffer"]=""
-                        return TYPING_SALARY
-
-                    # Удаляем все сообщения при успешном подтверждении
-                    await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-                    if "salary_message_id" in context.user_data:
-                        await safe_delete_message(context, update.effective_chat.id,
-                                                  context.user_data["salary_message_id"])
-
-                    context.user_data["salary"]=value
-                    return await save_shift_data(update, context)
-                except ValueError:
-                    # Удаляем сообщение с подтверждением
-                    await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                    # Обновляем сообщение с ошибкой
-                    if "salary_message_id" in context.user_data:
-                        try:
-                            await context.bot.edit_message_text(
-                                chat_id=update.effective_chat.id,
-                                message_id=context.user_data["salary_message_id"],
-                                text=f"{EMOJI['warning']} Неверный формат суммы.\n"
-                                     "Введите число:"
-                            )
-                        except:
-                            pass
-                    context.user_data["salary_buffer"]=""
-                    return TYPING_SALARY
-            else:
-                # Удаляем сообщение с подтверждением
-                await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                # Обновляем сообщение
-                if "salary_message_id" in context.user_data:
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=update.effective_chat.id,
-                            message_id=context.user_data["salary_message_id"],
-                            text=f"{EMOJI['warning']} Введите сумму или нажмите 'Пропустить'."
-                        )
-                    except:
-                        pass
+            if not buffer_value:
+                update_salary_prompt(update, context,
+                                     f"{EMOJI['warning']} Введите сумму или нажмите 'Пропустить'.")
                 return TYPING_SALARY
 
-        # Если это цифры или точка - добавляем к буферу
-        if text in ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "."]:
-            if "salary_buffer" not in context.user_data:
+            try:
+                value=int(buffer_value)
+            except ValueError:
+                update_salary_prompt(update, context,
+                                     f"{EMOJI['warning']} Неверный формат суммы.\n"
+                                     "Введите число:")
                 context.user_data["salary_buffer"]=""
+                return TYPING_SALARY
 
-            # Удаляем сообщение с цифрой
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
+            if value<0:
+                update_salary_prompt(update, context,
+                                     f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
+                                     "Введите новую сумму:")
+                context.user_data["salary_buffer"]=""
+                return TYPING_SALARY
 
-            context.user_data["salary_buffer"]+=text
+            drop_salary_messages(update, context)
+            context.user_data["salary"]=value
+            return await save_shift_data(update, context)
 
-            # Обновляем основное сообщение с текущей суммой
-            current_value=context.user_data["salary_buffer"]
-            if "salary_message_id" in context.user_data:
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=update.effective_chat.id,
-                        message_id=context.user_data["salary_message_id"],
-                        text=f"{EMOJI['salary']} Текущая сумма: {current_value} ₽\n"
-                             f"Нажмите 'Подтвердить' для сохранения"
-                    )
-                except:
-                    # Если не удалось отредактировать, отправляем новое
-                    msg=await update.message.reply_text(
-                        f"{EMOJI['salary']} Текущая сумма: {current_value} ₽\n"
-                        f"Нажмите 'Подтвердить' для сохранения"
-                    )
-                    context.user_data["salary_message_id"]=msg.message_id
+        # Если это цифры или точка - добавляем к буферу
+        if text in ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "."]:
+            context.user_data["salary_buffer"]=context.user_data.get("salary_buffer", "") + text
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['salary']} Текущая сумма: {context.user_data['salary_buffer']} ₽\n"
+                                 f"Нажмите 'Подтвердить' для сохранения")
             return TYPING_SALARY
 
         # Если это не команда и не цифра, пробуем обработать как обычный ввод
@@ -730,48 +865,21 @@ async def enter_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Убираем все кроме цифр и точки/запятой
             cleaned_text=re.sub(r'[^\d.,]', '', text)
             value=float(cleaned_text.replace(",", "."))
-
-            if value<0:
-                # Удаляем сообщение пользователя
-                await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                # Обновляем основное сообщение
-                if "salary_message_id" in context.user_data:
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=update.effective_chat.id,
-                            message_id=context.user_data["salary_message_id"],
-                            text=f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
-                                 "Используйте цифровую клавиатуру"
-                        )
-                    except:
-                        pass
-                return TYPING_SALARY
-
-            # Удаляем сообщения при успешном вводе
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-            if "salary_message_id" in context.user_data:
-                await safe_delete_message(context, update.effective_chat.id, context.user_data["salary_message_id"])
-
-            context.user_data["salary"]=int(value)
-            return await save_shift_data(update, context)
-
         except ValueError:
-            # Удаляем сообщение пользователя
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['warning']} Используйте цифровую клавиатуру или введите число.")
+            return TYPING_SALARY
 
-            # Обновляем основное сообщение
-            if "salary_message_id" in context.user_data:
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=update.effective_chat.id,
-                        message_id=context.user_data["salary_message_id"],
-                        text=f"{EMOJI['warning']} Используйте цифровую клавиатуру или введите число."
-                    )
-                except:
-                    pass
+        if value<0:
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
+                                 "Используйте цифровую клавиатуру")
             return TYPING_SALARY
 
+        drop_salary_messages(update, context)
+        context.user_data["salary"]=int(value)
+        return await save_shift_data(update, context)
+
     except Exception as e:
         logger.error(f"Ошибка в enter_salary: {e}")
         await update.message.reply_text(
@@ -795,7 +903,17 @@ async def save_shift_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "salary": context.user_data.get("salary"),
         }
 
-        if db.add_shift(user_id, shift_data):
+        try:
+            added=db.add_shift(user_id, shift_data)
+        except ShiftOverlapError as e:
+            await update.message.reply_text(format_shift_display(shift_data), reply_markup=get_main_menu_keyboard())
+            text, markup=render_overlap_prompt(e.conflict, can_merge=True)
+            msg=await update.message.reply_text(text, reply_markup=markup)
+            context.user_data["overlap"]={"action": "add", "shift": shift_data, "conflict_id": e.conflict["id"],
+                                          "message_id": msg.message_id}
+            return ConversationHandler.END
+
+        if added:
             # Показываем смену
             formatted_text=format_shift_display(shift_data)
             await update.message.reply_text(formatted_text)
@@ -804,6 +922,7 @@ async def save_shift_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"{EMOJI['success']} Смена успешно добавлена!",
                 reply_markup=get_main_menu_keyboard()
             )
+            finish_flow(context.user_data)
         else:
             await update.message.reply_text(
                 f"{EMOJI['warning']} Ошибка при сохранении смены. Попробуйте еще раз.",
@@ -821,134 +940,984 @@ async def save_shift_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
 
-# ====== ОБРАБОТЧИКИ ПРОСМОТРА СМЕН ======
+# ====== ПЕРЕСЕЧЕНИЯ СМЕН ======
 
-async def list_shifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать меню выбора месяца для просмотра смен"""
+def render_overlap_prompt(conflict: dict, can_merge: bool):
+    """Текст и кнопки: смена пересекается с уже сохраненной"""
+    text=(f"{EMOJI['warning']} Смена пересекается по времени с уже сохраненной:\n\n"
+          f"{format_shift_display(conflict)}\n\nЧто сделать?")
+    buttons=[InlineKeyboardButton("💾 Сохранить обе", callback_data="ov|keep")]
+    if can_merge:
+        buttons.insert(0, InlineKeyboardButton("🔗 Объединить", callback_data="ov|merge"))
+    return text, InlineKeyboardMarkup([buttons, [InlineKeyboardButton("❌ Отмена", callback_data="ov|cancel")]])
+
+
+async def overlap_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Решение по пересечению: ov|merge — объединить, ov|keep — сохранить все равно, ov|cancel"""
+    query=update.callback_query
     try:
-        # Создаем кнопки для месяцев
-        month_buttons=InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("Январь", callback_data="month_1"),
-                InlineKeyboardButton("Февраль", callback_data="month_2"),
-                InlineKeyboardButton("Март", callback_data="month_3")
-            ],
-            [
-                InlineKeyboardButton("Апрель", callback_data="month_4"),
-                InlineKeyboardButton("Май", callback_data="month_5"),
-                InlineKeyboardButton("Июнь", callback_data="month_6")
-            ],
-            [
-                InlineKeyboardButton("Июль", callback_data="month_7"),
-                InlineKeyboardButton("Август", callback_data="month_8"),
-                InlineKeyboardButton("Сентябрь", callback_data="month_9")
-            ],
-            [
-                InlineKeyboardButton("Октябрь", callback_data="month_10"),
-                InlineKeyboardButton("Ноябрь", callback_data="month_11"),
-                InlineKeyboardButton("Декабрь", callback_data="month_12")
-            ],
-            [
-                InlineKeyboardButton("Все смены", callback_data="month_all")
-            ]
+        overlap=context.user_data.get("overlap")
+        if not overlap or overlap["message_id"] != query.message.message_id:
+            await query.answer("Это решение уже принято.")
+            return
+        await query.answer()
+        user_id=await ensure_user_exists(update)
+        action=query.data.split("|")[1]
+        context.user_data.pop("overlap", None)
+
+        if overlap["action"] == "bulk":
+            # Групповое изменение из списка смен: ответ — та же страница
+            message_id=query.message.message_id
+            view=context.user_data.get("page_views", {}).get(message_id)
+            if action == "cancel":
+                context.user_data["selection"]=overlap["selection"]
+                notice=f"{EMOJI['cancel']} Изменение отменено."
+            else:
+                notice=apply_bulk_edit(context.user_data, user_id, message_id, overlap["field"],
+                                       overlap["values"], allow_overlap=True)
+            if view:
+                await render_shifts_page(context, query.message.chat_id, message_id, user_id, *view, notice=notice)
+            else:
+                await query.edit_message_text(notice)
+            return
+
+        if action == "cancel":
+            text=f"{EMOJI['cancel']} Смена не сохранена." if overlap["action"] == "add" \
+                else f"{EMOJI['cancel']} Изменение отменено."
+            context.user_data.pop("flow", None)
+        elif overlap["action"] == "edit":
+            if db.update_shift(user_id, overlap["shift_id"], overlap["field"], overlap["value"], allow_overlap=True):
+                text=f"{EMOJI['success']} Поле обновлено!"
+            else:
+                text=f"{EMOJI['warning']} Ошибка при обновлении."
+        elif action == "merge":
+            try:
+                merged=db.merge_shift(user_id, overlap["conflict_id"], overlap["shift"])
+            except ShiftOverlapError as e:
+                # Объединенная смена задела еще одну: остается сохранить обе или отменить
+                text, markup=render_overlap_prompt(e.conflict, can_merge=False)
+                await query.edit_message_text(text, reply_markup=markup)
+                context.user_data["overlap"]=overlap
+                return
+            if merged:
+                text=f"{format_shift_display(merged)}\n\n{EMOJI['success']} Смены объединены!"
+                finish_flow(context.user_data)
+            else:
+                text=f"{EMOJI['warning']} Не удалось объединить смены: сохраненная смена не найдена."
+        elif db.add_shift(user_id, overlap["shift"], allow_overlap=True):
+            text=f"{format_shift_display(overlap['shift'])}\n\n{EMOJI['success']} Смена успешно добавлена!"
+            finish_flow(context.user_data)
+        else:
+            text=f"{EMOJI['warning']} Ошибка при сохранении смены. Попробуйте еще раз."
+
+        await query.edit_message_text(text)
+        logger.info(f"Пользователь {user_id}: пересечение смен, решение {action}")
+
+    except Exception as e:
+        logger.error(f"Ошибка в overlap_callback: {e}")
+        await query.answer(f"{EMOJI['warning']} Произошла ошибка.")
+
+
+# ====== МАСТЕР ДОБАВЛЕНИЯ СМЕНЫ В ОДНОМ СООБЩЕНИИ ======
+
+WIZARD_STEPS=["date", "role", "program", "start", "end", "salary", "confirm"]
+WIZARD_FIELDS={"date": "date", "role": "role", "program": "program",
+               "start": "start_time", "end": "end_time", "salary": "salary"}
+WIZARD_ROLES=[b for row in ROLE_BUTTONS for b in row if b not in ("Пропустить", "❌ Отмена", "СВОЙ ВАРИАНТ")]
+WIZARD_PROGRAMS=[b for row in PROGRAM_BUTTONS for b in row if b not in ("Пропустить", "❌ Отмена", "СВОЙ ВАРИАНТ")]
+WIZARD_PROMPTS={
+    "date": f"{EMOJI['date']} Выбери дату смены:",
+    "date_custom": f"{EMOJI['date']} Набери дату (ДДММ): ",
+    "role": f"{EMOJI['role']} Выбери роль:",
+    "program": f"{EMOJI['program']} Выбери программу:",
+    "start": f"{EMOJI['time']} Время начала (ЧЧММ): ",
+    "end": f"{EMOJI['time']} Время окончания (ЧЧММ): ",
+    "salary": f"{EMOJI['salary']} Гонорар: ",
+    "confirm": f"{EMOJI['info']} Проверь смену и сохрани:",
+}
+# Поля, которые можно поправить прямо с шага подтверждения
+WIZARD_EDIT_STEPS=["date", "role", "program", "start", "end", "salary"]
+WIZARD_EDIT_LABELS=["Дата", "Роль", "Программа", "Начало", "Конец", "Гонорар"]
+
+
+def wizard_button_rows(labels, prefix: str, per_row: int = 3):
+    """Кнопки выбора из списка; в callback_data только индекс (лимит 64 байта)"""
+    buttons=[InlineKeyboardButton(label, callback_data=f"wz|{prefix}|{i}") for i, label in enumerate(labels)]
+    return [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
+
+
+def wizard_numpad_rows():
+    rows=[[InlineKeyboardButton(d, callback_data=f"wz|key|{d}") for d in digits]
+          for digits in (("1", "2", "3"), ("4", "5", "6"), ("7", "8", "9"))]
+    rows.append([
+        InlineKeyboardButton("⌫", callback_data="wz|key|del"),
+        InlineKeyboardButton("0", callback_data="wz|key|0"),
+        InlineKeyboardButton("OK", callback_data="wz|ok"),
+    ])
+    return rows
+
+
+def render_wizard(wizard: dict):
+    """Текст и клавиатура мастера для текущего шага"""
+    step=wizard["step"]
+    summary=format_shift_display(wizard["shift"])
+    lines=[summary] if summary else []
+
+    if wizard.get("error"):
+        lines.append(f"{EMOJI['warning']} {wizard['error']}")
+
+    typing_text=wizard.get("custom") and step in ("role", "program")
+    numpad=step in ("start", "end", "salary") or (step == "date" and wizard.get("custom"))
+
+    prompt=WIZARD_PROMPTS["date_custom" if step == "date" and wizard.get("custom") else step]
+    if numpad:
+        prompt+=wizard.get("buffer") or "_"
+    lines.append(prompt)
+    if wizard.get("autosave") and step == "date":
+        lines.append(f"{EMOJI['info']} Смена сохранится сразу после выбора даты")
+    if typing_text:
+        lines.append(f"{EMOJI['info']} Напиши свой вариант сообщением")
+
+    rows=[]
+    if numpad:
+        rows.extend(wizard_numpad_rows())
+    elif typing_text:
+        pass
+    elif step == "date":
+        today=date.today()
+        rows.append([
+            InlineKeyboardButton("Вчера", callback_data=f"wz|date|{(today - timedelta(days=1)).isoformat()}"),
+            InlineKeyboardButton("Сегодня", callback_data=f"wz|date|{today.isoformat()}"),
+            InlineKeyboardButton("Завтра", callback_data=f"wz|date|{(today + timedelta(days=1)).isoformat()}"),
+        ])
+        rows.append([
+            InlineKeyboardButton((today + timedelta(days=i)).strftime("%d.%m"),
+                                 callback_data=f"wz|date|{(today + timedelta(days=i)).isoformat()}")
+            for i in range(2, 6)
+        ])
+        rows.append([InlineKeyboardButton("Своя дата", callback_data="wz|date|custom")])
+    elif step == "role":
+        rows.extend(wizard_button_rows(wizard.get("roles", WIZARD_ROLES), "role"))
+        rows.append([InlineKeyboardButton("Свой вариант", callback_data="wz|role|custom")])
+    elif step == "program":
+        rows.extend(wizard_button_rows(wizard.get("programs", WIZARD_PROGRAMS), "prog"))
+        rows.append([InlineKeyboardButton("Свой вариант", callback_data="wz|prog|custom")])
+    elif step == "confirm" and wizard.get("editing"):
+        rows.extend(wizard_button_rows(WIZARD_EDIT_LABELS, "goto"))
+    elif step == "confirm":
+        rows.append([
+            InlineKeyboardButton(f"{EMOJI['success']} Сохранить", callback_data="wz|save"),
+            InlineKeyboardButton(f"{EMOJI['edit']} Изменить", callback_data="wz|edit"),
         ])
 
+    nav=[]
+    if step != "date" or wizard.get("custom"):
+        nav.append(InlineKeyboardButton("↩️ Назад", callback_data="wz|back"))
+    if step != "confirm":
+        nav.append(InlineKeyboardButton("Пропустить", callback_data="wz|skip"))
+    nav.append(InlineKeyboardButton(f"{EMOJI['cancel']} Отмена", callback_data="wz|cancel"))
+    rows.append(nav)
+
+    return "\n\n".join(lines), InlineKeyboardMarkup(rows)
+
+
+def wizard_advance(wizard: dict, step: str = None):
+    """Перейти к следующему (или указанному) шагу"""
+    if step is None and wizard.pop("jump_back", False):
+        step="confirm"  # Правка одного поля с шага подтверждения
+    wizard["step"]=step or WIZARD_STEPS[WIZARD_STEPS.index(wizard["step"]) + 1]
+    wizard["editing"]=False
+    wizard["buffer"]=""
+    wizard["custom"]=False
+    wizard["error"]=None
+
+
+def wizard_commit_buffer(wizard: dict) -> bool:
+    """Применить набранное на цифровой клавиатуре; False — ошибка ввода"""
+    step=wizard["step"]
+    buffer=wizard.get("buffer", "")
+
+    if step == "date":
+        try:
+            selected_date=date(datetime.now().year, int(buffer[2:4]), int(buffer[:2]))
+        except (ValueError, IndexError):
+            wizard["error"]="Неверная дата. Пример: 1503 для 15 марта"
+            wizard["buffer"]=""
+            return False
+        if not validate_date(selected_date):
+            wizard["error"]="Дата слишком далеко в прошлом или будущем."
+            wizard["buffer"]=""
+            return False
+        wizard["shift"]["date"]=selected_date
+        return True
+
+    if step in ("start", "end"):
+        time_str=clean_time_input(buffer)
+        if not time_str or not validate_time(time_str):
+            wizard["error"]="Неправильный формат времени. Пример: 1830"
+            wizard["buffer"]=""
+            return False
+        wizard["shift"][WIZARD_FIELDS[step]]=time_str
+        return True
+
+    if step == "salary":
+        if not buffer:
+            wizard["error"]="Введите сумму или нажмите 'Пропустить'."
+            return False
+        wizard["shift"]["salary"]=int(buffer)
+        return True
+
+    return True
+
+
+async def start_shift_wizard(update: Update, context: ContextTypes.DEFAULT_TYPE, wizard: dict = None):
+    """Начало ввода смены в одном сообщении с инлайн-кнопками.
+
+    wizard — уже заполненный мастер (например, из быстрого ввода)
+    """
+    try:
+        old=context.user_data.get("wizard")
+        if old:
+            edits.delete(context.bot, update.effective_chat.id, old["message_id"])
+
+        if wizard is None:
+            wizard={"step": "date", "shift": {}, "buffer": "", "custom": False, "error": None}
+        suggestions=await get_suggestions(update)
+        wizard["roles"]=ranked_labels(WIZARD_ROLES, suggestions["role"])
+        wizard["programs"]=ranked_labels(WIZARD_PROGRAMS, suggestions["program"])
+        text, markup=render_wizard(wizard)
+        msg=await update.message.reply_text(text, reply_markup=markup)
+        wizard["message_id"]=msg.message_id
+        context.user_data["wizard"]=wizard
+
+        logger.info(f"Пользователь {update.effective_user.id} начал добавление смены (мастер, шаг {wizard['step']})")
+
+    except Exception as e:
+        logger.error(f"Ошибка в start_shift_wizard: {e}")
         await update.message.reply_text(
-            f"{EMOJI['date']} Выбери месяц для просмотра смен:",
-            reply_markup=month_buttons
+            f"{EMOJI['warning']} Произошла ошибка. Попробуйте еще раз.",
+            reply_markup=get_main_menu_keyboard()
         )
 
+
+async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /add — мастер добавления смены в одном сообщении.
+
+    С аргументами (/add 1503 РЕЖ ЛЧ 1800-2300 10000) — быстрый ввод одной строкой
+    """
+    if context.args:
+        if not await quick_entry(update, context, " ".join(context.args)):
+            await update.message.reply_text(
+                f"{EMOJI['warning']} Не удалось разобрать смену. Пример: /add 1503 РЕЖ ЛЧ 1800-2300 10000",
+                reply_markup=get_main_menu_keyboard()
+            )
+        return
+
+    start_flow(context.user_data, "inline")
+    await start_shift_wizard(update, context)
+
+
+async def repeat_last_shift(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка "Как в прошлый раз" и /repeat: копия последней смены, осталось выбрать дату.
+
+    Два нажатия: кнопка меню и дата — смена сохраняется сразу.
+    """
+    try:
+        last=(await get_suggestions(update))["last"]
+        if not last:
+            await update.message.reply_text(
+                f"{EMOJI['info']} Смен пока нет — добавь первую через \"Начать смену\".",
+                reply_markup=get_main_menu_keyboard()
+            )
+            return
+
+        start_flow(context.user_data, "repeat")
+        shift={field: last.get(field) for field in ("role", "program", "start_time", "end_time", "salary")}
+        wizard={"step": "date", "shift": shift, "buffer": "", "custom": False, "error": None,
+                "jump_back": True, "autosave": True}
+        await start_shift_wizard(update, context, wizard)
+
     except Exception as e:
-        logger.error(f"Ошибка в list_shifts: {e}")
+        logger.error(f"Ошибка в repeat_last_shift: {e}")
         await update.message.reply_text(
-            "⚠️ Произошла ошибка при загрузке меню.",
+            f"{EMOJI['warning']} Произошла ошибка. Попробуйте еще раз.",
             reply_markup=get_main_menu_keyboard()
         )
 
 
-async def show_shifts_by_month(update: Update, context: ContextTypes.DEFAULT_TYPE, month: int = None):
-    """Показать смены за определенный месяц или все смены"""
+async def show_wizard(context: ContextTypes.DEFAULT_TYPE, chat_id: int, wizard: dict, coalesce: bool = False):
+    """Перерисовать мастер; нажатия цифровой клавиатуры склеиваются в одну правку"""
+    text, markup=render_wizard(wizard)
+    if coalesce:
+        edits.edit(context.bot, chat_id, wizard["message_id"], text, reply_markup=markup)
+        return
+
+    edits.discard(chat_id, wizard["message_id"])
     try:
-        query=update.callback_query
-        user_id=await ensure_user_exists(update)
-        shifts=db.get_user_shifts(user_id)
+        await context.bot.edit_message_text(text, chat_id=chat_id, message_id=wizard["message_id"],
+                                            reply_markup=markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
 
-        if not shifts:
-            await query.edit_message_text(
-                "У тебя пока нет смен.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("◀️ Назад к месяцам", callback_data="back_to_months")
-                ]])
-            )
+
+async def save_wizard_shift(update: Update, context: ContextTypes.DEFAULT_TYPE, wizard: dict):
+    """Сохранение смены из мастера; итог остается в том же сообщении"""
+    chat_id=update.effective_chat.id
+    user_id=await ensure_user_exists(update)
+    shift_data={field: wizard["shift"].get(field)
+                for field in ("date", "role", "program", "start_time", "end_time", "salary")}
+
+    edits.discard(chat_id, wizard["message_id"])
+    context.user_data.pop("wizard", None)
+    try:
+        added=db.add_shift(user_id, shift_data)
+    except ShiftOverlapError as e:
+        # Мастер закрывается, решение принимается в том же сообщении
+        text, markup=render_overlap_prompt(e.conflict, can_merge=True)
+        await context.bot.edit_message_text(text, chat_id=chat_id, message_id=wizard["message_id"], reply_markup=markup)
+        context.user_data["overlap"]={"action": "add", "shift": shift_data, "conflict_id": e.conflict["id"],
+                                      "message_id": wizard["message_id"]}
+        return
+
+    if added:
+        text=f"{format_shift_display(shift_data)}\n\n{EMOJI['success']} Смена успешно добавлена!"
+        finish_flow(context.user_data)
+    else:
+        text=f"{EMOJI['warning']} Ошибка при сохранении смены. Попробуйте еще раз."
+    await context.bot.edit_message_text(text, chat_id=chat_id, message_id=wizard["message_id"])
+
+
+async def wizard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Нажатия кнопок мастера: состояние в user_data, ответ — правка того же сообщения"""
+    query=update.callback_query
+    try:
+        wizard=context.user_data.get("wizard")
+        if not wizard or wizard["message_id"] != query.message.message_id:
+            await query.answer("Этот мастер уже закрыт.")
             return
+        await query.answer()
 
-        # Фильтруем смены по месяцу если нужно
-        if month is not None:
-            current_year=datetime.now().year
-            filtered_shifts=[]
-            for shift in shifts:
-                if shift.get("date") and shift["date"].month == month and shift["date"].year == current_year:
-                    filtered_shifts.append(shift)
-            shifts=filtered_shifts
-
-        # Сортируем смены: старые сверху, новые снизу
-        if shifts:
-            shifts.sort(key=lambda s: (
-                s.get("date") or date.min,  # Сначала по дате (старые сверху)
-                s.get("start_time") or "00:00"  # Потом по времени (раннее сверху)
-            ))
-
-        if not shifts:
-            month_names={
-                1: "январь", 2: "февраль", 3: "март", 4: "апрель",
-                5: "май", 6: "июнь", 7: "июль", 8: "август",
-                9: "сентябрь", 10: "октябрь", 11: "ноябрь", 12: "декабрь"
-            }
-            month_name=month_names.get(month, "выбранный месяц")
+        chat_id=update.effective_chat.id
+        parts=query.data.split("|")
+        action=parts[1]
+        value=parts[2] if len(parts)>2 else None
+        step=wizard["step"]
+        wizard["error"]=None
+
+        if action == "cancel":
+            edits.discard(chat_id, wizard["message_id"])
+            await query.edit_message_text(f"{EMOJI['cancel']} Операция отменена.")
+            context.user_data.pop("wizard", None)
+            context.user_data.pop("flow", None)
+            return
 
-            await query.edit_message_text(
-                f"У тебя нет смен за {month_name}.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("◀️ Назад к месяцам", callback_data="back_to_months")
-                ]])
-            )
+        if action == "save":
+            await save_wizard_shift(update, context, wizard)
             return
 
-        # Показываем заголовок
-        if month is not None:
-            month_names={
-                1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
-                5: "Май", 6: "Июнь", 7: "Июль", 8: "Август",
-                9: "Сентябрь", 10: "Октябрь", 11: "Ноябрь", 12: "Декабрь"
-            }
-            header=f"📅 Смены за {month_names[month]} {datetime.now().year}\n\n"
+        if action == "edit":
+            wizard["editing"]=True
+        elif action == "goto":
+            wizard_advance(wizard, WIZARD_EDIT_STEPS[int(value)])
+            wizard["jump_back"]=True
+        elif action == "back":
+            if wizard.get("editing"):
+                wizard["editing"]=False
+            elif wizard.get("custom"):
+                wizard_advance(wizard, step)
+            elif wizard.pop("jump_back", False):
+                wizard_advance(wizard, "confirm")
+            else:
+                wizard_advance(wizard, WIZARD_STEPS[max(WIZARD_STEPS.index(step) - 1, 0)])
+        elif action == "skip":
+            wizard["shift"][WIZARD_FIELDS[step]]=None
+            wizard_advance(wizard)
+        elif action == "date":
+            if value == "custom":
+                wizard["custom"]=True
+                wizard["buffer"]=""
+            else:
+                wizard["shift"]["date"]=date.fromisoformat(value)
+                wizard_advance(wizard)
+        elif action in ("role", "prog"):
+            if value == "custom":
+                wizard["custom"]=True
+            else:
+                labels=wizard.get("roles", WIZARD_ROLES) if action == "role" \
+                    else wizard.get("programs", WIZARD_PROGRAMS)
+                wizard["shift"][WIZARD_FIELDS[step]]=labels[int(value)]
+                wizard_advance(wizard)
+        elif action == "key":
+            if value == "del":
+                wizard["buffer"]=wizard.get("buffer", "")[:-1]
+            elif len(wizard.get("buffer", ""))<(7 if step == "salary" else 4):
+                wizard["buffer"]=wizard.get("buffer", "") + value
+            # Время и дата подтверждаются сами после 4 цифр
+            if step != "salary" and len(wizard["buffer"]) == 4 and wizard_commit_buffer(wizard):
+                wizard_advance(wizard)
+        elif action == "ok":
+            if wizard_commit_buffer(wizard):
+                wizard_advance(wizard)
+
+        # "Как в прошлый раз": все, кроме даты, уже заполнено
+        if wizard.get("autosave") and wizard["step"] == "confirm":
+            await save_wizard_shift(update, context, wizard)
+            return
+
+        # Цифры идут сериями — их правки склеиваются, остальные шаги сразу
+        await show_wizard(context, chat_id, wizard, coalesce=action == "key" and wizard["step"] == step)
+
+    except Exception as e:
+        logger.error(f"Ошибка в wizard_callback: {e}")
+        await query.answer(f"{EMOJI['warning']} Произошла ошибка.")
+
+
+async def wizard_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Свой вариант роли или программы, набранный сообщением"""
+    wizard=context.user_data["wizard"]
+    wizard["shift"][WIZARD_FIELDS[wizard["step"]]]=update.message.text.strip()
+    edits.delete(context.bot, update.effective_chat.id, update.message.message_id)
+    wizard_advance(wizard)
+    await show_wizard(context, update.effective_chat.id, wizard)
+
+
+# ====== БЫСТРЫЙ ВВОД ОДНОЙ СТРОКОЙ ======
+
+QUICK_DATE_WORDS={"позавчера": -2, "вчера": -1, "сегодня": 0, "завтра": 1, "послезавтра": 2}
+QUICK_TIME_RANGE=re.compile(r'^(\d{1,2}(?:[:.]?\d{2})?)[-–—](\d{1,2}(?:[:.]?\d{2})?)$')
+QUICK_TIME=re.compile(r'^\d{1,2}:\d{2}$')
+QUICK_DATE=re.compile(r'^(\d{1,2})[./](\d{1,2})(?:[./](\d{2}|\d{4}))?$')
+QUICK_SALARY=re.compile(r'^(\d+(?:[.,]\d+)?)(к|k|т|т\.р\.?|р|р\.|руб\.?|₽)?$', re.IGNORECASE)
+# Одинаковые на вид латинские и русские буквы (ММA, EКРАНЫ, ВМIX)
+QUICK_TO_CYRILLIC=str.maketrans("ABCEHKMOPTXY", "АВСЕНКМОРТХУ")
+QUICK_TO_LATIN=str.maketrans("АВСЕНКМОРТХУ", "ABCEHKMOPTXY")
+
+
+def match_option(word: str, options) -> str:
+    """Роль или программа по слову: точное совпадение, однозначный префикс, затем похожее"""
+    variants=[word.upper(), word.upper().translate(QUICK_TO_CYRILLIC), word.upper().translate(QUICK_TO_LATIN)]
+    for variant in variants:
+        if variant in options:
+            return variant
+
+    for variant in variants:
+        prefixed=[option for option in options if len(variant)>=2 and option.startswith(variant)]
+        if len(prefixed) == 1:
+            return prefixed[0]
+
+    for variant in variants:
+        close=difflib.get_close_matches(variant, options, n=1, cutoff=0.75)
+        if close:
+            return close[0]
+    return None
+
+
+def quick_time(token: str):
+    """ЧЧММ / Ч / ЧЧ:ММ -> ЧЧ:ММ или None"""
+    time_str=clean_time_input(token)
+    return time_str if time_str and validate_time(time_str) else None
+
+
+def quick_date(day: int, month: int, year: int = None):
+    try:
+        parsed=date(year or date.today().year, month, day)
+    except ValueError:
+        return None
+    return parsed if validate_date(parsed) else None
+
+
+def quick_date_token(token: str):
+    """ДД.ММ, ДД/ММ или ДД.ММ.ГГ(ГГ) -> date или None"""
+    match=QUICK_DATE.match(token)
+    if not match:
+        return None
+    day, month, year=match.groups()
+    if year and len(year) == 2:
+        year=f"20{year}"
+    return quick_date(int(day), int(month), int(year) if year else None)
+
+
+def parse_quick_entry(text: str):
+    """Разбор строки вида "1503 РЕЖ ЛЧ 1800-2300 10000" в смену.
+
+    Возвращает (shift, unknown): словарь распознанных полей смены и список
+    нераспознанных слов. Порядок слов свободный; 4 цифры в начале строки —
+    дата (ДДММ), дальше — время.
+    """
+    shift={}
+    unknown=[]
+    tokens=text.replace(",", " ").split()
+    times=[]
+
+    i=0
+    while i<len(tokens):
+        token=tokens[i]
+        lowered=token.lower()
+
+        # Программы из двух слов ("ЛИГА 1")
+        if i + 1<len(tokens) and "program" not in shift:
+            pair=f"{token} {tokens[i + 1]}".upper()
+            if pair in WIZARD_PROGRAMS:
+                shift["program"]=pair
+                i+=2
+                continue
+
+        time_range=QUICK_TIME_RANGE.match(token)
+        salary_match=QUICK_SALARY.match(lowered)
+
+        if lowered in QUICK_DATE_WORDS and "date" not in shift:
+            shift["date"]=date.today() + timedelta(days=QUICK_DATE_WORDS[lowered])
+        elif time_range and quick_time(time_range.group(1)) and quick_time(time_range.group(2)):
+            times=[quick_time(time_range.group(1)), quick_time(time_range.group(2))]
+        elif QUICK_TIME.match(token) and quick_time(token) and len(times)<2:
+            times.append(quick_time(token))
+        elif "date" not in shift and quick_date_token(token):
+            shift["date"]=quick_date_token(token)
+        elif token.isdigit() and len(token) == 4 and "date" not in shift and not times \
+                and quick_date(int(token[:2]), int(token[2:])):
+            shift["date"]=quick_date(int(token[:2]), int(token[2:]))
+        elif token.isdigit() and len(token) in (3, 4) and len(times)<2 and quick_time(token):
+            times.append(quick_time(token))
+        elif salary_match and "salary" not in shift and (salary_match.group(2) or len(salary_match.group(1))>=3):
+            amount=float(salary_match.group(1).replace(",", "."))
+            if (salary_match.group(2) or "").lower() in ("к", "k", "т", "т.р", "т.р."):
+                amount*=1000
+            shift["salary"]=int(amount)
+        elif not token.isdigit() and "role" not in shift and match_option(token, WIZARD_ROLES):
+            shift["role"]=match_option(token, WIZARD_ROLES)
+        elif not token.isdigit() and "program" not in shift and match_option(token, WIZARD_PROGRAMS):
+            shift["program"]=match_option(token, WIZARD_PROGRAMS)
         else:
-            header="📅 Все твои смены:\n\n"
+            unknown.append(token)
+        i+=1
 
-        # Отправляем заголовок с кнопкой "Назад"
-        await query.edit_message_text(
-            header.strip(),
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("◀️ Назад к месяцам", callback_data="back_to_months")
-            ]])
+    if times:
+        shift["start_time"]=times[0]
+    if len(times)>1:
+        shift["end_time"]=times[1]
+    return shift, unknown
+
+
+async def quick_entry(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> bool:
+    """Смена из одного сообщения: карточка мастера сразу на шаге подтверждения.
+
+    Сохранение — одно нажатие (тот же путь, что и у мастера), поправить
+    поле можно кнопкой "Изменить". False — в тексте нет смены.
+    """
+    shift, unknown=parse_quick_entry(text)
+    # Похоже на смену, только если есть время или дата и хотя бы еще одно поле
+    if len(shift)<2 or not ({"date", "start_time"} & shift.keys()):
+        return False
+    shift.setdefault("date", date.today())
+
+    start_flow(context.user_data, "quick")
+    wizard={"step": "confirm", "shift": shift, "buffer": "", "custom": False, "error": None}
+    if unknown:
+        wizard["error"]=f"Не распознано: {' '.join(unknown)}"
+    await start_shift_wizard(update, context, wizard)
+    return True
+
+
+# ====== ПАКЕТНОЕ ДОБАВЛЕНИЕ СМЕН ======
+
+BATCH_WEEKDAYS=["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+BATCH_WEEKDAY_NAMES=["понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"]
+BATCH_DATE_RANGE=re.compile(r'^(\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?)[-–—](\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?)$')
+BATCH_FILLER_WORDS={"с", "от", "по", "до", "и", "каждый", "каждую", "каждое", "каждые", "ежедневно"}
+# Дни недели без диапазона дат — на столько недель вперед
+BATCH_DEFAULT_WEEKS=4
+BATCH_MAX_SHIFTS=62
+BATCH_USAGE=(
+    "/batch <смена> <даты>\n\n"
+    "Примеры:\n"
+    "• /batch ЭКРАНЫ РПЛ 1800-2300 10000 сб вс 01.11-30.11\n"
+    "• /batch РЕЖ БИАТЛОН 0900-1800 05.12 06.12 12.12\n"
+    "• /batch ОПЕРАТОР ЛЧ 2100-0100 пн-пт (ближайшие 4 недели)"
+)
+
+
+def batch_weekday(word: str):
+    """День недели (0 — понедельник) по "пт", "пятница", "пятницам"; иначе None"""
+    word=word.lower().rstrip(",.")
+    if word in BATCH_WEEKDAYS:
+        return BATCH_WEEKDAYS.index(word)
+    if len(word)>=4:
+        for weekday, name in enumerate(BATCH_WEEKDAY_NAMES):
+            if word[:4] == name[:4]:
+                return weekday
+    return None
+
+
+def parse_recurrence(tokens):
+    """Даты повторения из слов команды: список дат, диапазон, дни недели.
+
+    Возвращает (dates, rest, error): отсортированные даты, оставшиеся
+    слова (из них разбирается шаблон смены) и текст ошибки.
+    """
+    explicit=[]
+    weekdays=set()
+    start=end=None
+    rest=[]
+
+    i=0
+    while i<len(tokens):
+        token=tokens[i].strip(",")
+        lowered=token.lower()
+        following=quick_date_token(tokens[i + 1].strip(",")) if i + 1<len(tokens) else None
+        date_range=BATCH_DATE_RANGE.match(token)
+        day_range=token.split("-")
+
+        if lowered in ("с", "от") and following:
+            start=following
+            i+=1
+        elif lowered in ("по", "до") and following:
+            end=following
+            i+=1
+        elif date_range and quick_date_token(date_range.group(1)) and quick_date_token(date_range.group(2)):
+            start, end=quick_date_token(date_range.group(1)), quick_date_token(date_range.group(2))
+        elif quick_date_token(token):
+            explicit.append(quick_date_token(token))
+        elif len(day_range) == 2 and None not in map(batch_weekday, day_range):
+            first, last=map(batch_weekday, day_range)
+            weekdays.update((first + k) % 7 for k in range((last - first) % 7 + 1))
+        elif batch_weekday(token) is not None:
+            weekdays.add(batch_weekday(token))
+        elif lowered not in BATCH_FILLER_WORDS:
+            rest.append(tokens[i])
+        i+=1
+
+    if start or end or weekdays:
+        start=start or date.today()
+        if end is None:
+            if not weekdays:
+                return [], rest, "Укажи конец диапазона: с 01.11 по 30.11 или 01.11-30.11"
+            end=start + timedelta(weeks=BATCH_DEFAULT_WEEKS, days=-1)
+        if end<start:
+            # Диапазон через Новый год: 20.12-10.01
+            end=quick_date(end.day, end.month, end.year + 1) or end
+        if end<start:
+            return [], rest, "Конец диапазона раньше начала."
+
+        day=start
+        while day<=end:
+            if not weekdays or day.weekday() in weekdays:
+                explicit.append(day)
+            day+=timedelta(days=1)
+
+    return sorted(set(explicit)), rest, None
+
+
+def describe_shift(shift) -> str:
+    """Смена в одну строку для списков"""
+    parts=[shift.get("role"), shift.get("program")]
+    if shift.get("start_time") and shift.get("end_time"):
+        parts.append(f"{shift['start_time']}–{shift['end_time']}")
+    return " ".join(part for part in parts if part) or "смена"
+
+
+def render_batch(batch: dict, conflicts: dict):
+    """Предпросмотр пакета: шаблон, даты (занятые помечены) и кнопки"""
+    lines=[f"🔁 Повторяющаяся смена:\n{format_shift_display(batch['shift'])}", f"Даты ({len(batch['dates'])}):"]
+    for day in batch["dates"]:
+        line=f"• {day.strftime('%d.%m')} {BATCH_WEEKDAYS[day.weekday()]}"
+        if day in conflicts:
+            line+=f" {EMOJI['warning']} уже есть: {', '.join(describe_shift(s) for s in conflicts[day])}"
+        lines.append(line)
+    if batch.get("unknown"):
+        lines.append(f"{EMOJI['warning']} Не распознано: {' '.join(batch['unknown'])}")
+
+    rows=[[InlineKeyboardButton(f"{EMOJI['success']} Добавить все ({len(batch['dates'])})",
+                                callback_data="bt|all")]]
+    free=len(batch["dates"]) - len(conflicts)
+    if conflicts and free:
+        rows.append([InlineKeyboardButton(f"Только свободные даты ({free})", callback_data="bt|free")])
+    rows.append([InlineKeyboardButton(f"{EMOJI['cancel']} Отмена", callback_data="bt|cancel")])
+    return "\n".join(lines), InlineKeyboardMarkup(rows)
+
+
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /batch — одна смена на много дат (туры РПЛ, этапы биатлона)"""
+    try:
+        if not context.args:
+            await update.message.reply_text(f"{EMOJI['info']} {BATCH_USAGE}")
+            return
+
+        dates, rest, error=parse_recurrence(context.args)
+        template, unknown=parse_quick_entry(" ".join(rest))
+        if "date" in template:  # "завтра" и т.п. — еще одна дата
+            dates=sorted(set(dates) | {template.pop("date")})
+
+        if not error and not dates:
+            error="Не нашел дат. Укажи даты, диапазон или дни недели."
+        elif not error and not template:
+            error="Не понял, какую смену повторять."
+        elif not error and len(dates)>BATCH_MAX_SHIFTS:
+            error=f"Слишком много дат ({len(dates)}), максимум {BATCH_MAX_SHIFTS}."
+        if error:
+            await update.message.reply_text(f"{EMOJI['warning']} {error}\n\n{BATCH_USAGE}")
+            return
+
+        user_id=await ensure_user_exists(update)
+        conflicts=db.get_shifts_on_dates(user_id, dates)
+
+        old=context.user_data.get("batch")
+        if old:
+            edits.delete(context.bot, update.effective_chat.id, old["message_id"])
+
+        batch={"shift": template, "dates": dates, "unknown": unknown}
+        text, markup=render_batch(batch, conflicts)
+        msg=await update.message.reply_text(text, reply_markup=markup)
+        batch["message_id"]=msg.message_id
+        context.user_data["batch"]=batch
+
+    except Exception as e:
+        logger.error(f"Ошибка в batch_command: {e}")
+        await update.message.reply_text(
+            f"{EMOJI['warning']} Произошла ошибка. Попробуйте еще раз.",
+            reply_markup=get_main_menu_keyboard()
+        )
+
+
+async def batch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сохранение пакета одной транзакцией или отмена"""
+    query=update.callback_query
+    try:
+        batch=context.user_data.get("batch")
+        if not batch or batch["message_id"] != query.message.message_id:
+            await query.answer("Этот список уже закрыт.")
+            return
+        await query.answer()
+
+        action=query.data.split("|")[1]
+        context.user_data.pop("batch", None)
+        if action == "cancel":
+            await query.edit_message_text(f"{EMOJI['cancel']} Операция отменена.")
+            return
+
+        user_id=await ensure_user_exists(update)
+        shifts=[{**batch["shift"], "date": day} for day in batch["dates"]]
+        # "Только свободные": занятость проверяется заново внутри транзакции
+        added=db.add_shifts_batch(user_id, shifts, skip_conflicts=action == "free")
+
+        if added is None:
+            text=f"{EMOJI['warning']} Ошибка при сохранении смен. Ни одна смена не добавлена."
+        else:
+            text=f"{format_shift_display(batch['shift'])}\n\n{EMOJI['success']} Добавлено смен: {added}"
+            if added<len(shifts):
+                text+=f" (пропущено занятых дат: {len(shifts) - added})"
+            logger.info(f"Пользователь {update.effective_user.id} добавил пакет из {added} смен")
+        await query.edit_message_text(text)
+
+    except Exception as e:
+        logger.error(f"Ошибка в batch_callback: {e}")
+        await query.answer(f"{EMOJI['warning']} Произошла ошибка.")
+
+
+# ====== ОБРАБОТЧИКИ ПРОСМОТРА СМЕН ======
+
+# Месяцы со сменами (число смен и заработок) по пользователям; сбрасывается с новой ревизией
+month_cache=VersionedCache(max_entries=int(os.getenv("MONTH_CACHE_SIZE", "4096")))
+
+
+def get_month_summary(user_id: str) -> list:
+    return month_cache.get_or_compute(user_id, db.get_user_version(user_id),
+                                      lambda: db.get_month_summary(user_id))
+
+
+def render_month_picker(user_id: str, year: int = None):
+    """Навигатор по годам и месяцам: только периоды, где есть смены.
+
+    Без year — последний год со сменами. Кнопки месяцев подписаны числом
+    смен и заработком; стрелки листают соседние годы со сменами.
+    """
+    summary=get_month_summary(user_id)
+    if not summary:
+        return f"{EMOJI['info']} У тебя пока нет смен.", None
+
+    years=sorted({row["year"] for row in summary})
+    if year not in years:
+        year=years[-1]
+    months=sorted((row for row in summary if row["year"] == year), key=lambda row: row["month"])
+
+    buttons=[
+        InlineKeyboardButton(f"{MONTH_NAMES[row['month']][:3]} · {row['count']} · {format_amount(row['salary'])} ₽",
+                             callback_data=f"month_{year}-{row['month']:02d}")
+        for row in months
+    ]
+    rows=[buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+    index=years.index(year)
+    year_row=[]
+    if index>0:
+        year_row.append(InlineKeyboardButton(f"◀️ {years[index - 1]}", callback_data=f"year|{years[index - 1]}"))
+    if index<len(years) - 1:
+        year_row.append(InlineKeyboardButton(f"{years[index + 1]} ▶️", callback_data=f"year|{years[index + 1]}"))
+    if year_row:
+        rows.append(year_row)
+    rows.append([InlineKeyboardButton("Все смены", callback_data="month_all")])
+
+    count=sum(row["count"] for row in months)
+    salary=sum(row["salary"] for row in months)
+    text=(f"{EMOJI['date']} {year} год: смен — {count}, заработок — {format_amount(salary)} ₽\n\n"
+          "Выбери месяц для просмотра смен:")
+    return text, InlineKeyboardMarkup(rows)
+
+
+async def list_shifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показать меню выбора года и месяца для просмотра смен"""
+    try:
+        user_id=await ensure_user_exists(update)
+        text, markup=render_month_picker(user_id)
+        await update.message.reply_text(text, reply_markup=markup or get_main_menu_keyboard())
+
+    except Exception as e:
+        logger.error(f"Ошибка в list_shifts: {e}")
+        await update.message.reply_text(
+            "⚠️ Произошла ошибка при загрузке меню.",
+            reply_markup=get_main_menu_keyboard()
         )
 
-        # Показываем смены
-        for shift in shifts:
-            formatted_text=format_shift_display(shift)
 
-            buttons=InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✏ Изменить", callback_data=f"edit_{shift['id']}"),
-                    InlineKeyboardButton("❌ Удалить", callback_data=f"delete_{shift['id']}")
-                ]
+def shift_sort_key(shift):
+    """Ключ смены для постраничного просмотра: (дата, время начала, id)"""
+    return (
+        shift['date'].isoformat() if shift.get('date') else '',
+        shift.get('start_time') or '',
+        shift['id']
+    )
+
+
+def scope_bounds(scope: str):
+    """Диапазон дат для 'all' или 'YYYY-MM'"""
+    if scope == "all":
+        return None, None
+    year, month=map(int, scope.split("-"))
+    first=date(year, month, 1)
+    next_month=(first.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return first, next_month - timedelta(days=1)
+
+
+def scope_title(scope: str) -> str:
+    if scope == "all":
+        return "📅 Все твои смены"
+    year, month=map(int, scope.split("-"))
+    return f"📅 Смены за {MONTH_NAMES[month]} {year}"
+
+
+def page_callback(scope: str, page: int, direction: str, key) -> str:
+    """callback_data для перехода по страницам (укладывается в 64 байта)"""
+    return "|".join(["pg", scope, str(page), direction, key[0], key[1], str(key[2])])
+
+
+def parse_page_callback(data: str):
+    _, scope, page, direction, date_key, time_key, shift_id=data.split("|")
+    return scope, int(page), direction, (date_key, time_key, int(shift_id))
+
+
+async def render_shifts_page(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int,
+                             user_id: str, scope: str, page: int = 1, direction: str = None,
+                             key=None, notice: str = None, coalesce: bool = False):
+    """Одна страница смен в одном сообщении; навигация редактирует это же сообщение.
+
+    В режиме выбора (user_data["selection"] для этого сообщения) у смен
+    флажки и кнопки групповых действий; coalesce — склеить частые
+    перерисовки (переключение флажков) в одну правку.
+    """
+    date_from, date_to=scope_bounds(scope)
+    back_row=[InlineKeyboardButton("◀️ Назад к месяцам", callback_data=f"back_to_months|{scope[:4]}"
+                                   if scope != "all" else "back_to_months")]
+
+    total=db.count_user_shifts(user_id, date_from, date_to)
+    pages=max(1, -(-total // SHIFTS_PAGE_SIZE))
+    page=min(max(page, 1), pages)
+
+    shifts=db.get_user_shifts_page(
+        user_id, date_from, date_to,
+        after=key if direction == "n" else None,
+        before=key if direction == "p" else None,
+        limit=SHIFTS_PAGE_SIZE
+    )
+    if not shifts and total:
+        # Страница опустела (например, после удаления) — показываем первую
+        page, direction, key=1, None, None
+        shifts=db.get_user_shifts_page(user_id, date_from, date_to, limit=SHIFTS_PAGE_SIZE)
+
+    if not shifts:
+        if scope == "all":
+            text="У тебя пока нет смен."
+        else:
+            text=f"У тебя нет смен за {MONTH_NAMES[int(scope.split('-')[1])].lower()}."
+        if notice:
+            text=f"{notice}\n\n{text}"
+        await context.bot.edit_message_text(
+            text, chat_id=chat_id, message_id=message_id,
+            reply_markup=InlineKeyboardMarkup([back_row])
+        )
+        return
+
+    first_number=(page - 1) * SHIFTS_PAGE_SIZE + 1
+    lines=[scope_title(scope), f"Страница {page} из {pages} · смен: {total}"]
+    if notice:
+        lines.insert(0, notice + "\n")
+
+    selection=context.user_data.get("selection")
+    if selection and selection["message_id"] != message_id:
+        selection=None
+
+    keyboard=[]
+    toggles=[]
+    for number, shift in enumerate(shifts, start=first_number):
+        lines.append(f"\n{number}.\n{format_shift_display(shift) or 'Смена без данных'}")
+        if selection:
+            mark="☑" if shift["id"] in selection["ids"] else "☐"
+            toggles.append(InlineKeyboardButton(f"{mark} {number}", callback_data=f"sel|t|{shift['id']}"))
+        else:
+            keyboard.append([
+                InlineKeyboardButton(f"✏ {number}", callback_data=f"edit_{shift['id']}"),
+                InlineKeyboardButton(f"❌ {number}", callback_data=f"delete_{shift['id']}")
             ])
+    if toggles:
+        keyboard.append(toggles)
+
+    nav_row=[]
+    if page>1:
+        nav_row.append(InlineKeyboardButton("◀️", callback_data=page_callback(
+            scope, page - 1, "p", shift_sort_key(shifts[0]))))
+    nav_row.append(InlineKeyboardButton(f"{page}/{pages}", callback_data="noop"))
+    if page<pages:
+        nav_row.append(InlineKeyboardButton("▶️", callback_data=page_callback(
+            scope, page + 1, "n", shift_sort_key(shifts[-1]))))
+    keyboard.append(nav_row)
+    if selection:
+        selection["page"]=[shift["id"] for shift in shifts]
+    keyboard.extend(selection_rows(context.user_data, message_id, selection))
+    keyboard.append(back_row)
+
+    text, markup="\n".join(lines), InlineKeyboardMarkup(keyboard)
+    if coalesce:
+        edits.edit(context.bot, chat_id, message_id, text, reply_markup=markup)
+    else:
+        edits.discard(chat_id, message_id)
+        await context.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup)
 
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=formatted_text if formatted_text else "Смена без данных",
-                reply_markup=buttons
-            )
+    # Запоминаем, что показано в сообщении, чтобы перерисовать его после правки
+    views=context.user_data.setdefault("page_views", {})
+    views.pop(message_id, None)
+    views[message_id]=(scope, page, direction, key)
+    while len(views)>5:
+        views.pop(next(iter(views)))
+
+
+async def show_shifts_by_month(update: Update, context: ContextTypes.DEFAULT_TYPE, scope: str = "all"):
+    """Показать смены за месяц ('YYYY-MM') или все смены (постранично, одним сообщением)"""
+    query=update.callback_query
+    try:
+        user_id=await ensure_user_exists(update)
+
+        await render_shifts_page(
+            context, query.message.chat_id, query.message.message_id, user_id, scope
+        )
 
     except Exception as e:
         logger.error(f"Ошибка в show_shifts_by_month: {e}")
@@ -960,89 +1929,455 @@ async def show_shifts_by_month(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+# ====== ГРУППОВОЕ РЕДАКТИРОВАНИЕ СМЕН ======
+
+# Сколько секунд после группового изменения доступна кнопка "Отменить"
+BULK_UNDO_WINDOW=int(os.getenv("BULK_UNDO_WINDOW", "60"))
+BULK_FIELDS={
+    "date": "📅 Дата",
+    "role": "🛠️ Роль",
+    "program": "📺 Программа",
+    "start_time": "⏰ Время начала",
+    "end_time": "⏱️ Время окончания",
+    "salary": "💰 Гонорар",
+}
+
+
+def selection_rows(user_data: dict, message_id: int, selection: dict):
+    """Кнопки режима выбора (или входа в него) и "Отменить" после групповой операции"""
+    rows=[]
+    undo=user_data.get("bulk_undo")
+    if undo and undo["message_id"] == message_id and time.time()<undo["expires"]:
+        rows.append([InlineKeyboardButton(f"↩️ Отменить: {undo['label']}", callback_data="sel|undo")])
+
+    if not selection:
+        rows.append([InlineKeyboardButton("☑️ Выбрать несколько", callback_data="sel|on")])
+        return rows
+
+    count=len(selection["ids"])
+    page_selected=all(shift_id in selection["ids"] for shift_id in selection["page"])
+    rows.append([InlineKeyboardButton("Снять на странице" if page_selected else "Выбрать всю страницу",
+                                      callback_data="sel|page")])
+    if count:
+        rows.append([
+            InlineKeyboardButton(f"✏ Изменить ({count})", callback_data="sel|edit"),
+            InlineKeyboardButton(f"🗑 Удалить ({count})", callback_data="sel|del"),
+        ])
+    rows.append([InlineKeyboardButton("✅ Готово", callback_data="sel|off")])
+    return rows
+
+
+def remember_undo(user_data: dict, message_id: int, label: str, **undo):
+    """Запомнить, как откатить групповую операцию (action и ids или field/values)"""
+    user_data["bulk_undo"]={"message_id": message_id, "label": label,
+                            "expires": time.time() + BULK_UNDO_WINDOW, **undo}
+
+
+def undo_bulk(user_data: dict, user_id: str, message_id: int) -> str:
+    """Откат последней групповой операции; возвращает текст для страницы"""
+    undo=user_data.pop("bulk_undo", None)
+    if not undo or undo["message_id"] != message_id:
+        return f"{EMOJI['info']} Отменять нечего."
+    if time.time()>undo["expires"]:
+        return f"{EMOJI['warning']} Время для отмены истекло."
+
+    if undo["action"] == "delete":
+        restored=db.restore_shifts(user_id, undo["ids"])
+        return f"↩️ Удаление отменено, восстановлено смен: {restored}."
+
+    # Откат возвращает прежнее состояние — пересечения не проверяются
+    db.update_shifts(user_id, undo["field"], undo["values"], allow_overlap=True)
+    return "↩️ Изменение отменено."
+
+
+async def selection_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Режим выбора в просмотре смен: флажки, групповое изменение и удаление"""
+    query=update.callback_query
+    try:
+        chat_id=query.message.chat_id
+        message_id=query.message.message_id
+        view=context.user_data.get("page_views", {}).get(message_id)
+        if not view:
+            await query.answer("Список устарел — открой его заново.")
+            return
+
+        parts=query.data.split("|")
+        action=parts[1]
+        selection=context.user_data.get("selection")
+        if selection and selection["message_id"] != message_id:
+            selection=None
+        if action not in ("on", "undo") and not selection:
+            await query.answer("Режим выбора уже закрыт.")
+            return
+        await query.answer()
+
+        user_id=await ensure_user_exists(update)
+        notice=None
+
+        if action == "on":
+            context.user_data["selection"]={"message_id": message_id, "ids": [], "page": []}
+        elif action == "off":
+            context.user_data.pop("selection", None)
+            context.user_data.pop("bulk_edit", None)
+        elif action == "undo":
+            notice=undo_bulk(context.user_data, user_id, message_id)
+        elif action == "t":
+            shift_id=int(parts[2])
+            if shift_id in selection["ids"]:
+                selection["ids"].remove(shift_id)
+            else:
+                selection["ids"].append(shift_id)
+            # Флажки переключают сериями — перерисовки склеиваются
+            await render_shifts_page(context, chat_id, message_id, user_id, *view, coalesce=True)
+            return
+        elif action == "page":
+            if all(shift_id in selection["ids"] for shift_id in selection["page"]):
+                selection["ids"]=[i for i in selection["ids"] if i not in selection["page"]]
+            else:
+                selection["ids"].extend(i for i in selection["page"] if i not in selection["ids"])
+        elif action == "edit":
+            edits.discard(chat_id, message_id)
+            rows=[[InlineKeyboardButton(label, callback_data=f"sel|f|{field}")] for field, label in BULK_FIELDS.items()]
+            rows.append([InlineKeyboardButton("◀️ Назад", callback_data="sel|back")])
+            await query.edit_message_text(
+                f"Что изменить у выбранных смен ({len(selection['ids'])})?",
+                reply_markup=InlineKeyboardMarkup(rows)
+            )
+            return
+        elif action == "f":
+            field=parts[2]
+            context.user_data["bulk_edit"]={"field": field, "message_id": message_id}
+            await query.edit_message_text(
+                f"Введи новое значение для поля «{BULK_FIELDS[field]}» у {len(selection['ids'])} смен:\n\n"
+                f"Введи 'пропустить' чтобы очистить поле.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("◀️ Назад", callback_data="sel|back")]])
+            )
+            return
+        elif action == "back":
+            context.user_data.pop("bulk_edit", None)
+        elif action == "del":
+            deleted=db.delete_shifts(user_id, selection["ids"])
+            context.user_data.pop("selection", None)
+            if deleted is None:
+                notice=f"{EMOJI['warning']} Ошибка при удалении смен."
+            else:
+                remember_undo(context.user_data, message_id, f"удалено {len(deleted)}", action="delete", ids=deleted)
+                notice=f"{EMOJI['success']} Удалено смен: {len(deleted)}"
+                logger.info(f"Пользователь {user_id} удалил {len(deleted)} смен")
+
+        await render_shifts_page(context, chat_id, message_id, user_id, *view, notice=notice)
+
+    except Exception as e:
+        logger.error(f"Ошибка в selection_callback: {e}")
+        await query.answer(f"{EMOJI['warning']} Произошла ошибка.")
+
+
+async def bulk_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Новое значение поля для всех выбранных смен — одной транзакцией"""
+    bulk=context.user_data["bulk_edit"]
+    field=bulk["field"]
+    message_id=bulk["message_id"]
+    chat_id=update.effective_chat.id
+
+    value, error=parse_edit_value(field, update.message.text.strip())
+    if error:
+        await update.message.reply_text(f"{EMOJI['warning']} {error}")
+        return
+
+    context.user_data.pop("bulk_edit", None)
+    selection=context.user_data.pop("selection", None)
+    view=context.user_data.get("page_views", {}).get(message_id)
+    if not selection or selection["message_id"] != message_id or not view:
+        await update.message.reply_text(
+            f"{EMOJI['warning']} Выбор сброшен — открой список и отметь смены заново.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+
+    user_id=await ensure_user_exists(update)
+    values={shift_id: value for shift_id in selection["ids"]}
+    edits.delete(context.bot, chat_id, update.message.message_id)
+    try:
+        notice=apply_bulk_edit(context.user_data, user_id, message_id, field, values)
+    except ShiftOverlapError as e:
+        # Решение принимается в том же сообщении, выбор восстанавливается при отмене
+        text, markup=render_overlap_prompt(e.conflict, can_merge=False)
+        edits.discard(chat_id, message_id)
+        await context.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup)
+        context.user_data["overlap"]={"action": "bulk", "field": field, "values": values,
+                                      "selection": selection, "message_id": message_id}
+        return
+
+    await render_shifts_page(context, chat_id, message_id, user_id, *view, notice=notice)
+
+
+def apply_bulk_edit(user_data: dict, user_id: str, message_id: int, field: str, values: dict,
+                    allow_overlap: bool = False) -> str:
+    """Групповое изменение поля; возвращает текст для страницы"""
+    previous=db.update_shifts(user_id, field, values, allow_overlap=allow_overlap)
+    if previous is None:
+        return f"{EMOJI['warning']} Ошибка при обновлении."
+    remember_undo(user_data, message_id, f"изменено {len(previous)}",
+                  action="update", field=field, values=previous)
+    logger.info(f"Пользователь {user_id} изменил поле {field} у {len(previous)} смен")
+    return f"{EMOJI['success']} Изменено смен: {len(previous)}"
+
+
+# ====== НАПОМИНАНИЯ ======
+
+# Варианты "за сколько минут напомнить"; None — выключено
+REMINDER_CHOICES=[None, 15, 30, 60, 120, 180]
+
+
+def format_minutes(minutes: int) -> str:
+    hours, rest=divmod(minutes, 60)
+    if hours and rest:
+        return f"{hours} ч {rest} мин"
+    return f"{hours} ч" if hours else f"{rest} мин"
+
+
+def render_reminder_settings(minutes):
+    """Текст и кнопки настройки напоминаний"""
+    if minutes is None:
+        text="⏰ Напоминания о сменах выключены."
+    else:
+        text=f"⏰ Напоминаю о смене за {format_minutes(minutes)} до начала."
+    text+="\n\nНапоминание приходит, если у смены указаны дата и время начала."
+
+    buttons=[
+        InlineKeyboardButton(("✅ " if choice == minutes else "") + ("Выкл" if choice is None else format_minutes(choice)),
+                             callback_data=f"rem|{choice or 'off'}")
+        for choice in REMINDER_CHOICES
+    ]
+    return text, InlineKeyboardMarkup([buttons[:3], buttons[3:]])
+
+
+async def reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /reminders — за сколько минут до смены напоминать"""
+    try:
+        user_id=await ensure_user_exists(update)
+        text, markup=render_reminder_settings(db.get_reminder_minutes(user_id))
+        await update.message.reply_text(text, reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Ошибка в reminders_command: {e}")
+        await update.message.reply_text(
+            f"{EMOJI['warning']} Произошла ошибка.",
+            reply_markup=get_main_menu_keyboard()
+        )
+
+
+async def reminders_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор времени напоминания (rem|минуты, rem|off, rem|show из профиля)"""
+    query=update.callback_query
+    try:
+        await query.answer()
+        user_id=await ensure_user_exists(update)
+        value=query.data.split("|")[1]
+
+        if value == "show":
+            minutes=db.get_reminder_minutes(user_id)
+        else:
+            minutes=None if value == "off" else int(value)
+            db.set_reminder_minutes(user_id, minutes)
+            await reminders.resync_user(user_id)
+            logger.info(f"Пользователь {user_id} настроил напоминания: {minutes}")
+
+        text, markup=render_reminder_settings(minutes)
+        try:
+            await query.edit_message_text(text, reply_markup=markup)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+
+    except Exception as e:
+        logger.error(f"Ошибка в reminders_callback: {e}")
+        await query.answer(f"{EMOJI['warning']} Произошла ошибка.")
+
+
+async def send_reminder(bot, entry: dict):
+    """Отправка напоминания (через FloodGateway, в фоновой очереди)"""
+    shift={field: entry[field] for field in ("date", "role", "program", "start_time", "end_time")}
+    await bot.send_message(
+        chat_id=entry["chat_id"],
+        text=f"⏰ Через {format_minutes(entry['minutes_before'])} начинается смена:\n\n{format_shift_display(shift)}",
+        rate_limit_args=PRIORITY_BACKGROUND
+    )
+
+
+reminders=ReminderScheduler(db, send_reminder)
+
+
+# ====== ИТОГИ МЕСЯЦА ======
+
+def format_amount(value) -> str:
+    return f"{value:,.0f}".replace(",", " ")
+
+
+def format_change(current, previous, fmt=str, unit: str = "") -> str:
+    """Изменение относительно прошлого месяца: (↑2), (↓1 500 ₽); без изменений — пусто"""
+    diff=current - previous
+    if not previous or not diff:
+        return ""
+    return f" ({'↑' if diff>0 else '↓'}{fmt(abs(diff))}{unit})"
+
+
+def render_digest(row: dict, period: date) -> str:
+    """Текст итогов месяца для одного пользователя"""
+    hours=round(row["minutes"] / 60, 1)
+    prev_hours=round(row["prev_minutes"] / 60, 1)
+    hours_fmt=lambda value: f"{round(value, 1):g}"
+
+    text=(f"📊 Итоги месяца: {MONTH_NAMES[period.month]} {period.year}\n\n"
+          f"• Смен: {row['count']}{format_change(row['count'], row['prev_count'])}\n")
+    if hours:
+        text+=f"• Часов: {hours:g}{format_change(hours, prev_hours, hours_fmt)}\n"
+    text+=(f"• Заработок: {format_amount(row['salary'])} ₽"
+           f"{format_change(row['salary'], row['prev_salary'], format_amount, ' ₽')}\n")
+    if row["prev_count"]:
+        text+=f"\nВ скобках — изменение к прошлому месяцу ({MONTH_NAMES[previous_month(period).month]})."
+    return text
+
+
+digest=MonthlyDigest(db, render_digest)
+
+
 # ====== ЭКСПОРТ ДАННЫХ ======
 
 async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Экспорт данных пользователя"""
+    """Выбор формата экспорта данных"""
     try:
         user_id=await ensure_user_exists(update)
-        shifts=db.get_user_shifts(user_id)
 
-        if not shifts:
+        if not db.count_user_shifts(user_id):
             await update.message.reply_text(
                 f"{EMOJI['info']} У тебя пока нет смен для экспорта.",
                 reply_markup=get_main_menu_keyboard()
             )
             return
 
+        buttons=InlineKeyboardMarkup([[
+            InlineKeyboardButton(title, callback_data=f"export_{fmt}")
+            for fmt, (title, _) in EXPORT_FORMATS.items()
+        ]])
+
+        await update.message.reply_text(
+            f"{EMOJI['info']} Выбери формат экспорта:",
+            reply_markup=buttons
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка в export_data: {e}")
+        await update.message.reply_text(
+            f"{EMOJI['warning']} Произошла ошибка при экспорте данных.",
+            reply_markup=get_main_menu_keyboard()
+        )
+
+
+async def send_export(update: Update, context: ContextTypes.DEFAULT_TYPE, fmt: str):
+    """Экспорт данных пользователя в выбранном формате (без временных файлов)"""
+    query=update.callback_query
+    try:
+        user_id=await ensure_user_exists(update)
+
         # Получаем информацию о пользователе
         telegram_id=str(update.effective_user.id)
         user=db.get_user_by_telegram_id(telegram_id)
 
-        # Создаем JSON файл
-        export_data_dict={
+        meta={
             "user_id": user_id,
             "api_token": user['api_token'],
             "export_date": datetime.now().isoformat(),
-            "web_access": f"Используй api_token для доступа к веб-версии",
-            "shifts": []
+            "web_access": "Используй api_token для доступа к веб-версии",
+            "calendar_name": "Мои смены"
         }
 
-        for shift in shifts:
-            shift_export={
-                "date": shift['date'].isoformat() if shift['date'] else None,
-                "role": shift['role'],
-                "program": shift['program'],
-                "start_time": shift['start_time'],
-                "end_time": shift['end_time'],
-                "salary": shift['salary']
-            }
-            export_data_dict["shifts"].append(shift_export)
-
-        # Создаем временный файл
-        filename=f"shifts_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(export_data_dict, f, ensure_ascii=False, indent=2)
+        # Смены читаются прямо из курсора и пишутся в буфер в памяти
+        document, filename=build_export(
+            fmt,
+            db.iter_user_shifts(user_id),
+            meta if fmt == "json" else {"calendar_name": meta["calendar_name"]},
+            f"shifts_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
 
-        # Отправляем файл
-        with open(filename, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
+        with document:
+            await query.edit_message_text(f"{EMOJI['success']} Экспорт готов: {filename}")
+            await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=document,
+                filename=filename,
                 caption=f"{EMOJI['success']} Экспорт данных о сменах\n"
-                        f"{EMOJI['link']} Твой API токен в файле для веб-доступа",
+                        f"{EMOJI['link']} Твой API токен в JSON-файле для веб-доступа",
                 reply_markup=get_main_menu_keyboard()
             )
 
-        # Удаляем временный файл
-        os.remove(filename)
-
     except Exception as e:
-        logger.error(f"Ошибка в export_data: {e}")
-        await update.message.reply_text(
-            f"{EMOJI['warning']} Произошла ошибка при экспорте данных.",
-            reply_markup=get_main_menu_keyboard()
-        )
+        logger.error(f"Ошибка в send_export: {e}")
+        await query.edit_message_text(f"{EMOJI['warning']} Произошла ошибка при экспорте данных.")
 
 
 # ====== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ======
 
-async def safe_delete_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int):
-    """Безопасное удаление сообщения"""
+async def cleanup_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очистка сообщений для удаления (в фоне, следующий ответ не ждет)"""
+    if "to_delete" not in context.user_data:
+        return
+
+    cleaner.delete(context.bot, update.effective_chat.id, context.user_data["to_delete"])
+    context.user_data["to_delete"]=[]
+
+
+def dangling_messages(user_data: dict) -> list:
+    """Служебные сообщения незавершенного ввода, которые остались в чате"""
+    message_ids=list(user_data.get("to_delete", []))
+    if "salary_message_id" in user_data:
+        message_ids.append(user_data["salary_message_id"])
+    if user_data.get("wizard"):
+        message_ids.append(user_data["wizard"]["message_id"])
+    if user_data.get("batch"):
+        message_ids.append(user_data["batch"]["message_id"])
+    return message_ids
+
+
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Диалог брошен на полпути: убрать подсказки и вернуть главное меню"""
     try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        chat_id=update.effective_chat.id
+        cleaner.delete(context.bot, chat_id, dangling_messages(context.user_data))
+        context.user_data.clear()
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"{EMOJI['info']} Ввод смены отменен: долго не было ответа.",
+            reply_markup=get_main_menu_keyboard(),
+            rate_limit_args=PRIORITY_BACKGROUND
+        )
     except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение {message_id}: {e}")
+        logger.error(f"Ошибка в conversation_timeout: {e}")
 
 
-async def cleanup_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Очистка сообщений для удаления"""
-    if "to_delete" not in context.user_data:
-        return
+async def expire_user_data(user_id: int, user_data: dict):
+    """Очистка данных пользователя, неактивного дольше USER_DATA_IDLE"""
+    # В личном чате chat_id совпадает с user_id
+    cleaner.delete(sweeper.application.bot, user_id, dangling_messages(user_data))
+    user_data.clear()
 
-    for msg_id in context.user_data["to_delete"]:
-        await safe_delete_message(context, update.effective_chat.id, msg_id)
 
-    context.user_data["to_delete"]=[]
+sweeper=IdleSweeper(on_expire=expire_user_data)
+
+
+async def post_init(application):
+    """Фоновые задачи после запуска"""
+    sweeper.start(application)
+    reminders.start(application)
+    digest.start(application)
+
+
+async def post_shutdown(application):
+    """Дослать отложенные правки и удаления перед остановкой"""
+    await sweeper.stop()
+    await reminders.stop()
+    await digest.stop()
+    await edits.flush()
+    await cleaner.flush()
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1053,7 +2388,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *Основные команды:*
 • Начать смену - добавить новую смену
 • Мои смены - посмотреть все смены
-• Экспорт данных - скачать данные в JSON
+• Экспорт данных - скачать данные в JSON, CSV или iCalendar
 • Статистика - просмотр статистики
 • 👤 Профиль - информация о профиле и API токен
 • Помощь - это сообщение
@@ -1065,6 +2400,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 4. Введите время начала и окончания
 5. Укажите гонорар
 
+Команда /add открывает то же самое в одном сообщении с кнопками.
+
+*Быстрый ввод:* просто напишите смену одной строкой, например
+`1503 РЕЖ ЛЧ 1800-2300 10000` — бот покажет карточку, останется нажать "Сохранить".
+
+*Повтор:* кнопка "🔁 Как в прошлый раз" (или /repeat) копирует последнюю смену — останется выбрать дату.
+
+*Много дат сразу:* /batch ЭКРАНЫ РПЛ 1800-2300 10000 сб вс 01.11-30.11
+Даты — списком, диапазоном или днями недели; перед сохранением бот покажет список и занятые даты.
+
 *Форматы ввода:*
 • Время: 1830 или 18:30
 • Дата: 1503 для 15.03
@@ -1073,6 +2418,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *Управление сменами:*
 • Редактирование - изменить любое поле
 • Удаление - удалить смену
+• ☑️ Выбрать несколько - изменить или удалить сразу несколько смен (с отменой)
+• /reminders - напоминание за N минут до начала смены
+• /stats - последние 30/90/365 дней, год к году, лучшие месяцы программ
+• /analytics - часы, ставка в час, разрезы по ролям, программам, месяцам и дням недели
 • Экспорт - скачать все данные
 
 ❌ *Кнопка "Отмена"* доступна на каждом шаге добавления смены
@@ -1100,55 +2449,54 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id=await ensure_user_exists(update)
         data=query.data
 
-        # Обработка выбора месяца
+        # Обработка выбора месяца: month_all, month_YYYY-MM (month_N — старые сообщения, текущий год)
         if data.startswith("month_"):
-            if data == "month_all":
-                await show_shifts_by_month(update, context, month=None)
-            else:
-                month=int(data.split("_")[1])
-                await show_shifts_by_month(update, context, month=month)
+            scope=data.split("_", 1)[1]
+            if scope.isdigit():
+                scope=f"{datetime.now().year}-{int(scope):02d}"
+            await show_shifts_by_month(update, context, scope)
             return
 
-        # Возврат к меню месяцев
-        elif data == "back_to_months":
-            month_buttons=InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("Январь", callback_data="month_1"),
-                    InlineKeyboardButton("Февраль", callback_data="month_2"),
-                    InlineKeyboardButton("Март", callback_data="month_3")
-                ],
-                [
-                    InlineKeyboardButton("Апрель", callback_data="month_4"),
-                    InlineKeyboardButton("Май", callback_data="month_5"),
-                    InlineKeyboardButton("Июнь", callback_data="month_6")
-                ],
-                [
-                    InlineKeyboardButton("Июль", callback_data="month_7"),
-                    InlineKeyboardButton("Август", callback_data="month_8"),
-                    InlineKeyboardButton("Сентябрь", callback_data="month_9")
-                ],
-                [
-                    InlineKeyboardButton("Октябрь", callback_data="month_10"),
-                    InlineKeyboardButton("Ноябрь", callback_data="month_11"),
-                    InlineKeyboardButton("Декабрь", callback_data="month_12")
-                ],
-                [
-                    InlineKeyboardButton("Все смены", callback_data="month_all")
-                ]
-            ])
-
-            await query.edit_message_text(
-                f"{EMOJI['date']} Выбери месяц для просмотра смен:",
-                reply_markup=month_buttons
+        # Переход по страницам смен
+        elif data.startswith("pg|"):
+            scope, page, direction, key=parse_page_callback(data)
+            await render_shifts_page(
+                context, query.message.chat_id, query.message.message_id,
+                user_id, scope, page, direction, key
             )
             return
 
+        elif data == "noop":
+            return
+
+        # Экспорт в выбранном формате
+        elif data.startswith("export_"):
+            fmt=data.split("_", 1)[1]
+            if fmt in EXPORT_FORMATS:
+                await send_export(update, context, fmt)
+            return
+
+        # Возврат к меню месяцев
+        elif data.startswith("back_to_months") or data.startswith("year|"):
+            year=data.split("|")[1] if "|" in data else None
+            text, markup=render_month_picker(user_id, int(year) if year else None)
+            await query.edit_message_text(text, reply_markup=markup)
+            return
+
         # Удаление смены
         elif data.startswith("delete_"):
             shift_id=int(data.split("_")[1])
+            view=context.user_data.get("page_views", {}).get(query.message.message_id)
 
             if db.delete_shift(user_id, shift_id):
-                await query.edit_message_text(f"{EMOJI['success']} Смена удалена.")
+                if view:
+                    # Перерисовываем ту же страницу в том же сообщении
+                    await render_shifts_page(
+                        context, query.message.chat_id, query.message.message_id,
+                        user_id, *view, notice=f"{EMOJI['success']} Смена удалена."
+                    )
+                else:
+                    await query.edit_message_text(f"{EMOJI['success']} Смена удалена.")
                 logger.info(f"Пользователь {user_id} удалил смену {shift_id}")
             else:
                 await query.edit_message_text(f"{EMOJI['warning']} Ошибка при удалении смены.")
@@ -1195,6 +2543,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             context.user_data["edit_shift_id"]=shift_id
             context.user_data["edit_field"]=field
+            context.user_data["edit_message_id"]=query.message.message_id
 
             field_names={
                 "date": "дату (формат ДДММ, например: 1503)",
@@ -1213,6 +2562,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Отмена редактирования
         elif data.startswith("cancel_edit_"):
             shift_id=int(data.split("_")[2])
+            view=context.user_data.get("page_views", {}).get(query.message.message_id)
+            if view:
+                await render_shifts_page(
+                    context, query.message.chat_id, query.message.message_id, user_id, *view
+                )
+                return
+
             shifts=db.get_user_shifts(user_id)
             shift=next((s for s in shifts if s['id'] == shift_id), None)
 
@@ -1259,8 +2615,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 month_name=month_names.get(month, month)
                 stats_text+=f"\n• {month_name} {year}: {month_stat['count']} смен, {month_stat['salary']:,} ₽"
 
+            stats_text=stats_text.replace(",", " ") + render_trends(get_statistics_trends(user_id),
+                                                                    months=12, programs=10)
             await query.edit_message_text(
-                stats_text.replace(",", " "),
+                stats_text,
                 parse_mode='Markdown'
             )
 
@@ -1269,6 +2627,44 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(f"{EMOJI['warning']} Произошла ошибка при обработке кнопки.")
 
 
+def parse_edit_value(field: str, new_value: str):
+    """Новое значение поля из текста; возвращает (значение, текст ошибки или None)"""
+    if new_value.lower() == "пропустить":
+        return None, None
+
+    if field == "date":
+        cleaned=re.sub(r"[^\d]", "", new_value)
+        if len(cleaned) != 4:
+            return None, "Неверный формат даты. Используй ДДММ (например: 1503)."
+        try:
+            day, month=int(cleaned[:2]), int(cleaned[2:])
+            processed_value=date(datetime.now().year, month, day)
+        except ValueError:
+            return None, "Неверная дата."
+        if not validate_date(processed_value):
+            return None, "Дата слишком далеко в прошлом или будущем."
+        return processed_value, None
+
+    if field in ["start_time", "end_time"]:
+        processed_value=clean_time_input(new_value)
+        if processed_value and not validate_time(processed_value):
+            return None, "Неверный формат времени. Используй ЧЧММ или ЧЧ:ММ (например: 1830)."
+        return processed_value, None
+
+    if field == "salary":
+        try:
+            # Убираем все кроме цифр и точки/запятой
+            cleaned_text=re.sub(r'[^\d.,]', '', new_value)
+            value=float(cleaned_text.replace(",", "."))
+        except ValueError:
+            return None, "Неверный формат суммы. Введи число в рублях (например: 10000 или 7500)."
+        if value<0:
+            return None, "Гонорар не может быть отрицательным."
+        return int(value), None  # Сохраняем как есть в рублях
+
+    return new_value, None  # role, program
+
+
 async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода при редактировании"""
     try:
@@ -1281,68 +2677,33 @@ async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         new_value=update.message.text.strip()
 
         # Валидация и преобразование значения
-        if field == "date":
-            if new_value.lower() == "пропустить":
-                processed_value=None
-            else:
-                try:
-                    cleaned=re.sub(r"[^\d]", "", new_value)
-                    if len(cleaned) == 4:
-                        day, month=int(cleaned[:2]), int(cleaned[2:])
-                        processed_value=date(datetime.now().year, month, day)
-
-                        if not validate_date(processed_value):
-                            await update.message.reply_text(
-                                f"{EMOJI['warning']} Дата слишком далеко в прошлом или будущем."
-                            )
-                            return
-                    else:
-                        await update.message.reply_text(
-                            f"{EMOJI['warning']} Неверный формат даты. Используй ДДММ (например: 1503)."
-                        )
-                        return
-                except ValueError:
-                    await update.message.reply_text(
-                        f"{EMOJI['warning']} Неверная дата."
-                    )
-                    return
-
-        elif field in ["start_time", "end_time"]:
-            if new_value.lower() == "пропустить":
-                processed_value=None
-            else:
-                processed_value=clean_time_input(new_value)
-                if processed_value and not validate_time(processed_value):
-                    await update.message.reply_text(
-                        f"{EMOJI['warning']} Неверный формат времени. Используй ЧЧММ или ЧЧ:ММ (например: 1830)."
-                    )
-                    return
-
-        elif field == "salary":
-            if new_value.lower() == "пропустить":
-                processed_value=None
-            else:
-                try:
-                    # Убираем все кроме цифр и точки/запятой
-                    cleaned_text=re.sub(r'[^\d.,]', '', new_value)
-                    value=float(cleaned_text.replace(",", "."))
-                    if value<0:
-                        await update.message.reply_text(
-                            f"{EMOJI['warning']} Гонорар не может быть отрицательным."
-                        )
-                        return
-                    processed_value=int(value)  # Сохраняем как есть в рублях
-                except ValueError:
-                    await update.message.reply_text(
-                        f"{EMOJI['warning']} Неверный формат суммы. Введи число в рублях (например: 10000 или 7500)."
-                    )
-                    return
+        processed_value, error=parse_edit_value(field, new_value)
+        if error:
+            await update.message.reply_text(f"{EMOJI['warning']} {error}")
+            return
 
-        else:  # role, program
-            processed_value=None if new_value.lower() == "пропустить" else new_value
+        message_id=context.user_data.get("edit_message_id")
+        view=context.user_data.get("page_views", {}).get(message_id)
 
         # Обновляем в базе данных
-        if db.update_shift(user_id, shift_id, field, processed_value):
+        try:
+            updated=db.update_shift(user_id, shift_id, field, processed_value)
+        except ShiftOverlapError as e:
+            text, markup=render_overlap_prompt(e.conflict, can_merge=False)
+            msg=await update.message.reply_text(text, reply_markup=markup)
+            context.user_data["overlap"]={"action": "edit", "shift_id": shift_id, "field": field,
+                                          "value": processed_value, "message_id": msg.message_id}
+            for key in ("edit_shift_id", "edit_field", "edit_message_id"):
+                context.user_data.pop(key, None)
+            return
+
+        if updated and view:
+            # Смена открыта со страницы — возвращаем страницу в том же сообщении
+            await render_shifts_page(
+                context, update.effective_chat.id, message_id, user_id, *view,
+                notice=f"{EMOJI['success']} Поле обновлено!"
+            )
+        elif updated:
             # Получаем обновленную смену
             shifts=db.get_user_shifts(user_id)
             updated_shift=next((s for s in shifts if s['id'] == shift_id), None)
@@ -1376,6 +2737,7 @@ async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Очищаем данные редактирования
         context.user_data.pop("edit_shift_id", None)
         context.user_data.pop("edit_field", None)
+        context.user_data.pop("edit_message_id", None)
 
     except Exception as e:
         logger.error(f"Ошибка в handle_edit_input: {e}")
@@ -1407,6 +2769,8 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
 
         if text == "Начать смену":
             return await start_shift_creation(update, context)
+        elif text == REPEAT_BUTTON:
+            await repeat_last_shift(update, context)
         elif text == "Мои смены":
             await list_shifts(update, context)
         elif text == "Экспорт данных":
@@ -1421,6 +2785,12 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
             # Проверяем, не находимся ли мы в режиме редактирования
             if "edit_shift_id" in context.user_data and "edit_field" in context.user_data:
                 await handle_edit_input(update, context)
+            elif "bulk_edit" in context.user_data:
+                await bulk_edit_input(update, context)
+            elif context.user_data.get("wizard", {}).get("custom"):
+                await wizard_text_input(update, context)
+            elif await quick_entry(update, context, text):
+                pass
             else:
                 await update.message.reply_text(
                     f"{EMOJI['info']} Используй кнопки меню для навигации.",
@@ -1438,6 +2808,10 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Глобальный обработчик ошибок"""
     logger.error(f"Ошибка: {context.error}")
 
+    # Ответ на флуд-контроль только добавил бы запросов
+    if isinstance(context.error, RetryAfter):
+        return
+
     if update and update.effective_message:
         await update.effective_message.reply_text(
             f"{EMOJI['warning']} Произошла непредвиденная ошибка. Попробуйте еще раз.",
@@ -1445,59 +2819,92 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-def main():
-    """Основная функция запуска бота"""
-    try:
-        # Инициализируем приложение
-        application=ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-
-        # Создаем обработчик диалогов для добавления смены
-        conv_handler=ConversationHandler(
-            entry_points=[
-                MessageHandler(filters.Regex(r'^Начать смену'), start_shift_creation)
-            ],
-            states={
-                SELECT_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_date)],
-                SELECT_ROLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_role)],
-                SELECT_PROGRAM: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_program)],
-                TYPING_START: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
-                TYPING_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
-                TYPING_SALARY: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_salary)],
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-        )
+def build_application():
+    """Приложение со всеми обработчиками (без запуска приема апдейтов)"""
+    # Инициализируем приложение; user_data и диалоги хранятся в той же базе
+    persistence=SQLitePersistence(db.db_path)
+    application=ingress.configure_builder(ApplicationBuilder()) \
+        .token(TELEGRAM_TOKEN) \
+        .request(CountingRequest(connection_pool_size=HTTP_POOL_SIZE, pool_timeout=HTTP_POOL_TIMEOUT)) \
+        .rate_limiter(FloodGateway()) \
+        .concurrent_updates(PerChatUpdateProcessor()) \
+        .persistence(persistence) \
+        .post_init(post_init) \
+        .post_shutdown(post_shutdown) \
+        .build()
+    persistence.attach(application)
+
+    # Создаем обработчик диалогов для добавления смены
+    conv_handler=ConversationHandler(
+        entry_points=[
+            MessageHandler(filters.Regex(r'^Начать смену'), start_shift_creation)
+        ],
+        states={
+            SELECT_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_date)],
+            SELECT_ROLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_role)],
+            SELECT_PROGRAM: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_program)],
+            TYPING_START: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
+            TYPING_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
+            TYPING_SALARY: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_salary)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
+        },
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="shift_creation",
+        persistent=True,
+    )
+
+    # Добавляем обработчики в правильном порядке (от более специфичных к общим)
 
-        # Добавляем обработчики в правильном порядке (от более специфичных к общим)
+    # 0. Отсев повторных апдейтов и замер запросов к API при вводе смены
+    ingress.add_dedup_handler(application)
+    application.add_handler(TypeHandler(Update, bind_flow), group=-1)
 
-        # 1. Команды
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("cancel", cancel))
-        application.add_handler(CommandHandler("profile", profile_command))
+    # 1. Команды
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("add", add_command))
+    application.add_handler(CommandHandler("batch", batch_command))
+    application.add_handler(CommandHandler("repeat", repeat_last_shift))
+    application.add_handler(CommandHandler("reminders", reminders_command))
+    application.add_handler(CommandHandler("analytics", analytics_command))
+    application.add_handler(CommandHandler("stats", statistics_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("profile", profile_command))
 
-        # 2. Обработчик диалогов
-        application.add_handler(conv_handler)
+    # 2. Обработчик диалогов
+    application.add_handler(conv_handler)
 
-        # 3. Обработчик inline кнопок
-        application.add_handler(CallbackQueryHandler(button_handler))
+    # 3. Обработчики inline кнопок
+    application.add_handler(CallbackQueryHandler(wizard_callback, pattern=r"^wz\|"))
+    application.add_handler(CallbackQueryHandler(batch_callback, pattern=r"^bt\|"))
+    application.add_handler(CallbackQueryHandler(selection_callback, pattern=r"^sel\|"))
+    application.add_handler(CallbackQueryHandler(reminders_callback, pattern=r"^rem\|"))
+    application.add_handler(CallbackQueryHandler(overlap_callback, pattern=r"^ov\|"))
+    application.add_handler(CallbackQueryHandler(button_handler))
 
-        # 4. Обработчик кнопок главного меню и текстовых сообщений
-        application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            handle_menu_buttons
-        ))
+    # 4. Обработчик кнопок главного меню и текстовых сообщений
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND,
+        handle_menu_buttons
+    ))
 
-        # 5. Глобальный обработчик ошибок
-        application.add_error_handler(error_handler)
+    # 5. Глобальный обработчик ошибок
+    application.add_error_handler(error_handler)
+
+    return application
+
+
+def main():
+    """Основная функция запуска бота"""
+    try:
+        application=build_application()
 
         logger.info("Бот запущен и готов к работе...")
         print(f"{EMOJI['success']} Бот запущен успешно!")
 
-        # Запускаем бота
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        # Запускаем бота (long polling или webhook, см. BOT_MODE)
+        ingress.run(application)
 
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске бота: {e}")
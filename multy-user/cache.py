@@ -0,0 +1,53 @@
+# cache.py - Кэш с проверкой версии данных пользователя
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class VersionedCache:
+    """LRU-кэш, где каждая запись помечена версией данных.
+
+    Версия берется из БД (например, MAX(rev) смен пользователя), поэтому
+    запись становится недействительной после записи из любого процесса —
+    и из бота, и из веб-сервера.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries=max_entries
+        self._entries: "OrderedDict[Hashable, tuple]"=OrderedDict()
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+
+    def get(self, key: Hashable, version: Any) -> Optional[Any]:
+        """Значение, если оно посчитано для этой же версии"""
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses+=1
+                return None
+            self._entries.move_to_end(key)
+            self.hits+=1
+            return entry[1]
+
+    def put(self, key: Hashable, version: Any, value: Any):
+        with self._lock:
+            self._entries[key]=(version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries)>self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, version: Any, compute: Callable[[], Any]) -> Any:
+        value=self.get(key, version)
+        if value is None:
+            value=compute()
+            self.put(key, version, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
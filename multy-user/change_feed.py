@@ -0,0 +1,157 @@
+# change_feed.py - Лента изменений смен для Server-Sent Events
+import json
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from database import MultiUserDatabase
+
+
+class Subscription:
+    """Подписка одного SSE-клиента на изменения смен пользователя"""
+
+    def __init__(self, user_id: str, token: int, buffer_size: int):
+        self.user_id=user_id
+        self.token=token
+        self.events=queue.Queue(maxsize=buffer_size)
+        self.overflowed=False
+
+    def push(self, event: str, data: Dict):
+        """Кладет событие в буфер; при переполнении клиент получит resync"""
+        try:
+            self.events.put_nowait((event, data))
+        except queue.Full:
+            self.overflowed=True
+
+
+class ChangeFeed:
+    """Следит за PRAGMA data_version и раздает изменения подписчикам.
+
+    data_version меняется при коммите из любого другого подключения, в том
+    числе из процесса бота, поэтому бот и веб-сервер не связаны напрямую.
+    """
+
+    def __init__(self, db: MultiUserDatabase, poll_interval: float = 0.5,
+                 max_streams: int = 100, buffer_size: int = 64):
+        self.db=db
+        self.poll_interval=poll_interval
+        self.max_streams=max_streams
+        self.buffer_size=buffer_size
+        self._subscriptions: Set[Subscription]=set()
+        self._lock=threading.Lock()
+        self._wakeup=threading.Event()
+        self._thread=None
+
+    @property
+    def stream_count(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+    def subscribe(self, user_id: str, token: Optional[int] = None) -> Optional[Subscription]:
+        """Новая подписка или None, если достигнут лимит потоков"""
+        if token is None:
+            token=self.db.get_sync_token()
+
+        with self._lock:
+            if len(self._subscriptions)>=self.max_streams:
+                return None
+            sub=Subscription(user_id, token, self.buffer_size)
+            self._subscriptions.add(sub)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread=threading.Thread(target=self._run, name='ChangeFeed', daemon=True)
+                self._thread.start()
+
+        self._wakeup.set()
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def _run(self):
+        """Фоновый опрос data_version; без подписчиков поток спит"""
+        conn=sqlite3.connect(self.db.db_path)
+        last_version=None
+        try:
+            while True:
+                with self._lock:
+                    subscriptions=list(self._subscriptions)
+
+                if not subscriptions:
+                    self._wakeup.clear()
+                    with self._lock:
+                        idle=not self._subscriptions
+                    if idle:
+                        self._wakeup.wait()
+                    continue
+
+                version=conn.execute('PRAGMA data_version').fetchone()[0]
+                if version != last_version or self._wakeup.is_set():
+                    self._wakeup.clear()
+                    last_version=version
+                    self._dispatch(subscriptions)
+
+                time.sleep(self.poll_interval)
+        finally:
+            conn.close()
+
+    def _dispatch(self, subscriptions):
+        """Выборка изменений для каждой подписки (одинаковые запросы не повторяются)"""
+        cache={}
+        for sub in subscriptions:
+            key=(sub.user_id, sub.token)
+            if key not in cache:
+                cache[key]=self.db.get_shift_changes(sub.user_id, sub.token)
+            changes=cache[key]
+
+            if changes['token'] == sub.token:
+                continue
+            since, sub.token=sub.token, changes['token']
+
+            # Для since=0 полный снимок — это и есть список изменений
+            if changes['reset'] and since>0:
+                sub.push('resync', {'token': str(sub.token)})
+            elif changes['upserts'] or changes['deleted']:
+                sub.push('changes', {
+                    'upserts': [_serialize_shift(s) for s in changes['upserts']],
+                    'deleted': changes['deleted'],
+                    'token': str(sub.token)
+                })
+
+    def stream(self, sub: Subscription, heartbeat: float = 15.0):
+        """Генератор SSE-сообщений для одной подписки"""
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                if sub.overflowed:
+                    # Клиент не успевает читать: просим перезагрузить данные целиком
+                    sub.overflowed=False
+                    with sub.events.mutex:
+                        sub.events.queue.clear()
+                    yield _format_event('resync', {'token': str(sub.token)}, sub.token)
+                    continue
+
+                try:
+                    event, data=sub.events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+
+                yield _format_event(event, data, data['token'])
+        finally:
+            self.unsubscribe(sub)
+
+
+def _serialize_shift(shift: Dict) -> Dict:
+    shift=dict(shift)
+    if shift.get('date'):
+        shift['date']=shift['date'].isoformat()
+    return shift
+
+
+def _format_event(event: str, data: Dict, event_id) -> str:
+    payload=json.dumps(data, ensure_ascii=False)
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
@@ -2,16 +2,80 @@
 import sqlite3
 import hashlib
 import secrets
-from datetime import datetime, date
-from typing import Optional, Dict, Any, List
+from datetime import datetime, date, timedelta
+from typing import Optional, Dict, Any, List, Iterator
 import json
 
+from analytics import parse_minutes
+
+# Сколько дней хранить записи об удаленных сменах для дельта-синхронизации
+TOMBSTONE_RETENTION_DAYS=30
+# За сколько дней вес смены в подсказках падает вдвое
+SUGGESTION_HALF_LIFE_DAYS=30
+# Поля смены, которые можно менять (имя колонки подставляется в SQL)
+SHIFT_FIELDS=('date', 'role', 'program', 'start_time', 'end_time', 'salary')
+
+
+def _chunks(values: list, size: int = 900):
+    """Части списка для IN (...): SQLite принимает не больше 999 параметров"""
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+# Минуты от полуночи для 'ЧЧ:ММ' и длительность смены с переходом через полночь (2200–0300)
+_MINUTES_SQL="(CAST(substr({0}, 1, 2) AS INTEGER) * 60 + CAST(substr({0}, 4, 2) AS INTEGER))"
+_DURATION_SQL=(
+    "(CASE WHEN {0}start_time IS NOT NULL AND {0}end_time IS NOT NULL "
+    f"THEN ({_MINUTES_SQL.format('{0}end_time')} - {_MINUTES_SQL.format('{0}start_time')} + 1440) % 1440 "
+    "ELSE 0 END)"
+)
+
+
+# Начало и конец смены в минутах от полуночи ее даты; конец смены через
+# полночь больше 1440 (22:00–03:00 -> 1320..1620). Колонки вычисляет SQLite.
+_TIME_GLOB="GLOB '[0-2][0-9]:[0-5][0-9]'"
+_START_MIN_SQL=f"CASE WHEN start_time {_TIME_GLOB} THEN {_MINUTES_SQL.format('start_time')} END"
+_END_MIN_SQL=(
+    f"CASE WHEN start_time {_TIME_GLOB} AND end_time {_TIME_GLOB} THEN {_MINUTES_SQL.format('start_time')} + "
+    f"({_MINUTES_SQL.format('end_time')} - {_MINUTES_SQL.format('start_time')} + 1440) % 1440 END"
+)
+
+
+def _to_db(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def _shift_interval(shift: Dict[str, Any]) -> Optional[tuple]:
+    """(дата, начало, конец) в минутах от полуночи даты; None — пересечение не проверить"""
+    start=parse_minutes(shift.get('start_time'))
+    end=parse_minutes(shift.get('end_time'))
+    if not shift.get('date') or start<0 or end<0 or start == end:
+        return None
+    return shift['date'], start, start + (end - start) % 1440
+
+
+def _format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class ShiftOverlapError(Exception):
+    """Смена пересекается по времени с уже сохраненной; conflict — та смена.
+
+    shift_id — какая из изменяемых смен пересеклась (групповое изменение).
+    """
+
+    def __init__(self, conflict: Dict[str, Any], shift_id: Optional[int] = None):
+        super().__init__(f"Смена пересекается со сменой {conflict['id']}")
+        self.conflict=conflict
+        self.shift_id=shift_id
+
 
 class MultiUserDatabase:
     """База данных с поддержкой множества пользователей"""
 
     def __init__(self, db_path: str = "multiuser_shifts.db"):
         self.db_path=db_path
+        self._change_listeners=[]
         self.init_database()
 
     def init_database(self):
@@ -29,7 +93,8 @@ class MultiUserDatabase:
                     api_token TEXT UNIQUE,
                     is_active BOOLEAN DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP
+                    last_login TIMESTAMP,
+                    data_rev INTEGER NOT NULL DEFAULT 0
                 )
             ''')
 
@@ -45,9 +110,46 @@ class MultiUserDatabase:
                     end_time TEXT,
                     salary INTEGER,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    deleted_at TIMESTAMP,
+                    rev INTEGER NOT NULL DEFAULT 0,
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             ''')
+            self._migrate_shifts(conn)
+            self._migrate_users(conn)
+
+            # Счетчик ревизий для дельта-синхронизации
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+            conn.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('rev', 0), ('horizon', 0)")
+
+            # Настройки напоминаний: за сколько минут до начала смены (нет строки — выключены)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS reminder_settings (
+                    user_id TEXT PRIMARY KEY,
+                    minutes_before INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+
+            # Ежемесячные рассылки итогов: контрольная точка для продолжения после перезапуска
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS digest_runs (
+                    period TEXT PRIMARY KEY,
+                    last_user_id TEXT NOT NULL DEFAULT '',
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
 
             # Таблица сессий для веб-авторизации
             conn.execute('''
@@ -62,11 +164,85 @@ class MultiUserDatabase:
 
             # Индексы для производительности
             conn.execute('CREATE INDEX IF NOT EXISTS idx_shifts_user_id ON shifts(user_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_shifts_user_rev ON shifts(user_id, rev)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_shifts_user_date ON shifts(user_id, date)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_shifts_rev ON shifts(rev)')
+            # Проверка пересечений: смены пользователя за 3 дня одним диапазоном индекса
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_shifts_intervals ON shifts(user_id, date, start_min, end_min)
+                WHERE deleted_at IS NULL
+            ''')
+            # Статистика и навигатор: покрывающий индекс, агрегаты без чтения строк таблицы
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_shifts_stats ON shifts(user_id, date, program, salary)
+                WHERE deleted_at IS NULL
+            ''')
+            # Постраничный просмотр: ключ страницы (COALESCE(date, ''), COALESCE(start_time, ''), id)
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_shifts_page
+                ON shifts(user_id, COALESCE(date, ''), COALESCE(start_time, ''), id)
+                WHERE deleted_at IS NULL
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_shifts_deleted_at ON shifts(deleted_at)
+                WHERE deleted_at IS NOT NULL
+            ''')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id)')
             conn.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)')
 
             conn.commit()
 
+        self.purge_tombstones()
+
+    def _migrate_shifts(self, conn):
+        """Добавление колонок синхронизации в старые БД"""
+        columns={row[1] for row in conn.execute('PRAGMA table_info(shifts)')}
+        if 'updated_at' not in columns:
+            conn.execute('ALTER TABLE shifts ADD COLUMN updated_at TIMESTAMP')
+            conn.execute('UPDATE shifts SET updated_at = created_at')
+        if 'deleted_at' not in columns:
+            conn.execute('ALTER TABLE shifts ADD COLUMN deleted_at TIMESTAMP')
+        if 'rev' not in columns:
+            conn.execute('ALTER TABLE shifts ADD COLUMN rev INTEGER NOT NULL DEFAULT 0')
+        # Вычисляемые колонки (SQLite 3.31+) остаются верными при записи из любого места
+        columns={row[1] for row in conn.execute('PRAGMA table_xinfo(shifts)')}
+        if 'start_min' not in columns:
+            conn.execute(f'ALTER TABLE shifts ADD COLUMN start_min INTEGER GENERATED ALWAYS AS ({_START_MIN_SQL})')
+        if 'end_min' not in columns:
+            conn.execute(f'ALTER TABLE shifts ADD COLUMN end_min INTEGER GENERATED ALWAYS AS ({_END_MIN_SQL})')
+
+    def _migrate_users(self, conn):
+        """Версия данных пользователя для старых БД: последняя ревизия его смен"""
+        columns={row[1] for row in conn.execute('PRAGMA table_info(users)')}
+        if 'data_rev' not in columns:
+            conn.execute('ALTER TABLE users ADD COLUMN data_rev INTEGER NOT NULL DEFAULT 0')
+            conn.execute('''
+                UPDATE users SET data_rev = COALESCE(
+                    (SELECT MAX(rev) FROM shifts s WHERE s.user_id = users.user_id), 0)
+            ''')
+
+    def add_change_listener(self, callback):
+        """callback() вызывается после каждой записи смен этим объектом БД"""
+        self._change_listeners.append(callback)
+
+    def _notify_change(self):
+        for callback in self._change_listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in change listener: {e}")
+
+    def _next_rev(self, conn, user_id: str) -> int:
+        """Следующая ревизия (вызывается внутри транзакции записи смен user_id).
+
+        Ревизия же становится версией данных пользователя (users.data_rev):
+        она только растет, очистка удаленных смен ее не уменьшает.
+        """
+        conn.execute("UPDATE sync_state SET value = value + 1 WHERE key = 'rev'")
+        rev=conn.execute("SELECT value FROM sync_state WHERE key = 'rev'").fetchone()[0]
+        conn.execute('UPDATE users SET data_rev = ? WHERE user_id = ?', (rev, user_id))
+        return rev
+
     # ====== МЕТОДЫ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ ======
 
     def create_user_from_telegram(self, telegram_id: str, username: str = None,
@@ -213,13 +389,23 @@ class MultiUserDatabase:
 
     # ====== МЕТОДЫ ДЛЯ СМЕН (те же, что и раньше) ======
 
-    def add_shift(self, user_id: str, shift_data: Dict[str, Any]) -> bool:
-        """Добавление смены"""
+    def add_shift(self, user_id: str, shift_data: Dict[str, Any], allow_overlap: bool = False) -> bool:
+        """Добавление смены.
+
+        Если смена пересекается по времени с уже сохраненной, бросает
+        ShiftOverlapError (allow_overlap=True — сохранить все равно).
+        """
         try:
             with sqlite3.connect(self.db_path) as conn:
+                if not allow_overlap:
+                    conn.execute('BEGIN IMMEDIATE')
+                    conflict=self._find_overlap(conn, user_id, shift_data)
+                    if conflict:
+                        raise ShiftOverlapError(conflict)
                 conn.execute('''
-                    INSERT INTO shifts (user_id, date, role, program, start_time, end_time, salary)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    INSERT INTO shifts (user_id, date, role, program, start_time, end_time, salary,
+                                        updated_at, rev)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
                 ''', (
                     user_id,
                     shift_data.get('date').isoformat() if shift_data.get('date') else None,
@@ -227,70 +413,761 @@ class MultiUserDatabase:
                     shift_data.get('program'),
                     shift_data.get('start_time'),
                     shift_data.get('end_time'),
-                    shift_data.get('salary')
+                    shift_data.get('salary'),
+                    self._next_rev(conn, user_id)
                 ))
                 conn.commit()
+                self._notify_change()
             return True
+        except ShiftOverlapError:
+            raise
         except Exception as e:
             print(f"Error adding shift: {e}")
             return False
 
+    def add_shifts_batch(self, user_id: str, shifts: List[Dict[str, Any]],
+                         skip_conflicts: bool = False) -> Optional[int]:
+        """Добавление набора смен одной транзакцией (повторяющиеся смены).
+
+        skip_conflicts — пропустить даты, на которые у пользователя уже
+        есть смены; проверка идет внутри той же транзакции. Возвращает
+        число добавленных смен или None при ошибке (не добавлено ничего).
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                if skip_conflicts:
+                    taken=self._taken_dates(conn, user_id, [s['date'] for s in shifts if s.get('date')])
+                    shifts=[s for s in shifts if s.get('date') not in taken]
+
+                rev=self._next_rev(conn, user_id)
+                conn.executemany('''
+                    INSERT INTO shifts (user_id, date, role, program, start_time, end_time, salary,
+                                        updated_at, rev)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+                ''', [(
+                    user_id,
+                    shift.get('date').isoformat() if shift.get('date') else None,
+                    shift.get('role'),
+                    shift.get('program'),
+                    shift.get('start_time'),
+                    shift.get('end_time'),
+                    shift.get('salary'),
+                    rev
+                ) for shift in shifts])
+                conn.commit()
+                self._notify_change()
+            return len(shifts)
+        except Exception as e:
+            print(f"Error adding shifts batch: {e}")
+            return None
+
+    # ====== ПЕРЕСЕЧЕНИЯ СМЕН ======
+
+    def find_overlap(self, user_id: str, shift: Dict[str, Any],
+                     exclude_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Сохраненная смена, пересекающаяся по времени с shift (или None)"""
+        with sqlite3.connect(self.db_path) as conn:
+            return self._find_overlap(conn, user_id, shift, exclude_id)
+
+    def _find_overlap(self, conn, user_id: str, shift: Dict[str, Any],
+                      exclude_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Один диапазонный запрос по idx_shifts_intervals: вчера, сегодня и завтра.
+
+        Смена вчерашнего дня может заходить за полночь в этот день, эта
+        смена — в завтрашний; минуты соседних дней сдвигаются на ±1440.
+        Смены без даты или без времени начала и конца не проверяются.
+        """
+        interval=_shift_interval(shift)
+        if interval is None:
+            return None
+        day, start, end=interval
+        prev_day, next_day=(day - timedelta(days=1)).isoformat(), (day + timedelta(days=1)).isoformat()
+
+        row=conn.execute('''
+            SELECT id, date, role, program, start_time, end_time, salary FROM (
+                SELECT *, CASE date WHEN :prev THEN -1440 WHEN :next THEN 1440 ELSE 0 END AS shift_offset
+                FROM shifts
+                WHERE user_id = :user_id AND deleted_at IS NULL AND date BETWEEN :prev AND :next
+                  AND end_min IS NOT NULL AND id IS NOT :exclude
+            )
+            WHERE start_min + shift_offset < :end AND end_min + shift_offset > :start
+            ORDER BY date, start_min
+            LIMIT 1
+        ''', {'user_id': user_id, 'prev': prev_day, 'next': next_day, 'exclude': exclude_id,
+              'start': start, 'end': end}).fetchone()
+        return self._row_to_shift(row) if row else None
+
+    def merge_shift(self, user_id: str, shift_id: int, shift_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Объединение новой смены с пересекающейся сохраненной.
+
+        Время — от раннего начала до позднего конца, пустые поля
+        заполняются из новой смены, гонорары складываются. Возвращает
+        объединенную смену или None при ошибке. Если расширенное время
+        задевает еще одну смену, бросает ShiftOverlapError с ней.
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                row=conn.execute('''
+                    SELECT id, date, role, program, start_time, end_time, salary
+                    FROM shifts WHERE id = ? AND user_id = ? AND deleted_at IS NULL
+                ''', (shift_id, user_id)).fetchone()
+                if not row:
+                    return None
+                merged=self._row_to_shift(row)
+
+                existing, new=_shift_interval(merged), _shift_interval(shift_data)
+                if existing and new:
+                    offset=(new[0] - existing[0]).days * 1440
+                    start=min(existing[1], new[1] + offset)
+                    end=max(existing[2], new[2] + offset)
+                    merged['date']=existing[0] + timedelta(days=start // 1440)
+                    merged['start_time']=_format_minutes(start % 1440)
+                    merged['end_time']=_format_minutes(end % 1440)
+                for field in ('role', 'program'):
+                    merged[field]=merged[field] or shift_data.get(field)
+                if shift_data.get('salary') is not None:
+                    merged['salary']=(merged['salary'] or 0) + shift_data['salary']
+
+                conflict=self._find_overlap(conn, user_id, merged, shift_id)
+                if conflict:
+                    raise ShiftOverlapError(conflict)
+
+                conn.execute('''
+                    UPDATE shifts SET date = ?, role = ?, program = ?, start_time = ?, end_time = ?, salary = ?,
+                                      updated_at = CURRENT_TIMESTAMP, rev = ?
+                    WHERE id = ? AND user_id = ?
+                ''', (_to_db(merged['date']), merged['role'], merged['program'], merged['start_time'],
+                      merged['end_time'], merged['salary'], self._next_rev(conn, user_id), shift_id, user_id))
+                conn.commit()
+                self._notify_change()
+            return merged
+        except ShiftOverlapError:
+            raise
+        except Exception as e:
+            print(f"Error merging shift: {e}")
+            return None
+
+    def get_shifts_on_dates(self, user_id: str, dates: List[date]) -> Dict[date, List[Dict[str, Any]]]:
+        """Существующие смены пользователя на указанные даты (индекс user_id, date)"""
+        result={}
+        with sqlite3.connect(self.db_path) as conn:
+            for shift in self._shifts_on_dates(conn, user_id, dates):
+                result.setdefault(shift['date'], []).append(shift)
+        return result
+
+    def _taken_dates(self, conn, user_id: str, dates: List[date]) -> set:
+        return {shift['date'] for shift in self._shifts_on_dates(conn, user_id, dates)}
+
+    def _shifts_on_dates(self, conn, user_id: str, dates: List[date]) -> List[Dict[str, Any]]:
+        shifts=[]
+        dates=sorted({d.isoformat() for d in dates})
+        for chunk in _chunks(dates):
+            cursor=conn.execute(f'''
+                SELECT id, date, role, program, start_time, end_time, salary
+                FROM shifts WHERE user_id = ? AND deleted_at IS NULL
+                AND date IN ({", ".join("?" * len(chunk))})
+                ORDER BY date, start_time
+            ''', [user_id, *chunk])
+            shifts.extend(self._row_to_shift(row) for row in cursor)
+        return shifts
+
     def get_user_shifts(self, user_id: str) -> List[Dict[str, Any]]:
         """Получение всех смен пользователя"""
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor=conn.execute('''
                     SELECT id, date, role, program, start_time, end_time, salary
-                    FROM shifts WHERE user_id = ?
+                    FROM shifts WHERE user_id = ? AND deleted_at IS NULL
                     ORDER BY date DESC, start_time DESC
                 ''', (user_id,))
 
-                shifts=[]
-                for row in cursor.fetchall():
-                    shift={
-                        'id': row[0],
-                        'date': datetime.fromisoformat(row[1]).date() if row[1] else None,
-                        'role': row[2],
-                        'program': row[3],
-                        'start_time': row[4],
-                        'end_time': row[5],
-                        'salary': row[6]
-                    }
-                    shifts.append(shift)
-                return shifts
+                return [self._row_to_shift(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error getting shifts: {e}")
             return []
 
+    def iter_user_shifts(self, user_id: str) -> Iterator[Dict[str, Any]]:
+        """Смены пользователя по одной прямо из курсора (для экспорта)"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor=conn.execute('''
+                SELECT id, date, role, program, start_time, end_time, salary
+                FROM shifts WHERE user_id = ? AND deleted_at IS NULL
+                ORDER BY date, start_time
+            ''', (user_id,))
+            for row in cursor:
+                yield self._row_to_shift(row)
+
+    def get_shift_rows(self, user_id: str, date_from: Optional[date] = None,
+                       date_to: Optional[date] = None) -> List[tuple]:
+        """Смены кортежами (date, start_time, end_time, role, program, salary) для аналитики"""
+        query='''
+            SELECT date, start_time, end_time, role, program, salary
+            FROM shifts WHERE user_id = ? AND deleted_at IS NULL
+        '''
+        params=[user_id]
+        if date_from:
+            query+=' AND date >= ?'
+            params.append(date_from.isoformat())
+        if date_to:
+            query+=' AND date <= ?'
+            params.append(date_to.isoformat())
+
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute(query, params).fetchall()
+
+    def count_user_shifts(self, user_id: str, date_from: Optional[date] = None,
+                          date_to: Optional[date] = None) -> int:
+        """Количество смен пользователя (опционально — в диапазоне дат)"""
+        query='SELECT COUNT(*) FROM shifts WHERE user_id = ? AND deleted_at IS NULL'
+        params=[user_id]
+        if date_from:
+            query+=' AND date >= ?'
+            params.append(date_from.isoformat())
+        if date_to:
+            query+=' AND date <= ?'
+            params.append(date_to.isoformat())
+
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def get_user_shifts_page(self, user_id: str, date_from: Optional[date] = None,
+                             date_to: Optional[date] = None, after: Optional[tuple] = None,
+                             before: Optional[tuple] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """Страница смен по ключу (date, start_time, id), от старых к новым.
+
+        after — ключ последней смены предыдущей страницы, before — ключ
+        первой смены следующей страницы. Смены без даты идут первыми.
+        Отбор, ключ и сортировка записаны теми же выражениями, что и
+        idx_shifts_page, — страница читается из индекса без сортировки.
+        """
+        query='''
+            SELECT id, date, role, program, start_time, end_time, salary
+            FROM shifts WHERE user_id = ? AND deleted_at IS NULL
+        '''
+        params=[user_id]
+        # Смены без даты ('') не попадают ни в один месяц
+        if date_from:
+            query+=" AND COALESCE(date, '') >= ?"
+            params.append(date_from.isoformat())
+        if date_to:
+            query+=" AND COALESCE(date, '') BETWEEN '0' AND ?"
+            params.append(date_to.isoformat())
+
+        # Сравнение по первому полю ключа задает начало диапазона индекса,
+        # сравнение кортежей — точную границу внутри дня
+        sort_key="(COALESCE(date, ''), COALESCE(start_time, ''), id)"
+        if after:
+            query+=f" AND COALESCE(date, '') >= ? AND {sort_key} > (?, ?, ?)"
+            params.extend([after[0], *after])
+        elif before:
+            query+=f" AND COALESCE(date, '') <= ? AND {sort_key} < (?, ?, ?)"
+            params.extend([before[0], *before])
+
+        order='DESC' if before else 'ASC'
+        query+=f" ORDER BY COALESCE(date, '') {order}, COALESCE(start_time, '') {order}, id {order} LIMIT ?"
+        params.append(limit)
+
+        with sqlite3.connect(self.db_path) as conn:
+            shifts=[self._row_to_shift(row) for row in conn.execute(query, params)]
+
+        if before:
+            shifts.reverse()
+        return shifts
+
+    @staticmethod
+    def _row_to_shift(row) -> Dict[str, Any]:
+        """Преобразование строки (id, date, role, program, start_time, end_time, salary)"""
+        return {
+            'id': row[0],
+            'date': datetime.fromisoformat(row[1]).date() if row[1] else None,
+            'role': row[2],
+            'program': row[3],
+            'start_time': row[4],
+            'end_time': row[5],
+            'salary': row[6]
+        }
+
     def delete_shift(self, user_id: str, shift_id: int) -> bool:
-        """Удаление смены"""
+        """Удаление смены (мягкое: остается запись для синхронизации)"""
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor=conn.execute('''
-                    DELETE FROM shifts WHERE id = ? AND user_id = ?
-                ''', (shift_id, user_id))
+                    UPDATE shifts
+                    SET deleted_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP, rev = ?
+                    WHERE id = ? AND user_id = ? AND deleted_at IS NULL
+                ''', (self._next_rev(conn, user_id), shift_id, user_id))
                 conn.commit()
+                self._notify_change()
                 return cursor.rowcount>0
         except Exception as e:
             print(f"Error deleting shift: {e}")
             return False
 
-    def update_shift(self, user_id: str, shift_id: int, field: str, value: Any) -> bool:
+    def update_shift(self, user_id: str, shift_id: int, field: str, value: Any,
+                     allow_overlap: bool = False) -> bool:
         """Обновление поля смены"""
-        try:
-            if field == 'date' and value:
-                value=value.isoformat()
+        return self.update_shift_fields(user_id, shift_id, {field: value}, allow_overlap)
+
+    def update_shift_fields(self, user_id: str, shift_id: int, values: Dict[str, Any],
+                            allow_overlap: bool = False) -> bool:
+        """Обновление нескольких полей смены одной записью.
 
+        Если после изменения даты или времени смена пересекается с другой,
+        бросает ShiftOverlapError (allow_overlap=True — сохранить все равно).
+        """
+        unknown=set(values) - set(SHIFT_FIELDS)
+        if unknown:
+            raise ValueError(f"Неизвестное поле смены: {', '.join(sorted(unknown))}")
+        try:
             with sqlite3.connect(self.db_path) as conn:
+                if not allow_overlap and {'date', 'start_time', 'end_time'} & set(values):
+                    conn.execute('BEGIN IMMEDIATE')
+                    row=conn.execute('''
+                        SELECT id, date, role, program, start_time, end_time, salary
+                        FROM shifts WHERE id = ? AND user_id = ? AND deleted_at IS NULL
+                    ''', (shift_id, user_id)).fetchone()
+                    if row:
+                        conflict=self._find_overlap(conn, user_id, {**self._row_to_shift(row), **values}, shift_id)
+                        if conflict:
+                            raise ShiftOverlapError(conflict)
+
+                assignments=", ".join(f"{field} = ?" for field in values)
                 conn.execute(f'''
-                    UPDATE shifts SET {field} = ? WHERE id = ? AND user_id = ?
-                ''', (value, shift_id, user_id))
+                    UPDATE shifts SET {assignments}, updated_at = CURRENT_TIMESTAMP, rev = ?
+                    WHERE id = ? AND user_id = ? AND deleted_at IS NULL
+                ''', (*[_to_db(value) for value in values.values()], self._next_rev(conn, user_id), shift_id, user_id))
                 conn.commit()
+                self._notify_change()
             return True
+        except ShiftOverlapError:
+            raise
         except Exception as e:
             print(f"Error updating shift: {e}")
             return False
 
+    # ====== ГРУППОВЫЕ ОПЕРАЦИИ ======
+
+    def update_shifts(self, user_id: str, field: str, values: Dict[int, Any],
+                      allow_overlap: bool = False) -> Optional[Dict[int, Any]]:
+        """Изменение поля у нескольких смен одной транзакцией.
+
+        values — {id смены: новое значение}. Возвращает прежние значения
+        измененных смен (для отмены) или None при ошибке. После изменения
+        даты или времени каждая смена проверяется с уже новыми значениями
+        остальных выбранных; при пересечении транзакция откатывается и
+        бросается ShiftOverlapError (allow_overlap=True — сохранить все равно).
+        """
+        if field not in SHIFT_FIELDS:
+            raise ValueError(f"Неизвестное поле смены: {field}")
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                previous={}
+                for chunk in _chunks(list(values)):
+                    previous.update(conn.execute(f'''
+                        SELECT id, {field} FROM shifts
+                        WHERE user_id = ? AND deleted_at IS NULL AND id IN ({", ".join("?" * len(chunk))})
+                    ''', [user_id, *chunk]).fetchall())
+
+                rev=self._next_rev(conn, user_id)
+                conn.executemany(f'''
+                    UPDATE shifts SET {field} = ?, updated_at = CURRENT_TIMESTAMP, rev = ?
+                    WHERE id = ? AND user_id = ?
+                ''', [(_to_db(values[shift_id]), rev, shift_id, user_id) for shift_id in previous])
+
+                if not allow_overlap and field in ('date', 'start_time', 'end_time'):
+                    for chunk in _chunks(list(previous)):
+                        rows=conn.execute(f'''
+                            SELECT id, date, role, program, start_time, end_time, salary FROM shifts
+                            WHERE user_id = ? AND id IN ({", ".join("?" * len(chunk))})
+                        ''', [user_id, *chunk]).fetchall()
+                        for row in rows:
+                            conflict=self._find_overlap(conn, user_id, self._row_to_shift(row), row[0])
+                            if conflict:
+                                raise ShiftOverlapError(conflict, row[0])
+                conn.commit()
+                self._notify_change()
+
+            if field == 'date':
+                previous={k: date.fromisoformat(v) if v else None for k, v in previous.items()}
+            return previous
+        except ShiftOverlapError:
+            raise
+        except Exception as e:
+            print(f"Error updating shifts: {e}")
+            return None
+
+    def delete_shifts(self, user_id: str, shift_ids: List[int]) -> Optional[List[int]]:
+        """Мягкое удаление нескольких смен одной транзакцией; возвращает id удаленных"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                deleted=[]
+                for chunk in _chunks(shift_ids):
+                    deleted.extend(row[0] for row in conn.execute(f'''
+                        SELECT id FROM shifts
+                        WHERE user_id = ? AND deleted_at IS NULL AND id IN ({", ".join("?" * len(chunk))})
+                    ''', [user_id, *chunk]))
+
+                rev=self._next_rev(conn, user_id)
+                conn.executemany('''
+                    UPDATE shifts
+                    SET deleted_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP, rev = ?
+                    WHERE id = ? AND user_id = ?
+                ''', [(rev, shift_id, user_id) for shift_id in deleted])
+                conn.commit()
+                self._notify_change()
+            return deleted
+        except Exception as e:
+            print(f"Error deleting shifts: {e}")
+            return None
+
+    def restore_shifts(self, user_id: str, shift_ids: List[int]) -> int:
+        """Восстановление мягко удаленных смен (отмена удаления)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                rev=self._next_rev(conn, user_id)
+                cursor=conn.executemany('''
+                    UPDATE shifts SET deleted_at = NULL, updated_at = CURRENT_TIMESTAMP, rev = ?
+                    WHERE id = ? AND user_id = ? AND deleted_at IS NOT NULL
+                ''', [(rev, shift_id, user_id) for shift_id in shift_ids])
+                conn.commit()
+                self._notify_change()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"Error restoring shifts: {e}")
+            return 0
+
+    # ====== ПОДСКАЗКИ ДЛЯ ВВОДА ======
+
+    def get_shift_suggestions(self, user_id: str, limit: int = 6,
+                              half_life_days: float = SUGGESTION_HALF_LIFE_DAYS) -> Dict[str, Any]:
+        """Частые роли и программы пользователя и его последняя смена.
+
+        Каждая смена дает значению вес 1 / (1 + возраст / half_life_days),
+        так что частые и недавние значения идут первыми. Одним сгруппированным
+        запросом по обоим полям.
+        """
+        weight='1.0 / (1 + MAX(julianday(\'now\') - julianday(COALESCE(date, created_at)), 0) / ?)'
+        suggestions={'role': [], 'program': [], 'last': None}
+        with sqlite3.connect(self.db_path) as conn:
+            rows=conn.execute(f'''
+                SELECT field, value FROM (
+                    SELECT 'role' AS field, role AS value, SUM({weight}) AS score
+                    FROM shifts WHERE user_id = ? AND deleted_at IS NULL AND role IS NOT NULL AND role != ''
+                    GROUP BY role
+                    UNION ALL
+                    SELECT 'program', program, SUM({weight})
+                    FROM shifts WHERE user_id = ? AND deleted_at IS NULL AND program IS NOT NULL AND program != ''
+                    GROUP BY program
+                ) ORDER BY field, score DESC
+            ''', (half_life_days, user_id, half_life_days, user_id)).fetchall()
+            for field, value in rows:
+                if len(suggestions[field])<limit:
+                    suggestions[field].append(value)
+
+            row=conn.execute('''
+                SELECT id, date, role, program, start_time, end_time, salary
+                FROM shifts WHERE user_id = ? AND deleted_at IS NULL
+                ORDER BY id DESC LIMIT 1
+            ''', (user_id,)).fetchone()
+            if row:
+                suggestions['last']=self._row_to_shift(row)
+        return suggestions
+
+    # ====== НАПОМИНАНИЯ ======
+
+    def get_reminder_minutes(self, user_id: str) -> Optional[int]:
+        """За сколько минут напоминать о смене; None — напоминания выключены"""
+        with sqlite3.connect(self.db_path) as conn:
+            row=conn.execute('SELECT minutes_before FROM reminder_settings WHERE user_id = ?',
+                             (user_id,)).fetchone()
+            return row[0] if row else None
+
+    def set_reminder_minutes(self, user_id: str, minutes: Optional[int]):
+        with sqlite3.connect(self.db_path) as conn:
+            if minutes is None:
+                conn.execute('DELETE FROM reminder_settings WHERE user_id = ?', (user_id,))
+            else:
+                conn.execute('''
+                    INSERT INTO reminder_settings (user_id, minutes_before, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET minutes_before = excluded.minutes_before,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (user_id, minutes))
+            conn.commit()
+
+    def get_upcoming_reminders(self, date_from: date, date_to: date,
+                               user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Смены с временем начала в диапазоне дат у пользователей с включенными напоминаниями"""
+        query='''
+            SELECT s.id, s.user_id, u.telegram_id, s.date, s.start_time, s.end_time, s.role, s.program,
+                   r.minutes_before, s.deleted_at
+            FROM reminder_settings r
+            JOIN shifts s ON s.user_id = r.user_id
+            JOIN users u ON u.user_id = r.user_id
+            WHERE s.date BETWEEN ? AND ? AND s.deleted_at IS NULL AND s.start_time IS NOT NULL
+        '''
+        params=[date_from.isoformat(), date_to.isoformat()]
+        if user_id:
+            query+=' AND r.user_id = ?'
+            params.append(user_id)
+
+        with sqlite3.connect(self.db_path) as conn:
+            return [self._row_to_reminder(row) for row in conn.execute(query, params)]
+
+    def get_reminder_changes(self, since: int):
+        """Смены, измененные после ревизии since (все пользователи, индекс по rev).
+
+        Возвращает (строки, ревизия), как get_upcoming_reminders, плюс
+        флаг deleted; minutes_before — None, если напоминания выключены.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            token=conn.execute("SELECT value FROM sync_state WHERE key = 'rev'").fetchone()[0]
+            rows=conn.execute('''
+                SELECT s.id, s.user_id, u.telegram_id, s.date, s.start_time, s.end_time, s.role, s.program,
+                       r.minutes_before, s.deleted_at
+                FROM shifts s
+                JOIN users u ON u.user_id = s.user_id
+                LEFT JOIN reminder_settings r ON r.user_id = s.user_id
+                WHERE s.rev > ? AND s.rev <= ?
+            ''', (since, token)).fetchall()
+        return [self._row_to_reminder(row) for row in rows], token
+
+    @staticmethod
+    def _row_to_reminder(row) -> Dict[str, Any]:
+        return {
+            'shift_id': row[0],
+            'user_id': row[1],
+            'chat_id': row[2],
+            'date': datetime.fromisoformat(row[3]).date() if row[3] else None,
+            'start_time': row[4],
+            'end_time': row[5],
+            'role': row[6],
+            'program': row[7],
+            'minutes_before': row[8],
+            'deleted': row[9] is not None
+        }
+
+    # ====== ЕЖЕМЕСЯЧНЫЕ ИТОГИ ======
+
+    def get_digest_batch(self, period: date, after_user_id: str = '', limit: int = 200) -> List[Dict[str, Any]]:
+        """Итоги месяца period и предыдущего для пачки пользователей.
+
+        Один сгруппированный проход по индексу (user_id, date); пачки идут
+        по user_id (after_user_id — последний пользователь прошлой пачки).
+        Попадают только пользователи Telegram со сменами в этом месяце.
+        """
+        month_from=period.replace(day=1)
+        prev_from=(month_from - timedelta(days=1)).replace(day=1)
+        month_to=(month_from + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        duration=_DURATION_SQL.format('s.')
+
+        with sqlite3.connect(self.db_path) as conn:
+            rows=conn.execute(f'''
+                SELECT s.user_id, u.telegram_id,
+                       SUM(s.date >= :month_from),
+                       SUM(CASE WHEN s.date >= :month_from THEN COALESCE(s.salary, 0) ELSE 0 END),
+                       SUM(CASE WHEN s.date >= :month_from THEN {duration} ELSE 0 END),
+                       SUM(s.date < :month_from),
+                       SUM(CASE WHEN s.date < :month_from THEN COALESCE(s.salary, 0) ELSE 0 END),
+                       SUM(CASE WHEN s.date < :month_from THEN {duration} ELSE 0 END)
+                FROM shifts s
+                JOIN users u ON u.user_id = s.user_id
+                WHERE s.user_id > :after AND s.deleted_at IS NULL
+                  AND s.date BETWEEN :prev_from AND :month_to
+                  AND u.telegram_id IS NOT NULL AND u.is_active = 1
+                GROUP BY s.user_id
+                HAVING SUM(s.date >= :month_from) > 0
+                ORDER BY s.user_id
+                LIMIT :limit
+            ''', {
+                'month_from': month_from.isoformat(),
+                'prev_from': prev_from.isoformat(),
+                'month_to': month_to.isoformat(),
+                'after': after_user_id,
+                'limit': limit
+            }).fetchall()
+
+        return [{
+            'user_id': row[0],
+            'chat_id': row[1],
+            'count': row[2],
+            'salary': row[3],
+            'minutes': row[4],
+            'prev_count': row[5],
+            'prev_salary': row[6],
+            'prev_minutes': row[7]
+        } for row in rows]
+
+    def get_digest_run(self, period: str) -> Optional[Dict[str, Any]]:
+        """Состояние рассылки за период 'YYYY-MM'"""
+        with sqlite3.connect(self.db_path) as conn:
+            row=conn.execute('''
+                SELECT last_user_id, sent, failed, blocked, finished_at FROM digest_runs WHERE period = ?
+            ''', (period,)).fetchone()
+        if not row:
+            return None
+        return {'last_user_id': row[0], 'sent': row[1], 'failed': row[2], 'blocked': row[3],
+                'finished': row[4] is not None}
+
+    def save_digest_run(self, period: str, run: Dict[str, Any]):
+        """Контрольная точка рассылки: последний обработанный пользователь и счетчики"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('''
+                INSERT INTO digest_runs (period, last_user_id, sent, failed, blocked, finished_at)
+                VALUES (?, ?, ?, ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END)
+                ON CONFLICT(period) DO UPDATE SET
+                    last_user_id = excluded.last_user_id, sent = excluded.sent, failed = excluded.failed,
+                    blocked = excluded.blocked, finished_at = excluded.finished_at
+            ''', (period, run['last_user_id'], run['sent'], run['failed'], run['blocked'], run['finished']))
+            conn.commit()
+
+    # ====== ДЕЛЬТА-СИНХРОНИЗАЦИЯ ======
+
+    def get_user_version(self, user_id: str) -> int:
+        """Версия данных пользователя: ревизия последней записи его смен"""
+        with sqlite3.connect(self.db_path) as conn:
+            row=conn.execute('''
+                SELECT data_rev FROM users WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+            return row[0] if row else 0
+
+    def get_month_summary(self, user_id: str) -> List[Dict[str, Any]]:
+        """Месяцы, в которых есть смены: число смен и заработок, от новых к старым.
+
+        Один GROUP BY по индексу (user_id, date) для навигатора по годам и месяцам.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            rows=conn.execute('''
+                SELECT CAST(substr(date, 1, 4) AS INTEGER), CAST(substr(date, 6, 2) AS INTEGER),
+                       COUNT(*), COALESCE(SUM(salary), 0)
+                FROM shifts
+                WHERE user_id = ? AND deleted_at IS NULL AND date IS NOT NULL
+                GROUP BY substr(date, 1, 7)
+                ORDER BY substr(date, 1, 7) DESC
+            ''', (user_id,)).fetchall()
+        return [{'year': row[0], 'month': row[1], 'count': row[2], 'salary': row[3]} for row in rows]
+
+    def get_daily_buckets(self, user_id: str, date_from: date, date_to: date) -> List[tuple]:
+        """(дата, смен, заработок) по дням периода, где есть смены, по возрастанию даты.
+
+        Группировка идет в порядке покрывающего индекса idx_shifts_stats —
+        без сортировки и чтения строк таблицы.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute('''
+                SELECT date, COUNT(*), COALESCE(SUM(salary), 0)
+                FROM shifts
+                WHERE user_id = ? AND deleted_at IS NULL AND date >= ? AND date <= ?
+                GROUP BY date
+                ORDER BY date
+            ''', (user_id, date_from.isoformat(), date_to.isoformat())).fetchall()
+
+    def get_calendar_owner(self, api_token: str) -> Optional[Dict[str, Any]]:
+        """Владелец публичного календаря и версия его данных одним запросом"""
+        with sqlite3.connect(self.db_path) as conn:
+            row=conn.execute('''
+                SELECT u.user_id, u.full_name, u.data_rev
+                FROM users u WHERE u.api_token = ? AND u.is_active = 1
+            ''', (api_token,)).fetchone()
+
+            if row:
+                return {'user_id': row[0], 'full_name': row[1], 'version': row[2] or 0}
+            return None
+
+    def get_user_shifts_between(self, user_id: str, date_from: Optional[date] = None,
+                                date_to: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Смены пользователя с датой в диапазоне [date_from, date_to] (индекс user_id, date)"""
+        query='''
+            SELECT id, date, role, program, start_time, end_time, salary
+            FROM shifts
+            WHERE user_id = ? AND deleted_at IS NULL AND date IS NOT NULL
+        '''
+        params=[user_id]
+        if date_from:
+            query+=' AND date >= ?'
+            params.append(date_from.isoformat())
+        if date_to:
+            query+=' AND date <= ?'
+            params.append(date_to.isoformat())
+        query+=' ORDER BY date, start_time'
+
+        with sqlite3.connect(self.db_path) as conn:
+            return [self._row_to_shift(row) for row in conn.execute(query, params)]
+
+    def get_sync_token(self) -> int:
+        """Текущая ревизия БД (токен для следующей синхронизации)"""
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT value FROM sync_state WHERE key = 'rev'").fetchone()[0]
+
+    def get_shift_changes(self, user_id: str, since: int) -> Dict[str, Any]:
+        """Изменения смен пользователя после ревизии since.
+
+        Если since старше окна хранения удаленных записей, возвращается
+        полный снимок с флагом reset.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            state=dict(conn.execute('SELECT key, value FROM sync_state').fetchall())
+            token=state['rev']
+            reset=since<=0 or since<state['horizon'] or since>token
+
+            if reset:
+                cursor=conn.execute('''
+                    SELECT id, date, role, program, start_time, end_time, salary, updated_at
+                    FROM shifts
+                    WHERE user_id = ? AND deleted_at IS NULL AND rev <= ?
+                    ORDER BY rev
+                ''', (user_id, token))
+                deleted=[]
+            else:
+                cursor=conn.execute('''
+                    SELECT id, date, role, program, start_time, end_time, salary, updated_at, deleted_at
+                    FROM shifts
+                    WHERE user_id = ? AND rev > ? AND rev <= ?
+                    ORDER BY rev
+                ''', (user_id, since, token))
+                rows=cursor.fetchall()
+                deleted=[row[0] for row in rows if row[8]]
+                cursor=[row for row in rows if not row[8]]
+
+            upserts=[]
+            for row in cursor:
+                shift=self._row_to_shift(row)
+                shift['updated_at']=row[7]
+                upserts.append(shift)
+
+            return {
+                'upserts': upserts,
+                'deleted': deleted,
+                'reset': reset,
+                'token': token
+            }
+
+    def purge_tombstones(self, days: int = TOMBSTONE_RETENTION_DAYS) -> int:
+        """Удаление старых записей об удаленных сменах"""
+        with sqlite3.connect(self.db_path) as conn:
+            cutoff=f'-{days} days'
+            row=conn.execute('''
+                SELECT COUNT(*), MAX(rev) FROM shifts
+                WHERE deleted_at IS NOT NULL AND deleted_at < datetime('now', ?)
+            ''', (cutoff,)).fetchone()
+            if not row[0]:
+                return 0
+
+            conn.execute('''
+                DELETE FROM shifts
+                WHERE deleted_at IS NOT NULL AND deleted_at < datetime('now', ?)
+            ''', (cutoff,))
+            # Клиенты с токеном старше горизонта получат полный снимок
+            conn.execute('''
+                UPDATE sync_state SET value = MAX(value, ?) WHERE key = 'horizon'
+            ''', (row[1],))
+            conn.commit()
+            return row[0]
+
     # ====== СТАТИСТИКА ======
 
     def get_user_statistics(self, user_id: str) -> Dict:
@@ -299,7 +1176,7 @@ class MultiUserDatabase:
             # Общее количество смен
             cursor=conn.execute('''
                 SELECT COUNT(*), SUM(salary)
-                FROM shifts WHERE user_id = ?
+                FROM shifts WHERE user_id = ? AND deleted_at IS NULL
             ''', (user_id,))
             count, total_salary=cursor.fetchone()
 
@@ -307,7 +1184,7 @@ class MultiUserDatabase:
             cursor=conn.execute('''
                 SELECT strftime('%Y-%m', date) as month, COUNT(*), SUM(salary)
                 FROM shifts 
-                WHERE user_id = ? AND date IS NOT NULL
+                WHERE user_id = ? AND date IS NOT NULL AND deleted_at IS NULL
                 GROUP BY month
                 ORDER BY month DESC
                 LIMIT 12
@@ -325,4 +1202,105 @@ class MultiUserDatabase:
                 'total_shifts': count or 0,
                 'total_salary': total_salary or 0,
                 'monthly_stats': monthly_stats
-            }
\ No newline at end of file
+            }
+
+    def get_statistics_trends(self, user_id: str, today: Optional[date] = None) -> Dict[str, Any]:
+        """Скользящие окна 30/90/365 дней, месяцы год к году и лучший/худший
+        месяц каждой программы — одним запросом.
+
+        Каждое окно сравнивается с предыдущим окном той же длины; месяц — с
+        тем же месяцем прошлого года (LAG по номеру месяца); лучший и худший
+        месяц программы — ROW_NUMBER по заработку внутри программы. Смены
+        читаются из покрывающего индекса idx_shifts_stats, замер на большой
+        истории — bench_statistics.py.
+        """
+        today=(today or date.today()).isoformat()
+        with sqlite3.connect(self.db_path) as conn:
+            rows=conn.execute('''
+                WITH program_months AS (
+                    SELECT COALESCE(program, '') AS program, substr(date, 1, 7) AS month,
+                           COUNT(*) AS cnt, COALESCE(SUM(salary), 0) AS sal
+                    FROM shifts
+                    WHERE user_id = :user_id AND deleted_at IS NULL
+                      AND date IS NOT NULL AND date <= :today
+                    GROUP BY 1, 2
+                ),
+                monthly AS (
+                    SELECT month, SUM(cnt) AS cnt, SUM(sal) AS sal
+                    FROM program_months GROUP BY month
+                ),
+                yoy AS (
+                    SELECT month, cnt, sal,
+                           LAG(month) OVER same_month AS prev_month,
+                           LAG(cnt) OVER same_month AS prev_cnt,
+                           LAG(sal) OVER same_month AS prev_sal
+                    FROM monthly
+                    WINDOW same_month AS (PARTITION BY substr(month, 6, 2) ORDER BY month)
+                ),
+                daily AS (
+                    SELECT date, COUNT(*) AS cnt, COALESCE(SUM(salary), 0) AS sal
+                    FROM shifts
+                    WHERE user_id = :user_id AND deleted_at IS NULL
+                      AND date > date(:today, '-730 days') AND date <= :today
+                    GROUP BY date
+                ),
+                windows(days, since, before) AS (
+                    SELECT days, date(:today, (-days) || ' days'), date(:today, (-2 * days) || ' days')
+                    FROM (SELECT 30 AS days UNION ALL SELECT 90 UNION ALL SELECT 365)
+                ),
+                rolling AS (
+                    SELECT w.days,
+                           COALESCE(SUM(CASE WHEN d.date > w.since THEN d.cnt END), 0) AS cnt,
+                           COALESCE(SUM(CASE WHEN d.date > w.since THEN d.sal END), 0) AS sal,
+                           COALESCE(SUM(CASE WHEN d.date <= w.since THEN d.cnt END), 0) AS prev_cnt,
+                           COALESCE(SUM(CASE WHEN d.date <= w.since THEN d.sal END), 0) AS prev_sal
+                    FROM windows w
+                    LEFT JOIN daily d ON d.date > w.before
+                    GROUP BY w.days
+                ),
+                ranked AS (
+                    -- Одна сортировка на все оконные функции: месяцы программы от
+                    -- лучшего к худшему, худший — последний (place = months)
+                    SELECT program, month, cnt, sal,
+                           ROW_NUMBER() OVER by_salary AS place,
+                           COUNT(*) OVER by_salary AS months,
+                           SUM(sal) OVER by_salary AS total
+                    FROM program_months
+                    WINDOW by_salary AS (PARTITION BY program ORDER BY sal DESC, month DESC
+                                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+                )
+                SELECT 'window', days, NULL, cnt, sal, prev_cnt, prev_sal FROM rolling
+                UNION ALL
+                -- LAG дает тот же месяц предыдущего года, в котором были смены:
+                -- сравнение только с годом ровно на один раньше
+                SELECT 'yoy', month, NULL, cnt, sal,
+                       CASE WHEN substr(prev_month, 1, 4) + 1 = substr(month, 1, 4) + 0 THEN prev_cnt END,
+                       CASE WHEN substr(prev_month, 1, 4) + 1 = substr(month, 1, 4) + 0 THEN prev_sal END
+                FROM yoy
+                WHERE month > strftime('%Y-%m', :today, 'start of month', '-12 months')
+                UNION ALL
+                SELECT CASE WHEN place = 1 THEN 'best' ELSE 'worst' END, program, month, cnt, sal, months, total
+                FROM ranked
+                WHERE place = 1 OR (place = months AND months > 1)
+            ''', {'user_id': user_id, 'today': today}).fetchall()
+
+        windows=[]
+        year_over_year=[]
+        programs={}
+        for kind, key, month, count, salary, prev_a, prev_b in rows:
+            if kind == 'window':
+                windows.append({'days': key, 'count': count, 'salary': salary,
+                                'prev_count': prev_a, 'prev_salary': prev_b})
+            elif kind == 'yoy':
+                year_over_year.append({'month': key, 'count': count, 'salary': salary,
+                                       'prev_count': prev_a, 'prev_salary': prev_b})
+            else:
+                program=programs.setdefault(key, {'program': key or None, 'months': prev_a,
+                                                  'salary': prev_b, 'best': None, 'worst': None})
+                program[kind]={'month': month, 'count': count, 'salary': salary}
+
+        return {
+            'windows': sorted(windows, key=lambda row: row['days']),
+            'year_over_year': sorted(year_over_year, key=lambda row: row['month'], reverse=True),
+            'programs': sorted(programs.values(), key=lambda row: row['salary'], reverse=True)
+        }
\ No newline at end of file
@@ -0,0 +1,155 @@
+# digest.py - Ежемесячная рассылка итогов всем пользователям
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from telegram.error import BadRequest, Forbidden
+
+from database import MultiUserDatabase
+from rate_gateway import PRIORITY_BACKGROUND
+
+logger=logging.getLogger(__name__)
+
+# Выключатель рассылки (например, для второго экземпляра бота с той же базой)
+DIGEST_ENABLED=os.getenv("DIGEST_ENABLED", "1") == "1"
+# В котором часу 1-го числа рассылаются итоги прошлого месяца
+DIGEST_HOUR=int(os.getenv("DIGEST_HOUR", "10"))
+# Сколько пользователей в одной пачке (один запрос к БД и одна контрольная точка)
+DIGEST_BATCH_SIZE=int(os.getenv("DIGEST_BATCH_SIZE", "200"))
+# Сколько сообщений пачки одновременно ждут FloodGateway
+DIGEST_CONCURRENCY=int(os.getenv("DIGEST_CONCURRENCY", "8"))
+# Если бот был выключен 1-го числа, рассылка догоняет не дольше стольких дней
+DIGEST_CATCHUP_DAYS=int(os.getenv("DIGEST_CATCHUP_DAYS", "3"))
+
+
+def previous_month(day: date) -> date:
+    return (day.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def due_time(month: date) -> datetime:
+    """Время рассылки итогов: 1-е число месяца month в DIGEST_HOUR"""
+    return datetime.combine(month.replace(day=1), datetime.min.time()).replace(hour=DIGEST_HOUR)
+
+
+def next_due_time(now: datetime) -> datetime:
+    """Ближайшее будущее время рассылки (этого месяца, если оно еще не наступило)"""
+    due=due_time(now.date())
+    if now<due:
+        return due
+    return due_time(due.date() + timedelta(days=32))
+
+
+class MonthlyDigest:
+    """Рассылка итогов месяца: смены, часы, заработок и сравнение с прошлым месяцем.
+
+    Итоги считаются в БД пачками по DIGEST_BATCH_SIZE пользователей (один
+    сгруппированный запрос на пачку), тексты пачки готовятся сразу, а
+    отправка идет через FloodGateway в фоновой очереди — интерактивные
+    ответы бота рассылку обгоняют. После каждой пачки в digest_runs
+    пишется контрольная точка, поэтому после перезапуска рассылка
+    продолжается с места остановки (повторно может уйти не больше одной
+    пачки).
+    """
+
+    def __init__(self, db: MultiUserDatabase, render: Callable[[Dict[str, Any], date], str],
+                 batch_size: int = DIGEST_BATCH_SIZE, concurrency: int = DIGEST_CONCURRENCY):
+        self.db=db
+        self.render=render  # render(итоги пользователя, первое число месяца) -> текст
+        self.batch_size=batch_size
+        self.concurrency=concurrency
+        self.application=None
+        self._task: Optional[asyncio.Task]=None
+
+    def start(self, application):
+        """Запуск из post_init приложения"""
+        self.application=application
+        if DIGEST_ENABLED:
+            self._task=asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task=None
+
+    # ====== Расписание ======
+
+    async def _run(self):
+        while True:
+            try:
+                period=await asyncio.to_thread(self._due_period, datetime.now())
+                if period:
+                    await self.send(period)
+            except Exception as e:
+                logger.error(f"Ошибка в MonthlyDigest: {e}")
+
+            # Сон до ближайшей рассылки, но не дольше суток (перевод часов, сбои)
+            now=datetime.now()
+            await asyncio.sleep(min((next_due_time(now) - now).total_seconds(), 86400))
+
+    def _due_period(self, now: datetime) -> Optional[date]:
+        """Месяц, итоги которого пора (или все еще нужно) разослать"""
+        due=due_time(now.date())
+        if now<due or now - due>=timedelta(days=DIGEST_CATCHUP_DAYS):
+            return None
+        period=previous_month(now.date())
+        run=self.db.get_digest_run(period.strftime("%Y-%m"))
+        if run and run["finished"]:
+            return None
+        return period
+
+    # ====== Рассылка ======
+
+    async def send(self, period: date) -> Dict[str, Any]:
+        """Разослать итоги месяца period; незаконченная рассылка продолжается"""
+        key=period.strftime("%Y-%m")
+        run=await asyncio.to_thread(self.db.get_digest_run, key)
+        if run and run["finished"]:
+            return run
+        if run:
+            logger.info(f"Итоги {key}: продолжение после {run['last_user_id']}, уже отправлено {run['sent']}")
+        else:
+            run={"last_user_id": "", "sent": 0, "failed": 0, "blocked": 0, "finished": False}
+
+        bot=self.application.bot
+        semaphore=asyncio.Semaphore(self.concurrency)
+        started=time.monotonic()
+        sent_before=run["sent"]
+
+        while True:
+            rows=await asyncio.to_thread(self.db.get_digest_batch, period, run["last_user_id"], self.batch_size)
+            if not rows:
+                break
+            messages=[(row["chat_id"], self.render(row, period)) for row in rows]
+            results=await asyncio.gather(*(self._deliver(bot, semaphore, chat_id, text)
+                                           for chat_id, text in messages))
+            for result in results:
+                run[result]+=1
+            run["last_user_id"]=rows[-1]["user_id"]
+            await asyncio.to_thread(self.db.save_digest_run, key, run)
+
+        run["finished"]=True
+        await asyncio.to_thread(self.db.save_digest_run, key, run)
+        elapsed=time.monotonic() - started
+        logger.info(f"Итоги {key} разосланы: отправлено {run['sent']}, заблокировали бота {run['blocked']}, "
+                    f"ошибок {run['failed']}; {(run['sent'] - sent_before) / max(elapsed, 1e-9):.1f} сообщений/с")
+        return run
+
+    async def _deliver(self, bot, semaphore: asyncio.Semaphore, chat_id: int, text: str) -> str:
+        """Отправка одного сообщения; возвращает счетчик: sent, blocked или failed"""
+        async with semaphore:
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, rate_limit_args=PRIORITY_BACKGROUND)
+                return "sent"
+            except Forbidden:
+                return "blocked"  # Пользователь остановил бота
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return "blocked"
+                logger.warning(f"Итоги не отправлены в чат {chat_id}: {e}")
+                return "failed"
+            except Exception as e:
+                logger.warning(f"Итоги не отправлены в чат {chat_id}: {e}")
+                return "failed"
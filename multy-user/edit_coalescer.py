@@ -0,0 +1,101 @@
+# edit_coalescer.py - Склейка частых правок и удалений сообщений
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from telegram.error import BadRequest
+
+from message_cleaner import MessageCleaner
+
+logger=logging.getLogger(__name__)
+
+
+class EditCoalescer:
+    """Откладывает edit_message_text на короткое окно и отправляет только
+    последнее состояние сообщения. Одинаковые правки не отправляются,
+    удаления (с отменой ждущих правок) передаются в MessageCleaner.
+
+    Используется всеми обработчиками, которые обновляют сообщение на месте
+    (цифровая клавиатура времени и гонорара и т.п.).
+    """
+
+    def __init__(self, cleaner: MessageCleaner, delay: float = 0.35, max_tracked: int = 10000):
+        self.cleaner=cleaner
+        self.delay=delay
+        self.max_tracked=max_tracked
+        self._pending_edits: Dict[Tuple[int, int], dict]={}
+        self._last_sent: Dict[Tuple[int, int], tuple]={}
+        self._tasks: Dict[Tuple[int, int], asyncio.Task]={}
+
+    # ====== Правки ======
+
+    def edit(self, bot, chat_id: int, message_id: int, text: str, **kwargs):
+        """Запланировать правку; более поздний вызов заменяет более ранний"""
+        key=(chat_id, message_id)
+        self._pending_edits[key]={"bot": bot, "text": text, "kwargs": kwargs}
+        self._schedule(key, self._flush_edit(key))
+
+    async def _flush_edit(self, key: Tuple[int, int]):
+        await asyncio.sleep(self.delay)
+        self._tasks.pop(key, None)
+        await self._send_edit(key)
+
+    async def _send_edit(self, key: Tuple[int, int]):
+        pending=self._pending_edits.pop(key, None)
+        if not pending:
+            return
+
+        kwargs=pending["kwargs"]
+        markup=kwargs.get("reply_markup")
+        state=(pending["text"], markup.to_json() if markup is not None else None, kwargs.get("parse_mode"))
+        if self._last_sent.get(key) == state:
+            return  # Сообщение уже в этом состоянии
+
+        chat_id, message_id=key
+        if len(self._last_sent)>=self.max_tracked:
+            self._last_sent.clear()
+
+        try:
+            await pending["bot"].edit_message_text(
+                pending["text"], chat_id=chat_id, message_id=message_id, **kwargs
+            )
+            self._last_sent[key]=state
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self._last_sent[key]=state
+            else:
+                logger.warning(f"Не удалось изменить сообщение {message_id}: {e}")
+        except Exception as e:
+            logger.warning(f"Не удалось изменить сообщение {message_id}: {e}")
+
+    def discard(self, chat_id: int, message_id: int):
+        """Отменить отложенную правку (сообщение будет удалено или заменено)"""
+        key=(chat_id, message_id)
+        self._pending_edits.pop(key, None)
+        self._last_sent.pop(key, None)
+        task=self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+
+    def delete(self, bot, chat_id: int, message_id: int):
+        """Отменить ждущую правку и удалить сообщение в фоне"""
+        self.discard(chat_id, message_id)
+        self.cleaner.delete(bot, chat_id, [message_id])
+
+    # ====== Общее ======
+
+    def _schedule(self, key, coro):
+        """Одна отложенная задача на ключ: новые вызовы только обновляют состояние"""
+        if key in self._tasks:
+            coro.close()
+            return
+        self._tasks[key]=asyncio.get_running_loop().create_task(coro)
+
+    async def flush(self, chat_id: Optional[int] = None):
+        """Немедленно отправить накопленные правки (для чата или для всех)"""
+        for key, task in list(self._tasks.items()):
+            if chat_id is not None and key[0] != chat_id:
+                continue
+            task.cancel()
+            self._tasks.pop(key, None)
+            await self._send_edit(key)
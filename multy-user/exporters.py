@@ -0,0 +1,198 @@
+# exporters.py - Экспорт смен в JSON, CSV и iCalendar без временных файлов
+import csv
+import gzip
+import io
+import json
+import shutil
+import tempfile
+from datetime import datetime, date, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# До этого размера экспорт держится в памяти, дальше — в анонимном временном файле
+EXPORT_SPOOL_SIZE=1024 * 1024
+# Экспорт больше этого размера отправляется сжатым (.gz)
+EXPORT_GZIP_THRESHOLD=256 * 1024
+
+EXPORT_FORMATS={
+    "json": ("JSON", "application/json"),
+    "csv": ("CSV (Excel)", "text/csv"),
+    "ics": ("iCalendar", "text/calendar"),
+}
+
+SHIFT_FIELDS=["date", "role", "program", "start_time", "end_time", "salary"]
+
+
+# ====== Время смены ======
+
+def _parse_date(value) -> Optional[date]:
+    if not value:
+        return None
+    if isinstance(value, date):
+        return value
+    return datetime.fromisoformat(value).date()
+
+
+def _parse_time(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not value:
+        return None
+    try:
+        hours, minutes=map(int, value.split(":"))
+        return hours, minutes
+    except (ValueError, AttributeError):
+        return None
+
+
+def shift_bounds(shift: Dict[str, Any]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Начало и конец смены; конец раньше начала означает переход через полночь"""
+    shift_date=_parse_date(shift.get("date"))
+    if not shift_date:
+        return None, None
+
+    start=_parse_time(shift.get("start_time"))
+    end=_parse_time(shift.get("end_time"))
+
+    start_dt=datetime.combine(shift_date, datetime.min.time()).replace(hour=start[0], minute=start[1]) \
+        if start else None
+    end_dt=datetime.combine(shift_date, datetime.min.time()).replace(hour=end[0], minute=end[1]) \
+        if end else None
+
+    if start_dt and end_dt and end_dt<=start_dt:
+        end_dt+=timedelta(days=1)
+
+    return start_dt, end_dt
+
+
+# ====== Форматы ======
+
+def _shift_row(shift: Dict[str, Any]) -> Dict[str, Any]:
+    row={field: shift.get(field) for field in SHIFT_FIELDS}
+    if row["date"] and hasattr(row["date"], "isoformat"):
+        row["date"]=row["date"].isoformat()
+    return row
+
+
+def write_json(out, shifts: Iterable[Dict[str, Any]], meta: Dict[str, Any]):
+    """Компактный JSON; смены пишутся по одной, без сборки общего списка"""
+    header=json.dumps(meta, ensure_ascii=False, separators=(",", ":"))
+    out.write(header[:-1].encode("utf-8"))
+    out.write(b',"shifts":[' if meta else b'"shifts":[')
+
+    for index, shift in enumerate(shifts):
+        if index:
+            out.write(b",")
+        out.write(json.dumps(_shift_row(shift), ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    out.write(b"]}")
+
+
+def write_csv(out, shifts: Iterable[Dict[str, Any]], meta: Dict[str, Any]):
+    """CSV с BOM, чтобы Excel правильно открыл кириллицу"""
+    text=io.TextIOWrapper(out, encoding="utf-8-sig", newline="", write_through=True)
+    writer=csv.DictWriter(text, fieldnames=SHIFT_FIELDS)
+    writer.writeheader()
+    for shift in shifts:
+        writer.writerow(_shift_row(shift))
+    text.detach()
+
+
+def _ics_escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
+
+
+def _ics_line(line: str) -> bytes:
+    """Строка iCalendar со свёрткой по 75 октетов (RFC 5545)"""
+    data=line.encode("utf-8")
+    if len(data)<=75:
+        return data + b"\r\n"
+
+    chunks=[]
+    current=b""
+    for char in line:
+        encoded=char.encode("utf-8")
+        if len(current) + len(encoded)>75:
+            chunks.append(current)
+            current=b" "
+        current+=encoded
+    chunks.append(current)
+    return b"\r\n".join(chunks) + b"\r\n"
+
+
+def ics_event_lines(shift: Dict[str, Any], uid_domain: str = "ra_bot") -> Iterable[str]:
+    """Строки VEVENT для одной смены (пусто, если у смены нет даты)"""
+    shift_date=_parse_date(shift.get("date"))
+    if not shift_date:
+        return []
+
+    start_dt, end_dt=shift_bounds(shift)
+    summary=shift.get("program") or "Смена"
+    if shift.get("role"):
+        summary=f"{summary} ({shift['role']})"
+
+    uid=shift.get("id") or f"{shift_date.isoformat()}-{shift.get('start_time') or ''}"
+    lines=[
+        "BEGIN:VEVENT",
+        f"UID:shift-{uid}@{uid_domain}",
+        f"DTSTAMP:{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}",
+    ]
+
+    if start_dt:
+        lines.append(f"DTSTART:{start_dt.strftime('%Y%m%dT%H%M%S')}")
+        if end_dt:
+            lines.append(f"DTEND:{end_dt.strftime('%Y%m%dT%H%M%S')}")
+    else:
+        # Без времени начала — событие на весь день
+        lines.append(f"DTSTART;VALUE=DATE:{shift_date.strftime('%Y%m%d')}")
+        lines.append(f"DTEND;VALUE=DATE:{(shift_date + timedelta(days=1)).strftime('%Y%m%d')}")
+
+    lines.append(f"SUMMARY:{_ics_escape(summary)}")
+    if shift.get("salary") is not None:
+        description=f"Гонорар: {shift['salary']} ₽"
+        lines.append(f"DESCRIPTION:{_ics_escape(description)}")
+    lines.append("END:VEVENT")
+    return lines
+
+
+def write_ics(out, shifts: Iterable[Dict[str, Any]], meta: Dict[str, Any]):
+    """Календарь iCalendar со сменами как VEVENT"""
+    out.write(_ics_line("BEGIN:VCALENDAR"))
+    out.write(_ics_line("VERSION:2.0"))
+    out.write(_ics_line("PRODID:-//ra_bot//Shifts//RU"))
+    out.write(_ics_line("CALSCALE:GREGORIAN"))
+    out.write(_ics_line(f"X-WR-CALNAME:{_ics_escape(meta.get('calendar_name', 'Смены'))}"))
+
+    for shift in shifts:
+        for line in ics_event_lines(shift):
+            out.write(_ics_line(line))
+
+    out.write(_ics_line("END:VCALENDAR"))
+
+
+WRITERS={
+    "json": write_json,
+    "csv": write_csv,
+    "ics": write_ics,
+}
+
+
+def build_export(fmt: str, shifts: Iterable[Dict[str, Any]], meta: Dict[str, Any],
+                 basename: str) -> Tuple[Any, str]:
+    """Собирает экспорт в памяти (или в анонимном файле для больших объемов).
+
+    Возвращает (файловый объект, имя файла). Крупный экспорт сжимается gzip.
+    """
+    out=tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    WRITERS[fmt](out, shifts, meta)
+    filename=f"{basename}.{fmt}"
+
+    if out.tell()>EXPORT_GZIP_THRESHOLD:
+        out.seek(0)
+        compressed=tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        with gzip.GzipFile(filename=filename, mode="wb", fileobj=compressed) as gz:
+            shutil.copyfileobj(out, gz)
+        out.close()
+        out=compressed
+        filename+=".gz"
+
+    out.seek(0)
+    return out, filename
@@ -0,0 +1,99 @@
+# flow_metrics.py - Замер запросов к Bot API и времени ввода одной смены
+import contextvars
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.request import HTTPXRequest
+
+from rate_gateway import HTTP_POOL_SIZE
+
+logger=logging.getLogger(__name__)
+
+# Замер текущего диалога; задается на время обработки апдейта и
+# наследуется фоновыми задачами (склейка правок, удаления)
+_active_flow: contextvars.ContextVar[Optional[dict]]=contextvars.ContextVar("active_flow", default=None)
+
+
+class FlowStats:
+    """Накопленные показатели завершенных диалогов по режимам ввода"""
+
+    def __init__(self):
+        self._totals: Dict[str, Dict[str, float]]={}
+        self._lock=threading.Lock()
+
+    def record(self, mode: str, api_calls: int, updates: int, duration: float):
+        with self._lock:
+            totals=self._totals.setdefault(mode, {"flows": 0, "api_calls": 0, "updates": 0, "duration": 0.0})
+            totals["flows"]+=1
+            totals["api_calls"]+=api_calls
+            totals["updates"]+=updates
+            totals["duration"]+=duration
+
+    def averages(self) -> Dict[str, Dict[str, float]]:
+        """Средние на одну смену: запросы к API, апдейты и время ввода"""
+        with self._lock:
+            return {
+                mode: {
+                    "flows": totals["flows"],
+                    "api_calls": totals["api_calls"] / totals["flows"],
+                    "updates": totals["updates"] / totals["flows"],
+                    "duration": totals["duration"] / totals["flows"],
+                }
+                for mode, totals in self._totals.items()
+            }
+
+
+flow_stats=FlowStats()
+
+
+class CountingRequest(HTTPXRequest):
+    """HTTPXRequest, который считает запросы к Bot API в активном замере.
+
+    У HTTPXRequest по умолчанию одно соединение (ApplicationBuilder без
+    своего request дает 256), поэтому пул задается явно — иначе все
+    исходящие запросы бота шли бы по очереди.
+    """
+
+    def __init__(self, connection_pool_size: int = HTTP_POOL_SIZE, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+
+    async def do_request(self, *args, **kwargs):
+        flow=_active_flow.get()
+        if flow is not None:
+            flow["api_calls"]+=1
+        return await super().do_request(*args, **kwargs)
+
+
+def start_flow(user_data: dict, mode: str):
+    """Начать замер ввода смены (classic или inline)"""
+    flow={"mode": mode, "started": time.time(), "api_calls": 0, "updates": 1}
+    user_data["flow"]=flow
+    _active_flow.set(flow)
+
+
+def finish_flow(user_data: dict):
+    """Завершить замер после сохранения смены и записать результат"""
+    flow=user_data.pop("flow", None)
+    if not flow:
+        return
+
+    duration=time.time() - flow["started"]
+    flow_stats.record(flow["mode"], flow["api_calls"], flow["updates"], duration)
+    average=flow_stats.averages()[flow["mode"]]
+    logger.info(
+        f"Смена введена ({flow['mode']}): {flow['api_calls']} запросов к API, "
+        f"{flow['updates']} апдейтов, {duration:.1f} c; "
+        f"в среднем за {average['flows']} смен: {average['api_calls']:.1f} запросов, {average['duration']:.1f} c"
+    )
+
+
+async def bind_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Привязывает замер пользователя к обработке апдейта (группа -1)"""
+    flow=context.user_data.get("flow") if context.user_data is not None else None
+    if flow is not None:
+        flow["updates"]+=1
+    _active_flow.set(flow)
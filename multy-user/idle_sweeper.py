@@ -0,0 +1,136 @@
+# idle_sweeper.py - Таймауты диалогов и вытеснение неактивных user_data
+import asyncio
+import logging
+import os
+import time
+from collections.abc import MutableMapping
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram.ext import ConversationHandler
+
+logger=logging.getLogger(__name__)
+
+# Брошенный на полпути диалог завершается через столько секунд (нужен JobQueue)
+CONVERSATION_TIMEOUT=float(os.getenv("CONVERSATION_TIMEOUT", "900"))
+# user_data неактивного пользователя очищается и выгружается из памяти
+USER_DATA_IDLE=float(os.getenv("USER_DATA_IDLE", "3600"))
+SWEEP_INTERVAL=float(os.getenv("SWEEP_INTERVAL", "300"))
+# Состояния внутри ConversationHandler (python-telegram-bot 20.0–22.x, проверено
+# на 22.8): у persistent-обработчика это TrackingDict (MutableMapping, не dict).
+# Публичного способа завершить диалог по ключу в PTB нет; удаление из него
+# попадает в persistence при следующем update_persistence
+_HANDLER_CONVERSATIONS="_conversations"
+
+
+class IdleSweeper:
+    """Периодически обходит пользователей, неактивных дольше idle_after.
+
+    Для каждого вызывается on_expire(user_id, user_data) — он убирает
+    висящие подсказки и временные ключи, — затем незавершенные диалоги
+    пользователя завершаются (после перезапуска таймаутов диалогов нет,
+    и без этого пользователь остался бы в середине диалога с пустыми
+    user_data), а данные выгружаются из памяти через
+    SQLitePersistence.evict_user. Пустые chat_data удаляются. После
+    прохода в лог пишется объем данных в памяти (footprint).
+    """
+
+    def __init__(self, on_expire: Optional[Callable[[int, dict], Awaitable[None]]] = None,
+                 idle_after: float = USER_DATA_IDLE, interval: float = SWEEP_INTERVAL):
+        self.on_expire=on_expire
+        self.idle_after=idle_after
+        self.interval=interval
+        self.application=None
+        self.last_footprint: Dict[str, int]={}
+        self._task: Optional[asyncio.Task]=None
+
+    def start(self, application):
+        """Запуск из post_init приложения"""
+        for handler in self.conversation_handlers(application):
+            if not isinstance(getattr(handler, _HANDLER_CONVERSATIONS, None), MutableMapping):
+                raise RuntimeError(
+                    f"ConversationHandler.{_HANDLER_CONVERSATIONS} не найден: завершение диалогов "
+                    f"не поддерживает эту версию python-telegram-bot"
+                )
+        self.application=application
+        self._task=asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task=None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка в IdleSweeper.sweep: {e}")
+
+    async def sweep(self) -> int:
+        """Один проход; возвращает число выгруженных пользователей"""
+        application=self.application
+        persistence=application.persistence
+        started=time.monotonic()
+
+        evicted=0
+        for user_id in persistence.idle_users(self.idle_after):
+            user_data=application.user_data.get(user_id)
+            if user_data and self.on_expire:
+                try:
+                    await self.on_expire(user_id, user_data)
+                except Exception as e:
+                    logger.warning(f"Не удалось очистить данные пользователя {user_id}: {e}")
+            self.end_conversations(user_id)
+            persistence.evict_user(user_id)
+            evicted+=1
+
+        # chat_data боты не используют: пустые словари создаются при обращении
+        for chat_id in [chat_id for chat_id, data in application.chat_data.items() if not data]:
+            application.drop_chat_data(chat_id)
+
+        self.last_footprint=self.footprint()
+        logger.info(
+            f"Очистка памяти: выгружено {evicted}, в памяти {self.last_footprint['users']} пользователей, "
+            f"{self.last_footprint['chats']} чатов, ~{self.last_footprint['bytes'] // 1024} КБ "
+            f"({time.monotonic() - started:.2f} c)"
+        )
+        return evicted
+
+    @staticmethod
+    def conversation_handlers(application):
+        return [
+            handler for handlers in application.handlers.values() for handler in handlers
+            if isinstance(handler, ConversationHandler)
+        ]
+
+    def end_conversations(self, user_id: int) -> int:
+        """Завершить незавершенные диалоги пользователя в личном чате.
+
+        Вместе с состоянием снимается и задача таймаута диалога, иначе
+        conversation_timeout сработал бы позже для уже завершенного диалога.
+        """
+        ended=0
+        for handler in self.conversation_handlers(self.application):
+            # В личном чате chat_id совпадает с user_id
+            key=tuple(user_id for enabled in (handler.per_chat, handler.per_user) if enabled)
+            job=handler.timeout_jobs.pop(key, None)
+            if job is not None:
+                job.schedule_removal()
+            if getattr(handler, _HANDLER_CONVERSATIONS).pop(key, None) is not None:
+                ended+=1
+        return ended
+
+    def footprint(self) -> Dict[str, int]:
+        """Объем user_data и chat_data в памяти.
+
+        Размер user_data — оценка persistence по последним записям: обход
+        и сериализация всех данных на каждом проходе блокировали бы цикл
+        событий. chat_data боты не используют, они только считаются.
+        """
+        application=self.application
+        return {
+            "users": len(application.user_data),
+            "chats": len(application.chat_data),
+            "bytes": application.persistence.bytes_in_memory,
+        }
@@ -0,0 +1,100 @@
+# ingress.py - Прием апдейтов: long polling или webhook
+import asyncio
+import logging
+import os
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, ApplicationHandlerStop, ContextTypes, TypeHandler
+
+logger=logging.getLogger(__name__)
+
+# ====== Настройки ======
+BOT_MODE=os.getenv("BOT_MODE", "polling")  # polling | webhook
+WEBHOOK_URL=os.getenv("WEBHOOK_URL", "")  # Публичный адрес, например https://bot.example.com
+WEBHOOK_LISTEN=os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT=int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH=os.getenv("WEBHOOK_PATH", "telegram")
+# Обязателен в режиме webhook: Telegram присылает его в X-Telegram-Bot-Api-Secret-Token,
+# запросы без него отклоняются
+WEBHOOK_SECRET=os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Очередь между приемом и обработкой: при заполнении прием ждет, Telegram повторит доставку
+UPDATE_QUEUE_SIZE=int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Сколько последних update_id помнить для отсева повторов
+DEDUP_WINDOW=int(os.getenv("DEDUP_WINDOW", "10000"))
+# Адрес Bot API (для локальной заглушки, например http://127.0.0.1:8081/bot)
+BOT_API_BASE_URL=os.getenv("BOT_API_BASE_URL", "")
+
+
+class UpdateDeduplicator:
+    """Отбрасывает апдейты с уже виденным update_id.
+
+    Telegram повторяет доставку webhook, если не дождался ответа, а при
+    переключении режимов один апдейт может прийти дважды.
+    """
+
+    def __init__(self, window: int = DEDUP_WINDOW):
+        self._order=deque(maxlen=window)
+        self._seen=set()
+        self.duplicates=0
+
+    def seen(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            return True
+        if len(self._order) == self._order.maxlen:
+            self._seen.discard(self._order[0])
+        self._order.append(update_id)
+        self._seen.add(update_id)
+        return False
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if self.seen(update.update_id):
+            self.duplicates+=1
+            logger.info(f"Повторный апдейт {update.update_id} пропущен")
+            raise ApplicationHandlerStop
+
+
+def check_settings():
+    """Проверка настроек режима до сборки приложения"""
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_URL")
+        if not WEBHOOK_SECRET:
+            raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_SECRET")
+
+
+def configure_builder(builder: ApplicationBuilder) -> ApplicationBuilder:
+    """Ограниченная очередь апдейтов и (опционально) свой адрес Bot API"""
+    check_settings()
+    builder.update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+    if BOT_API_BASE_URL:
+        builder.base_url(BOT_API_BASE_URL)
+    return builder
+
+
+def add_dedup_handler(application: Application):
+    """Отсев повторов раньше всех остальных обработчиков"""
+    application.add_handler(TypeHandler(Update, UpdateDeduplicator()), group=-2)
+
+
+def run(application: Application):
+    """Запуск в режиме из BOT_MODE"""
+    if BOT_MODE == "webhook":
+        check_settings()
+        logger.info(f"Webhook: слушаем {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        application.run_polling(
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
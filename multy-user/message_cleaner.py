@@ -0,0 +1,92 @@
+# message_cleaner.py - Фоновое пакетное удаление сообщений
+import asyncio
+import logging
+from typing import Dict, Iterable, Set
+
+logger=logging.getLogger(__name__)
+
+# Bot API deleteMessages принимает до 100 идентификаторов за вызов
+DELETE_BATCH_SIZE=100
+
+
+class MessageCleaner:
+    """Удаляет сообщения в фоне, не задерживая ответ пользователю.
+
+    Идентификаторы копятся по чатам: пока идет запрос, новые удаления
+    собираются в следующий пакет. Пакеты уходят через deleteMessages,
+    а если он недоступен — поштучно, параллельно в пределах лимита.
+    Одновременных запросов на чат не больше max_per_chat, всего — не
+    больше max_concurrent. rate_limit_args передается ограничителю бота
+    (например, фоновый приоритет).
+    """
+
+    def __init__(self, max_per_chat: int = 2, max_concurrent: int = 16, rate_limit_args=None):
+        self.max_per_chat=max_per_chat
+        self._request_kwargs={"rate_limit_args": rate_limit_args} if rate_limit_args is not None else {}
+        self._global=asyncio.Semaphore(max_concurrent)
+        self._chat_limits: Dict[int, asyncio.Semaphore]={}
+        self._pending: Dict[int, Set[int]]={}
+        self._bots: Dict[int, object]={}
+        self._workers: Dict[int, asyncio.Task]={}
+        self.deleted=0
+        self.failed=0
+
+    def delete(self, bot, chat_id: int, message_ids: Iterable[int]):
+        """Запланировать удаление; возвращается сразу"""
+        pending=self._pending.setdefault(chat_id, set())
+        pending.update(message_ids)
+        if not pending:
+            return
+
+        self._bots[chat_id]=bot
+        if chat_id not in self._workers:
+            self._workers[chat_id]=asyncio.get_running_loop().create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id: int):
+        """Разбирает очередь чата, пока в ней что-то есть"""
+        try:
+            # Даем обработчику договорить: удаления этого апдейта уйдут одним пакетом
+            await asyncio.sleep(0)
+            while self._pending.get(chat_id):
+                message_ids=sorted(self._pending.pop(chat_id))
+                bot=self._bots[chat_id]
+                batches=[message_ids[i:i + DELETE_BATCH_SIZE]
+                         for i in range(0, len(message_ids), DELETE_BATCH_SIZE)]
+                await asyncio.gather(*(self._delete_batch(bot, chat_id, batch) for batch in batches))
+        finally:
+            self._workers.pop(chat_id, None)
+            self._bots.pop(chat_id, None)
+            self._chat_limits.pop(chat_id, None)
+
+    async def _delete_batch(self, bot, chat_id: int, message_ids):
+        limit=self._chat_limits.setdefault(chat_id, asyncio.Semaphore(self.max_per_chat))
+        try:
+            async with limit, self._global:
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids, **self._request_kwargs)
+            self.deleted+=len(message_ids)
+            return
+        except AttributeError:
+            pass  # Старая версия библиотеки без deleteMessages
+        except Exception as e:
+            logger.warning(f"Пакетное удаление в чате {chat_id} не удалось, удаляем по одному: {e}")
+
+        await asyncio.gather(*(self._delete_one(bot, chat_id, message_id, limit) for message_id in message_ids))
+
+    async def _delete_one(self, bot, chat_id: int, message_id: int, limit: asyncio.Semaphore):
+        try:
+            async with limit, self._global:
+                await bot.delete_message(chat_id=chat_id, message_id=message_id, **self._request_kwargs)
+            self.deleted+=1
+        except Exception as e:
+            self.failed+=1
+            logger.warning(f"Не удалось удалить сообщение {message_id}: {e}")
+
+    @property
+    def queued(self) -> int:
+        """Сколько сообщений ждет удаления"""
+        return sum(len(ids) for ids in self._pending.values())
+
+    async def flush(self):
+        """Дождаться всех удалений (при остановке бота)"""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
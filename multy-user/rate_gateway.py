@@ -0,0 +1,181 @@
+# rate_gateway.py - Исходящие запросы к Bot API с учетом лимитов Telegram
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger=logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду на чат
+GLOBAL_RATE=float(os.getenv("BOT_GLOBAL_RATE", "30"))
+CHAT_RATE=float(os.getenv("BOT_CHAT_RATE", "1"))
+CHAT_BURST=int(os.getenv("BOT_CHAT_BURST", "3"))
+MAX_RETRIES=int(os.getenv("BOT_MAX_RETRIES", "3"))
+METRICS_INTERVAL=float(os.getenv("BOT_METRICS_INTERVAL", "60"))
+
+# Пул HTTP-соединений к api.telegram.org
+HTTP_POOL_SIZE=int(os.getenv("BOT_HTTP_POOL_SIZE", "32"))
+HTTP_POOL_TIMEOUT=float(os.getenv("BOT_HTTP_POOL_TIMEOUT", "5"))
+
+# Полосы приоритета (rate_limit_args): ответы пользователю идут раньше фоновых
+PRIORITY_INTERACTIVE=0
+PRIORITY_BACKGROUND=1
+
+# Служебные методы не расходуют лимит на сообщения
+UNLIMITED_ENDPOINTS={
+    "getUpdates", "getMe", "answerCallbackQuery", "setWebhook", "deleteWebhook",
+    "getWebhookInfo", "setMyCommands", "logOut", "close",
+}
+
+
+class TokenBucket:
+    """Классическое ведро токенов: rate в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate=rate
+        self.capacity=capacity
+        self.tokens=capacity
+        self.updated=time.monotonic()
+        self.blocked_until=0.0
+
+    def reserve(self) -> float:
+        """Забрать токен; вернуть, сколько секунд подождать до отправки"""
+        now=time.monotonic()
+        self.tokens=min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated=now
+        self.tokens-=1
+        wait=-self.tokens / self.rate if self.tokens<0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float):
+        """Пауза после 429 с retry_after"""
+        self.blocked_until=max(self.blocked_until, time.monotonic() + seconds)
+
+
+class FloodGateway(BaseRateLimiter[int]):
+    """Ограничитель запросов для ApplicationBuilder().rate_limiter().
+
+    Общее ведро на бота и ведро на каждый чат. Фоновые запросы
+    (rate_limit_args=PRIORITY_BACKGROUND) ждут, пока в очереди есть
+    ответы пользователям. На 429 запрос повторяется после retry_after,
+    а чат (или весь бот) ставится на паузу.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, max_retries: int = MAX_RETRIES,
+                 metrics_interval: float = METRICS_INTERVAL):
+        self.global_bucket=TokenBucket(global_rate, global_rate)
+        self.chat_rate=chat_rate
+        self.chat_burst=chat_burst
+        self.max_retries=max_retries
+        self.metrics_interval=metrics_interval
+        self._chat_buckets: Dict[Any, TokenBucket]={}
+        self._waiting={PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self._interactive_idle=asyncio.Event()
+        self._interactive_idle.set()
+        self._reporter: Optional[asyncio.Task]=None
+        self.sent=0
+        self.throttled=0
+        self.retried=0
+
+    async def initialize(self) -> None:
+        if self.metrics_interval>0:
+            self._reporter=asyncio.get_running_loop().create_task(self._report())
+
+    async def shutdown(self) -> None:
+        if self._reporter:
+            self._reporter.cancel()
+            self._reporter=None
+
+    # ====== Метрики ======
+
+    def metrics(self) -> Dict[str, int]:
+        """Глубина очередей по полосам и счетчики отправки"""
+        return {
+            "waiting_interactive": self._waiting[PRIORITY_INTERACTIVE],
+            "waiting_background": self._waiting[PRIORITY_BACKGROUND],
+            "chats": len(self._chat_buckets),
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "retried": self.retried,
+        }
+
+    async def _report(self):
+        """Периодически пишет метрики в лог и забывает простаивающие чаты"""
+        last_sent=0
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            now=time.monotonic()
+            for chat_id, bucket in list(self._chat_buckets.items()):
+                if bucket.tokens>=bucket.capacity - 1 and now - bucket.updated>self.metrics_interval:
+                    del self._chat_buckets[chat_id]
+
+            metrics=self.metrics()
+            if metrics["sent"] != last_sent or metrics["waiting_interactive"] or metrics["waiting_background"]:
+                logger.info(f"Bot API: {metrics}")
+            last_sent=metrics["sent"]
+
+    # ====== Отправка ======
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket=self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket=self._chat_buckets[chat_id]=TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id, priority: int):
+        """Дождаться места в общем ведре и в ведре чата с учетом приоритета"""
+        self._waiting[priority]+=1
+        if priority == PRIORITY_INTERACTIVE:
+            self._interactive_idle.clear()
+        try:
+            if priority != PRIORITY_INTERACTIVE:
+                # Фоновые запросы пропускают вперед ответы пользователям
+                while self._waiting[PRIORITY_INTERACTIVE]:
+                    await self._interactive_idle.wait()
+
+            wait=self._chat_bucket(chat_id).reserve() if chat_id is not None else 0.0
+            wait=max(wait, self.global_bucket.reserve())
+            if wait>0:
+                self.throttled+=1
+                await asyncio.sleep(wait)
+        finally:
+            self._waiting[priority]-=1
+            if not self._waiting[PRIORITY_INTERACTIVE]:
+                self._interactive_idle.set()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ):
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        chat_id=data.get("chat_id")
+        priority=PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                result=await callback(*args, **kwargs)
+                self.sent+=1
+                return result
+            except RetryAfter as e:
+                delay=e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") \
+                    else float(e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+                self.retried+=1
+                logger.warning(f"429 от Telegram ({endpoint}, чат {chat_id}), повтор через {delay} c")
+                # Без чата (или при общем лимите) пауза касается всего бота
+                bucket=self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.block(delay)
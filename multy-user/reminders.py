@@ -0,0 +1,179 @@
+# reminders.py - Напоминания о сменах: очередь-куча по времени срабатывания
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from database import MultiUserDatabase
+
+logger=logging.getLogger(__name__)
+
+# На сколько часов вперед смены держатся в памяти
+REMINDER_HORIZON_HOURS=float(os.getenv("REMINDER_HORIZON_HOURS", "48"))
+# Как часто проверять ревизию БД на записи из других процессов (веб-сервер), секунд
+REMINDER_RESYNC_INTERVAL=float(os.getenv("REMINDER_RESYNC_INTERVAL", "300"))
+# Напоминание, опоздавшее больше чем на столько секунд (бот был выключен), не отправляется
+REMINDER_GRACE=float(os.getenv("REMINDER_GRACE", "120"))
+
+
+class ReminderScheduler:
+    """Напоминания за N минут до начала смены.
+
+    Ближайшие смены пользователей с включенными напоминаниями лежат в
+    min-куче по времени срабатывания; цикл спит до ближайшего
+    срабатывания, поэтому между напоминаниями процессор не занят, сколько
+    бы ни было пользователей. Изменения смен подтягиваются по ревизии
+    (rev) — сразу после записи через MultiUserDatabase (слушатель
+    изменений) и раз в resync_interval для записей из других процессов.
+    Устаревшие записи кучи не удаляются, а пропускаются при извлечении.
+    """
+
+    def __init__(self, db: MultiUserDatabase, on_fire: Callable[[Any, dict], Awaitable[None]],
+                 horizon_hours: float = REMINDER_HORIZON_HOURS,
+                 resync_interval: float = REMINDER_RESYNC_INTERVAL):
+        self.db=db
+        self.on_fire=on_fire  # on_fire(bot, напоминание)
+        self.application=None
+        self.horizon=timedelta(hours=horizon_hours)
+        self.resync_interval=resync_interval
+        self._heap: List[tuple]=[]  # (время срабатывания, порядковый номер, id смены)
+        self._entries: Dict[int, dict]={}  # id смены -> актуальное напоминание
+        self._counter=itertools.count()
+        self._rev=0
+        self._window_end: Optional[date]=None
+        self._reload_at=0.0
+        self._wakeup: Optional[asyncio.Event]=None
+        self._loop: Optional[asyncio.AbstractEventLoop]=None
+        self._task: Optional[asyncio.Task]=None
+        self._sending=set()
+        self.sent=0
+        db.add_change_listener(self.notify)
+
+    def start(self, application):
+        """Запуск из post_init приложения"""
+        self.application=application
+        self._loop=asyncio.get_running_loop()
+        self._wakeup=asyncio.Event()
+        self._task=self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task=None
+
+    def notify(self):
+        """Слушатель изменений БД: смены изменились, пора подтянуть ревизии"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def resync_user(self, user_id: str):
+        """Перечитать ближайшие смены пользователя (после смены его настроек)"""
+        for shift_id in [i for i, entry in self._entries.items() if entry["user_id"] == user_id]:
+            del self._entries[shift_id]
+        if self._window_end is None:
+            return
+        rows=await asyncio.to_thread(self.db.get_upcoming_reminders, date.today(), self._window_end, user_id)
+        for row in rows:
+            self._schedule(row)
+        self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    # ====== Цикл ======
+
+    async def _run(self):
+        last_check=0.0
+        while True:
+            try:
+                now=time.time()
+                if now>=self._reload_at:
+                    await self._reload()
+                elif self._wakeup.is_set() or now - last_check>=self.resync_interval:
+                    self._wakeup.clear()
+                    await self._sync()
+                    last_check=now
+                self._fire_due()
+            except Exception as e:
+                logger.error(f"Ошибка в ReminderScheduler: {e}")
+
+            timeout=min(self.resync_interval, self._reload_at - time.time())
+            if self._heap:
+                timeout=min(timeout, self._heap[0][0] - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _reload(self):
+        """Полная загрузка окна [сегодня, сегодня + horizon]"""
+        today=date.today()
+        window_end=(datetime.now() + self.horizon).date()
+        rev=await asyncio.to_thread(self.db.get_sync_token)
+        rows=await asyncio.to_thread(self.db.get_upcoming_reminders, today, window_end)
+
+        self._heap=[]
+        self._entries={}
+        self._rev=rev
+        self._window_end=window_end
+        for row in rows:
+            self._schedule(row)
+        # Окно сдвигается, когда пройдена половина горизонта
+        self._reload_at=time.time() + self.horizon.total_seconds() / 2
+        logger.info(f"Напоминания: загружено {len(self._entries)} до {window_end.strftime('%d.%m.%Y')}")
+
+    async def _sync(self):
+        """Изменения смен после последней известной ревизии"""
+        rows, rev=await asyncio.to_thread(self.db.get_reminder_changes, self._rev)
+        for row in rows:
+            self._entries.pop(row["shift_id"], None)
+            if not row["deleted"]:
+                self._schedule(row)
+        self._rev=rev
+
+    def _schedule(self, row: dict):
+        if row["minutes_before"] is None or not row["chat_id"] or not row["date"] or not row["start_time"]:
+            return
+        if row["date"]>self._window_end:
+            return  # Попадет в окно при следующей загрузке
+        try:
+            starts_at=datetime.combine(row["date"], datetime.strptime(row["start_time"], "%H:%M").time())
+        except ValueError:
+            return
+
+        fire_at=(starts_at - timedelta(minutes=row["minutes_before"])).timestamp()
+        if fire_at<time.time() - REMINDER_GRACE:
+            return
+        entry=dict(row, fire_at=fire_at)
+        self._entries[row["shift_id"]]=entry
+        heapq.heappush(self._heap, (fire_at, next(self._counter), row["shift_id"]))
+
+        # Пропущенных записей стало слишком много — пересобрать кучу
+        if len(self._heap)>2 * len(self._entries) + 64:
+            self._heap=[item for item in self._heap
+                        if self._entries.get(item[2]) is not None and self._entries[item[2]]["fire_at"] == item[0]]
+            heapq.heapify(self._heap)
+
+    def _fire_due(self):
+        now=time.time()
+        while self._heap and self._heap[0][0]<=now:
+            fire_at, _, shift_id=heapq.heappop(self._heap)
+            entry=self._entries.get(shift_id)
+            if entry is None or entry["fire_at"] != fire_at:
+                continue  # Смена изменена или удалена
+            del self._entries[shift_id]
+            task=asyncio.get_running_loop().create_task(self._fire(entry))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _fire(self, entry: dict):
+        try:
+            await self.on_fire(self.application.bot, entry)
+            self.sent+=1
+        except Exception as e:
+            logger.warning(f"Не удалось отправить напоминание о смене {entry['shift_id']}: {e}")
@@ -0,0 +1,384 @@
+# replay_updates.py - Локальная заглушка Bot API и прогон записанных апдейтов
+#
+# Бот запускается против заглушки:
+#   BOT_API_BASE_URL=http://127.0.0.1:8081/bot BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443 \
+#   WEBHOOK_SECRET=test python bot_multiuser.py
+# и затем:
+#   python replay_updates.py --mode webhook --secret test --count 500
+# В режиме polling апдейты отдаются боту через getUpdates заглушки.
+# Итог: апдейтов в секунду и задержка от отправки апдейта до ответа бота (p50/p95/p99).
+# Нагрузка от многих пользователей: --users 200 --count 2000
+# Ввод одной смены целиком (запросы к API и время ввода на смену):
+#   python replay_updates.py --mode polling --scenario classic --users 20
+#   python replay_updates.py --mode polling --scenario inline --users 20
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER={"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+# Методы приема апдейтов и настройки — не ответы пользователю
+SERVICE_METHODS={"getMe", "getUpdates", "setWebhook", "deleteWebhook", "getWebhookInfo",
+                 "setMyCommands", "logOut", "close"}
+# Текст бота после сохранения смены (оба режима ввода)
+SAVED_MARK="Смена успешно добавлена"
+
+
+class StubState:
+    """Общее состояние заглушки: очередь getUpdates и задержки ответов.
+
+    Апдейты одного чата обрабатываются по порядку, поэтому i-й ответ в чат
+    сопоставляется i-му отправленному в него апдейту.
+    """
+
+    def __init__(self):
+        self.lock=threading.Condition()
+        self.updates=[]
+        self.sent_at=defaultdict(deque)
+        self.latencies=[]
+        self.last_reply=None
+        self.replies=0
+        self.message_ids=itertools.count(1000)
+        self.ready=threading.Event()  # Бот вызвал setWebhook или getUpdates
+        # Сценарии ввода смены: запросы бота по методам, первое сообщение
+        # бота в чате (мастер) и момент, когда смена сохранена
+        self.calls=Counter()
+        self.first_message={}
+        self.saved_at={}
+
+    def mark_sent(self, chat_id: int):
+        with self.lock:
+            self.sent_at[chat_id].append(time.monotonic())
+
+    def mark_call(self, method: str, params: dict, message_id: int = None):
+        chat_id=int(params.get("chat_id") or 0)
+        with self.lock:
+            self.calls[method]+=1
+            if message_id and chat_id not in self.first_message:
+                self.first_message[chat_id]=message_id
+            if SAVED_MARK in str(params.get("text", "")):
+                self.saved_at.setdefault(chat_id, time.monotonic())
+            self.lock.notify_all()
+
+    def mark_replied(self, chat_id: int):
+        with self.lock:
+            now=time.monotonic()
+            self.replies+=1
+            self.last_reply=now
+            if self.sent_at[chat_id]:
+                self.latencies.append(now - self.sent_at[chat_id].popleft())
+
+
+class StubServer(ThreadingHTTPServer):
+    # Очередь соединений по умолчанию (5) под нагрузкой дает повторы SYN и лишнюю секунду задержки
+    request_queue_size=256
+    daemon_threads=True
+
+
+class StubBotAPI(BaseHTTPRequestHandler):
+    state: StubState=None
+    delay=0.0  # Имитация сетевой задержки до api.telegram.org
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        method=self.path.rstrip("/").rsplit("/", 1)[-1]
+        length=int(self.headers.get("Content-Length") or 0)
+        params=self._parse(self.rfile.read(length))
+
+        if method == "getMe":
+            result=BOT_USER
+        elif method == "setWebhook":
+            self.state.ready.set()
+            result=True
+        elif method == "getUpdates":
+            self.state.ready.set()
+            result=self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        elif method in ("sendMessage", "editMessageText", "sendDocument"):
+            time.sleep(self.delay)
+            result=self._reply(params)
+            self.state.mark_call(method, params, result["message_id"] if method == "sendMessage" else None)
+        else:
+            time.sleep(self.delay)
+            result=True
+            self.state.mark_call(method, params)
+
+        body=json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse(self, raw: bytes) -> dict:
+        content_type=self.headers.get("Content-Type", "")
+        if "json" in content_type:
+            return json.loads(raw or b"{}")
+        if "multipart" in content_type:
+            return {m.group(1).decode(): m.group(2).decode("utf-8", "replace")
+                    for m in re.finditer(rb'name="(\w+)"\r\n\r\n([^\r]*)', raw)}
+        return {key: values[0] for key, values in parse_qs(raw.decode("utf-8")).items()}
+
+    def _get_updates(self, offset: int, timeout: float):
+        state=self.state
+        with state.lock:
+            state.updates=[u for u in state.updates if u["update_id"]>=offset]
+            if not state.updates and timeout:
+                state.lock.wait(timeout)
+            return state.updates[:100]
+
+    def _reply(self, params: dict):
+        chat_id=int(params.get("chat_id") or 0)
+        self.state.mark_replied(chat_id)
+        return {
+            "message_id": next(self.state.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+
+def _chat_id(update: dict) -> int:
+    message=update.get("message") or update.get("callback_query", {}).get("message") or {}
+    return message.get("chat", {}).get("id", 0)
+
+
+def make_updates(count: int, text: str, start_id: int, users: int):
+    """Синтетические апдейты от users пользователей (каждый пишет в свой чат)"""
+    now=int(time.time())
+    for i in range(count):
+        user_id=10_000_000 + start_id + i % users
+        yield {
+            "update_id": start_id + i,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{i % users}"},
+                "text": text,
+            },
+        }
+
+
+def load_updates(path: str):
+    """Записанные апдейты: один JSON на строку"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def post_webhook(url: str, secret: str, update: dict):
+    request=urllib.request.Request(
+        url,
+        data=json.dumps(update).encode("utf-8"),
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret},
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+
+
+def percentile(values, share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def report(state: StubState, expected: int, started: float, duplicates: int, rejected: int):
+    latencies=sorted(state.latencies)
+    elapsed=max((state.last_reply or started) - started, 1e-9)
+
+    print(f"Апдейтов: {expected} (+{duplicates} повторов), ответов: {state.replies}")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.1f} апдейтов/с")
+    if latencies:
+        print(f"Задержка до ответа: p50 {percentile(latencies, 0.5) * 1000:.0f} мс, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f} мс, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.0f} мс, max {latencies[-1] * 1000:.0f} мс")
+    if rejected:
+        print(f"Отклонено вебхуком: {rejected}")
+
+
+def deliver(args, state: StubState, update: dict) -> bool:
+    """Передать апдейт боту (webhook или очередь getUpdates); False — отклонен"""
+    if args.mode == "webhook":
+        try:
+            post_webhook(args.webhook_url, args.secret, update)
+        except urllib.error.HTTPError as e:
+            # 403 — неверный секрет, 503 — очередь бота переполнена
+            print(f"Апдейт {update['update_id']} отклонен: {e.code} {e.reason}")
+            return False
+    else:
+        with state.lock:
+            state.updates.append(update)
+            state.lock.notify_all()
+    return True
+
+
+def send_stream(args, state: StubState, updates) -> tuple:
+    """Апдейты одного пользователя по порядку; возвращает (повторы, отклоненные)"""
+    duplicates=rejected=0
+    for update in updates:
+        state.mark_sent(_chat_id(update))
+        for copy in range(2 if args.duplicates else 1):
+            duplicates+=copy
+            rejected+=not deliver(args, state, update)
+        if args.rate:
+            time.sleep(1 / args.rate)
+    return duplicates, rejected
+
+
+# ====== Сценарии ввода смены ======
+
+def scenario_steps(scenario: str) -> list:
+    """Нажатия пользователя: текст сообщения или ("cb", callback_data)"""
+    digits=lambda value: [("cb", f"wz|key|{d}") for d in value]
+    if scenario == "classic":
+        return ["Начать смену", "Сегодня", "РЕЖ", "ЛЧ", *"1800", *"2300", *"10000", "Подтвердить"]
+    return ["/add", ("cb", f"wz|date|{date.today().isoformat()}"), ("cb", "wz|role|0"), ("cb", "wz|prog|0"),
+            *digits("1800"), *digits("2300"), *digits("10000"), ("cb", "wz|ok"), ("cb", "wz|save")]
+
+
+class UpdateFactory:
+    """Апдейты сценария с общей нумерацией update_id"""
+
+    def __init__(self, start_id: int):
+        self.ids=itertools.count(start_id)
+        self.lock=threading.Lock()
+
+    def make(self, user_id: int, step, message_id: int = None) -> dict:
+        with self.lock:
+            update_id=next(self.ids)
+        user={"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        chat={"id": user_id, "type": "private"}
+        if isinstance(step, tuple):
+            return {"update_id": update_id, "callback_query": {
+                "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": step[1],
+                "message": {"message_id": message_id, "date": int(time.time()), "chat": chat,
+                            "from": BOT_USER, "text": "мастер"},
+            }}
+        message={"message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": step}
+        if step.startswith("/"):
+            message["entities"]=[{"type": "bot_command", "offset": 0, "length": len(step)}]
+        return {"update_id": update_id, "message": message}
+
+
+def run_entry(args, state: StubState, factory: UpdateFactory, user_id: int) -> tuple:
+    """Один пользователь вводит смену; возвращает (начало, отправлено апдейтов)"""
+    steps=scenario_steps(args.scenario)
+    started=time.monotonic()
+    deliver(args, state, factory.make(user_id, steps[0]))
+
+    # Кнопки мастера ссылаются на его сообщение — ждем первый ответ бота
+    with state.lock:
+        state.lock.wait_for(lambda: user_id in state.first_message, timeout=args.wait)
+    for step in steps[1:]:
+        time.sleep(args.step_delay)
+        deliver(args, state, factory.make(user_id, step, state.first_message.get(user_id)))
+    return started, len(steps)
+
+
+def report_scenario(args, state: StubState, starts: dict, steps: int):
+    calls=sum(count for method, count in state.calls.items() if method not in SERVICE_METHODS)
+    entries=sorted(state.saved_at[user_id] - started for user_id, started in starts.items()
+                   if user_id in state.saved_at)
+    think=(steps - 1) * args.step_delay
+
+    print(f"Сценарий {args.scenario}: пользователей {len(starts)}, сохранено смен {len(entries)}, "
+          f"апдейтов на смену {steps}")
+    # answerCallbackQuery не расходует лимиты Telegram на сообщения в чат
+    limited=calls - state.calls["answerCallbackQuery"]
+    print(f"Запросов к Bot API на смену: {calls / max(len(entries), 1):.1f}, "
+          f"из них под лимитами на сообщения {limited / max(len(entries), 1):.1f} "
+          f"({', '.join(f'{method} {count}' for method, count in state.calls.most_common() if method not in SERVICE_METHODS)})")
+    if entries:
+        print(f"Время ввода (пауза между нажатиями {args.step_delay:.2f} c, сумма пауз {think:.1f} c): "
+              f"p50 {percentile(entries, 0.5):.2f} c, p95 {percentile(entries, 0.95):.2f} c, max {entries[-1]:.2f} c")
+        print(f"Ожидание бота сверх пауз: p50 {percentile(entries, 0.5) - think:.2f} c, "
+              f"p95 {percentile(entries, 0.95) - think:.2f} c")
+
+
+def main():
+    parser=argparse.ArgumentParser(description="Прогон апдейтов через бота с заглушкой Bot API")
+    parser.add_argument("--mode", choices=["webhook", "polling"], default="webhook")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", help="файл с записанными апдейтами (JSON Lines)")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1, help="сколько пользователей пишут одновременно")
+    parser.add_argument("--text", default="Помощь")
+    parser.add_argument("--rate", type=float, default=0, help="апдейтов в секунду на пользователя (0 — без паузы)")
+    parser.add_argument("--duplicates", action="store_true", help="отправлять каждый апдейт дважды")
+    parser.add_argument("--api-delay", type=float, default=0.05, help="задержка ответа заглушки, с")
+    parser.add_argument("--wait", type=float, default=10, help="сколько ждать ответов после отправки")
+    parser.add_argument("--linger", type=float, default=0,
+                        help="сколько еще держать заглушку после отчета (отложенные запросы бота)")
+    parser.add_argument("--start-id", type=int, default=int(time.time()))
+    parser.add_argument("--scenario", choices=["classic", "inline"],
+                        help="ввод смены целиком вместо одинаковых апдейтов")
+    parser.add_argument("--step-delay", type=float, default=0.3, help="пауза между нажатиями в сценарии, с")
+    args=parser.parse_args()
+
+    state=StubState()
+    StubBotAPI.state=state
+    StubBotAPI.delay=args.api_delay
+    server=StubServer(("127.0.0.1", args.api_port), StubBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Заглушка Bot API: http://127.0.0.1:{args.api_port}/bot")
+
+    if args.scenario:
+        print("Ожидание бота...")
+        state.ready.wait()
+        time.sleep(0.5)
+        factory=UpdateFactory(args.start_id)
+        user_ids=[20_000_000 + args.start_id % 1_000_000 + i for i in range(args.users)]
+        with ThreadPoolExecutor(max_workers=min(len(user_ids), 256)) as pool:
+            results=dict(zip(user_ids, pool.map(lambda user_id: run_entry(args, state, factory, user_id), user_ids)))
+        with state.lock:
+            state.lock.wait_for(lambda: len(state.saved_at)>=len(user_ids), timeout=args.wait)
+        # Фоновые удаления и склеенные правки уходят после сохранения
+        time.sleep(args.linger or 3)
+        report_scenario(args, state, {user_id: started for user_id, (started, _) in results.items()},
+                        len(scenario_steps(args.scenario)))
+        server.shutdown()
+        return
+
+    updates=load_updates(args.updates) if args.updates \
+        else list(make_updates(args.count, args.text, args.start_id, args.users))
+    streams=defaultdict(list)
+    for update in updates:
+        streams[_chat_id(update)].append(update)
+
+    print("Ожидание бота...")
+    state.ready.wait()
+    time.sleep(0.5)
+
+    started=time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(len(streams), 256) or 1) as pool:
+        results=list(pool.map(lambda stream: send_stream(args, state, stream), streams.values()))
+    duplicates=sum(r[0] for r in results)
+    rejected=sum(r[1] for r in results)
+
+    deadline=time.monotonic() + args.wait
+    while time.monotonic()<deadline and len(state.latencies)<len(updates) - rejected:
+        time.sleep(0.1)
+
+    report(state, len(updates), started, duplicates, rejected)
+    if args.linger:
+        replies=state.replies
+        time.sleep(args.linger)
+        print(f"Отложенных ответов за {args.linger:.0f} c: {state.replies - replies}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# sqlite_persistence.py - Хранение user_data и состояний диалогов в SQLite
+import asyncio
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger=logging.getLogger(__name__)
+
+# Как часто Application сбрасывает измененные записи в хранилище, секунд
+PERSISTENCE_INTERVAL=float(os.getenv("PERSISTENCE_INTERVAL", "10"))
+# Сколько пользователей держать в памяти; сверх лимита вытесняются давно неактивные
+PERSISTENCE_MAX_USERS=int(os.getenv("PERSISTENCE_MAX_USERS", "5000"))
+# Словарь user_data внутри Application (python-telegram-bot 20.0–22.x, проверено
+# на 22.8). Публичного способа выгрузить user_data из памяти, не удаляя его из
+# хранилища (как drop_user_data), в PTB нет; наличие атрибута проверяет attach
+_APPLICATION_USER_DATA="_user_data"
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для python-telegram-bot поверх основной базы бота.
+
+    - user_data хранится построчно (одна строка на пользователя) и
+      пишется только для измененных пользователей, одной транзакцией;
+    - при старте ничего не загружается: данные пользователя читаются при
+      его первом апдейте (refresh_user_data), поэтому время запуска не
+      зависит от числа пользователей;
+    - в памяти держится не больше max_users пользователей, вытесняются
+      те, кто дольше всех неактивен (данные перед этим записываются);
+    - состояния диалогов хранятся только для незавершенных диалогов;
+    - размер user_data в памяти оценивается по размеру последней записи
+      (bytes_in_memory), без повторной сериализации.
+    """
+
+    def __init__(self, db_path: str, update_interval: float = PERSISTENCE_INTERVAL,
+                 max_users: int = PERSISTENCE_MAX_USERS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db_path=db_path
+        self.max_users=max_users
+        # Вытеснять можно только того, чьи изменения Application уже сбросил
+        self.evict_after=max(60.0, update_interval * 3)
+        self.application=None
+        self._loaded: "OrderedDict[int, float]"=OrderedDict()  # user_id -> время последнего апдейта
+        self._pending_users: Dict[int, Optional[bytes]]={}  # None — удалить
+        self._writing_users: Dict[int, Optional[bytes]]={}  # Пишутся в базу прямо сейчас
+        self._sizes: Dict[int, int]={}  # user_id -> размер последней записи user_data
+        self._bytes=0
+        self._pending_conversations: Dict[tuple, Optional[str]]={}
+        self._writer: Optional[asyncio.Task]=None
+        self.loads=0
+        self.evictions=0
+        self.init_tables()
+
+    def init_tables(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS bot_user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS bot_conversations (
+                    name TEXT NOT NULL,
+                    conv_key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (name, conv_key)
+                )
+            ''')
+            conn.commit()
+
+    def attach(self, application):
+        """Ссылка на Application нужна для вытеснения пользователей из памяти"""
+        if not isinstance(getattr(application, _APPLICATION_USER_DATA, None), dict):
+            raise RuntimeError(
+                f"Application.{_APPLICATION_USER_DATA} не найден: вытеснение user_data "
+                f"не поддерживает эту версию python-telegram-bot"
+            )
+        self.application=application
+
+    # ====== user_data ======
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        # Ленивая загрузка: данные придут в refresh_user_data при первом апдейте
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._loaded:
+            self._loaded[user_id]=time.monotonic()
+            self._loaded.move_to_end(user_id)
+            return
+
+        # Вытесненные данные могут еще не дойти до базы: очередь и текущая
+        # запись новее строки в bot_user_data
+        for users in (self._pending_users, self._writing_users):
+            if user_id in users:
+                stored, size=self._unpickle_user(user_id, users[user_id])
+                break
+        else:
+            stored, size=await asyncio.to_thread(self._read_user, user_id)
+        self._record_size(user_id, size)
+        if stored:
+            # Свежие значения из памяти (если они уже есть) важнее сохраненных
+            user_data.update({key: value for key, value in stored.items() if key not in user_data})
+        self.loads+=1
+        self._loaded[user_id]=time.monotonic()
+        self._evict_idle()
+
+    def _read_user(self, user_id: int) -> Tuple[Optional[dict], int]:
+        """Сохраненные user_data и размер записи"""
+        with sqlite3.connect(self.db_path) as conn:
+            row=conn.execute('SELECT data FROM bot_user_data WHERE user_id = ?', (user_id,)).fetchone()
+        return self._unpickle_user(user_id, row[0] if row else None)
+
+    def _unpickle_user(self, user_id: int, blob: Optional[bytes]) -> Tuple[Optional[dict], int]:
+        if not blob:
+            return None, 0
+        try:
+            return pickle.loads(blob), len(blob)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать user_data {user_id}: {e}")
+            return None, 0
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if user_id not in self._loaded:
+            return  # Пользователь вытеснен, его данные уже записаны
+        blob=pickle.dumps(data) if data else None
+        self._record_size(user_id, len(blob) if blob else 0)
+        self._pending_users[user_id]=blob
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded.pop(user_id, None)
+        self._record_size(user_id, 0)
+        self._pending_users[user_id]=None
+        self._schedule_write()
+
+    def _evict_idle(self):
+        """Вытеснить давно неактивных пользователей сверх лимита"""
+        if self.application is None:
+            return
+
+        now=time.monotonic()
+        while len(self._loaded)>self.max_users:
+            user_id, last_seen=next(iter(self._loaded.items()))
+            if now - last_seen<self.evict_after:
+                break  # Остальные активны, лимит временно превышен
+            self.evict_user(user_id)
+
+    def evict_user(self, user_id: int):
+        """Записать данные пользователя и убрать их из памяти приложения"""
+        if self.application is None:
+            return
+        user_data=getattr(self.application, _APPLICATION_USER_DATA, None)
+        if user_data is None:
+            raise RuntimeError(f"Application.{_APPLICATION_USER_DATA} не найден, вытеснение невозможно")
+        data=user_data.pop(user_id, None)
+        self._loaded.pop(user_id, None)
+        self._record_size(user_id, 0)
+        self._pending_users[user_id]=pickle.dumps(data) if data else None
+        self.evictions+=1
+        self._schedule_write()
+
+    def idle_users(self, seconds: float):
+        """Пользователи в памяти, неактивные дольше seconds"""
+        threshold=time.monotonic() - seconds
+        return [user_id for user_id, last_seen in self._loaded.items() if last_seen<threshold]
+
+    def _record_size(self, user_id: int, size: int):
+        self._bytes+=size - self._sizes.pop(user_id, 0)
+        if size:
+            self._sizes[user_id]=size
+
+    @property
+    def users_in_memory(self) -> int:
+        return len(self._loaded)
+
+    @property
+    def bytes_in_memory(self) -> int:
+        """Оценка объема user_data в памяти по размеру последних записей"""
+        return self._bytes
+
+    # ====== Диалоги ======
+
+    async def get_conversations(self, name: str) -> dict:
+        with sqlite3.connect(self.db_path) as conn:
+            rows=conn.execute(
+                'SELECT conv_key, state FROM bot_conversations WHERE name = ?', (name,)
+            ).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._pending_conversations[(name, json.dumps(list(key)))]= \
+            json.dumps(new_state) if new_state is not None else None
+        self._schedule_write()
+
+    # ====== Запись ======
+
+    def _schedule_write(self):
+        """Все изменения одного прохода update_persistence пишутся одной транзакцией"""
+        if self._writer is None or self._writer.done():
+            self._writer=asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        # Пока идет запись, новые изменения копятся для следующей транзакции
+        while self._pending_users or self._pending_conversations:
+            self._writing_users, self._pending_users=self._pending_users, {}
+            conversations, self._pending_conversations=self._pending_conversations, {}
+            try:
+                await asyncio.to_thread(self._write, self._writing_users, conversations)
+            except Exception as e:
+                logger.error(f"Ошибка в SQLitePersistence._write: {e}")
+            finally:
+                self._writing_users={}
+
+    def _write(self, users: Dict[int, Optional[bytes]], conversations: Dict[tuple, Optional[str]]):
+        with sqlite3.connect(self.db_path) as conn:
+            for user_id, data in users.items():
+                if data is None:
+                    conn.execute('DELETE FROM bot_user_data WHERE user_id = ?', (user_id,))
+                else:
+                    conn.execute('''
+                        INSERT INTO bot_user_data (user_id, data, updated_at)
+                        VALUES (?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = CURRENT_TIMESTAMP
+                    ''', (user_id, data))
+
+            for (name, key), state in conversations.items():
+                if state is None:
+                    conn.execute('DELETE FROM bot_conversations WHERE name = ? AND conv_key = ?', (name, key))
+                else:
+                    conn.execute('''
+                        INSERT INTO bot_conversations (name, conv_key, state, updated_at)
+                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(name, conv_key) DO UPDATE SET state = excluded.state,
+                            updated_at = CURRENT_TIMESTAMP
+                    ''', (name, key, state))
+            conn.commit()
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
+
+    # ====== Не используется ======
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
@@ -1,67 +1,247 @@
 from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
-from datetime import datetime
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import threading
 import traceback
 import sqlite3
+import time
 import os
 
 # Определяем пути
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'shifts.db')
 
+# Ограничение одновременных подключений к БД и таймаут для проверок готовности
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "8"))
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "0.25"))
+
+_db_slots = threading.BoundedSemaphore(DB_MAX_CONNECTIONS)
+_db_lock = threading.Lock()
+_db_in_use = 0
+
+
+@contextmanager
+def get_connection():
+    """Подключение к БД с учетом лимита одновременных соединений"""
+    global _db_in_use
+    _db_slots.acquire()
+    with _db_lock:
+        _db_in_use += 1
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        with _db_lock:
+            _db_in_use -= 1
+        _db_slots.release()
+
+
 # Функции для работы с БД (вместо импорта из db.py)
 def get_all_shifts():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.execute('''
-        SELECT * FROM shifts 
-        ORDER BY date DESC, start_time DESC
-    ''')
-    shifts = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return shifts
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.execute('''
+            SELECT * FROM shifts 
+            ORDER BY date DESC, start_time DESC
+        ''')
+        return [dict(row) for row in cursor.fetchall()]
 
 def get_statistics():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.execute('''
-        SELECT COUNT(*) as total, SUM(salary) as total_salary 
-        FROM shifts
-    ''')
-    stats = dict(cursor.fetchone())
-    conn.close()
-    return stats
-
-def update_shift(user_id, shift_id, field, value):
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.execute('''
+            SELECT COUNT(*) as total, SUM(salary) as total_salary 
+            FROM shifts
+        ''')
+        return dict(cursor.fetchone())
+
+# Начало и конец смены в минутах от полуночи (те же выражения, что в bot.py):
+# веб-интерфейс может работать с базой, которую бот еще не обновлял
+_MINUTES_SQL = "(CAST(substr({0}, 1, 2) AS INTEGER) * 60 + CAST(substr({0}, 4, 2) AS INTEGER))"
+_TIME_GLOB = "GLOB '[0-2][0-9]:[0-5][0-9]'"
+_START_MIN_SQL = f"CASE WHEN start_time {_TIME_GLOB} THEN {_MINUTES_SQL.format('start_time')} END"
+_END_MIN_SQL = (
+    f"CASE WHEN start_time {_TIME_GLOB} AND end_time {_TIME_GLOB} THEN {_MINUTES_SQL.format('start_time')} + "
+    f"({_MINUTES_SQL.format('end_time')} - {_MINUTES_SQL.format('start_time')} + 1440) % 1440 END"
+)
+
+_intervals_ready = False
+
+
+def ensure_interval_columns(conn):
+    """Колонки start_min/end_min и индекс idx_shifts_intervals (проверка один раз за процесс).
+
+    Возвращает False, если создать их не удалось (SQLite старше 3.31) —
+    тогда пересечения не проверяются, а изменение сохраняется.
+    """
+    global _intervals_ready
+    if _intervals_ready:
+        return True
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute(f'''
-            UPDATE shifts SET {field} = ? 
-            WHERE id = ? AND user_id = ?
-        ''', (value, shift_id, user_id))
+        columns = {row[1] for row in conn.execute('PRAGMA table_xinfo(shifts)')}
+        if 'start_min' not in columns:
+            conn.execute(f'ALTER TABLE shifts ADD COLUMN start_min INTEGER GENERATED ALWAYS AS ({_START_MIN_SQL})')
+        if 'end_min' not in columns:
+            conn.execute(f'ALTER TABLE shifts ADD COLUMN end_min INTEGER GENERATED ALWAYS AS ({_END_MIN_SQL})')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_shifts_intervals ON shifts(user_id, date, start_min, end_min)')
         conn.commit()
-        affected = conn.total_changes
-        conn.close()
-        return affected > 0
-    except Exception as e:
-        print(f"Ошибка обновления: {e}")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"[ERROR] Проверка пересечений недоступна: {e}")
         return False
+    _intervals_ready = True
+    return True
+
+
+def update_shift_fields(user_id, shift_id, values, check_overlap):
+    """Изменение полей смены одной транзакцией.
+
+    Пересечение (check_overlap) проверяется в той же транзакции BEGIN
+    IMMEDIATE, что и запись, поэтому параллельная правка не проскочит
+    между проверкой и записью. Возвращает (изменено ли, пересекающаяся смена).
+    """
+    with get_connection() as conn:
+        check_overlap = check_overlap and ensure_interval_columns(conn)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if check_overlap:
+                conflict = find_overlap(conn, user_id, shift_id, values)
+                if conflict:
+                    conn.rollback()
+                    return False, conflict
+            assignments = ", ".join(f"{field} = ?" for field in values)
+            cursor = conn.execute(f'''
+                UPDATE shifts SET {assignments}
+                WHERE id = ? AND user_id = ?
+            ''', (*values.values(), shift_id, user_id))
+            conn.commit()
+            return cursor.rowcount > 0, None
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def _time_minutes(value):
+    """'ЧЧ:ММ' -> минуты от полуночи; -1, если время не указано"""
+    try:
+        parsed = datetime.strptime(value, '%H:%M') if value else None
+    except ValueError:
+        return -1
+    return parsed.hour * 60 + parsed.minute if parsed else -1
+
+
+def find_overlap(conn, user_id, shift_id, changes):
+    """Другая смена пользователя, с которой пересечется смена после изменений.
+
+    Один диапазонный запрос по индексу idx_shifts_intervals за вчера,
+    сегодня и завтра; смены через полночь учитываются.
+    """
+    conn.row_factory = sqlite3.Row
+    current = conn.execute('''
+        SELECT date, start_time, end_time FROM shifts WHERE id = ? AND user_id = ?
+    ''', (shift_id, user_id)).fetchone()
+    if not current:
+        return None
+    shift = {**dict(current), **changes}
+
+    start = _time_minutes(shift['start_time'])
+    end = _time_minutes(shift['end_time'])
+    if not shift['date'] or start < 0 or end < 0 or start == end:
+        return None
+    try:
+        day = datetime.fromisoformat(shift['date']).date()
+    except ValueError:
+        return None  # Неверную дату отклонит проверка полей
+    end = start + (end - start) % 1440
+
+    row = conn.execute('''
+        SELECT id, date, role, program, start_time, end_time, salary FROM (
+            SELECT *, CASE date WHEN :prev THEN -1440 WHEN :next THEN 1440 ELSE 0 END AS shift_offset
+            FROM shifts
+            WHERE user_id = :user_id AND date BETWEEN :prev AND :next
+              AND end_min IS NOT NULL AND id != :shift_id
+        )
+        WHERE start_min + shift_offset < :end AND end_min + shift_offset > :start
+        ORDER BY date, start_min
+        LIMIT 1
+    ''', {'user_id': user_id, 'shift_id': shift_id, 'start': start, 'end': end,
+          'prev': (day - timedelta(days=1)).isoformat(),
+          'next': (day + timedelta(days=1)).isoformat()}).fetchone()
+    return dict(row) if row else None
+
 
 def delete_shift(user_id, shift_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute('''
-            DELETE FROM shifts 
-            WHERE id = ? AND user_id = ?
-        ''', (shift_id, user_id))
-        conn.commit()
-        affected = conn.total_changes
-        conn.close()
-        return affected > 0
+        with get_connection() as conn:
+            conn.execute('''
+                DELETE FROM shifts 
+                WHERE id = ? AND user_id = ?
+            ''', (shift_id, user_id))
+            conn.commit()
+            return conn.total_changes > 0
     except Exception as e:
         print(f"Ошибка удаления: {e}")
         return False
 
 
+# ====== Проверки для балансировщика (без чтения данных) ======
+
+def _timed(checks, name, func):
+    """Выполняет проверку и записывает время выполнения в миллисекундах"""
+    started = time.perf_counter()
+    try:
+        return func()
+    finally:
+        checks[name] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def ping_db():
+    """Чтение заголовка БД без обращения к таблицам"""
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=PROBE_TIMEOUT)
+    try:
+        conn.execute("PRAGMA schema_version").fetchone()
+        return True
+    finally:
+        conn.close()
+
+
+def check_writable():
+    """Проверка, что БД можно заблокировать на запись (без записи данных)"""
+    if not os.access(DB_PATH, os.W_OK) or not os.access(BASE_DIR, os.W_OK):
+        return False
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=rw", uri=True,
+                           timeout=PROBE_TIMEOUT, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ROLLBACK")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def get_wal_size():
+    """Размер WAL-файла в байтах (0 если WAL не используется)"""
+    try:
+        return os.path.getsize(DB_PATH + "-wal")
+    except OSError:
+        return 0
+
+
+def get_pool_usage():
+    """Загрузка пула подключений к БД"""
+    with _db_lock:
+        in_use = _db_in_use
+    return {
+        "in_use": in_use,
+        "max": DB_MAX_CONNECTIONS,
+        "saturation": round(in_use / DB_MAX_CONNECTIONS, 3)
+    }
+
+
 app=Flask(__name__)
 CORS(app)  # Разрешаем CORS для API
 
@@ -120,8 +300,8 @@ def api_update_shift(shift_id):
         if not user_id:
             return jsonify({"error": "user_id обязателен"}), 400
 
-        # Обновляем каждое поле отдельно
-        updated_fields=[]
+        # Сначала проверяются все поля, затем они пишутся одной транзакцией
+        values={}
 
         for field in ['date', 'role', 'program', 'start_time', 'end_time', 'salary']:
             if field in data:
@@ -157,14 +337,23 @@ def api_update_shift(shift_id):
                     except (ValueError, TypeError):
                         return jsonify({"error": f"Неверный формат зарплаты: {value}"}), 400
 
-                # Обновляем поле в базе
-                print(f"[DEBUG] Обновляем поле {field} = {value} (тип: {type(value)})")
-                if update_shift(user_id, shift_id, field, value):
-                    updated_fields.append(field)
-                    print(f"[DEBUG] Успешно обновлено поле {field}")
-                else:
-                    print(f"[ERROR] Ошибка обновления поля {field}")
-                    return jsonify({"error": f"Ошибка обновления поля {field}"}), 500
+                values[field]=value
+
+        # Пересечение с другой сменой: 409 с этой сменой, пока клиент не подтвердит on_overlap=allow
+        check_overlap=bool({'date', 'start_time', 'end_time'} & set(values)) and data.get('on_overlap') != 'allow'
+        updated_fields=list(values)
+        if values:
+            print(f"[DEBUG] Обновляем поля {values}")
+            updated, conflict=update_shift_fields(user_id, shift_id, values, check_overlap)
+            if conflict:
+                return jsonify({
+                    "success": False,
+                    "error": "Смена пересекается с уже сохраненной",
+                    "conflict": conflict
+                }), 409
+            if not updated:
+                print(f"[ERROR] Смена {shift_id} не найдена")
+                return jsonify({"error": "Ошибка обновления смены"}), 500
 
         if updated_fields:
             print(f"[SUCCESS] Смена {shift_id} обновлена. Поля: {updated_fields}")
@@ -218,14 +407,47 @@ def api_statistics():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/livez")
+def livez():
+    """Процесс жив (БД не проверяется)"""
+    return jsonify({"status": "alive"})
+
+
+@app.route("/readyz")
+def readyz():
+    """Готовность к обработке запросов: ping БД, запись, WAL и пул подключений"""
+    verbose="verbose" in request.args
+    checks={}
+
+    try:
+        _timed(checks, "ping_ms", ping_db)
+    except Exception as e:
+        return jsonify({"status": "unavailable", "error": str(e), "timings": checks}), 503
+
+    writable=_timed(checks, "writable_ms", check_writable)
+    pool=get_pool_usage()
+    ready=writable and pool["in_use"]<pool["max"]
+
+    result={
+        "status": "ready" if ready else "degraded",
+        "writable": writable,
+        "wal_size": get_wal_size(),
+        "pool": pool
+    }
+    if verbose:
+        result["timings"]=checks
+        result["timestamp"]=datetime.now().isoformat()
+
+    return jsonify(result), 200 if ready else 503
+
+
 @app.route("/health")
 def health():
-    """Проверка работоспособности"""
+    """Проверка работоспособности (без чтения смен)"""
     try:
-        shifts_count=len(get_all_shifts())
+        ping_db()
         return jsonify({
             "status": "healthy",
-            "shifts_count": shifts_count,
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
@@ -239,4 +461,5 @@ if __name__ == "__main__":
     print("📝 Новые endpoints:")
     print("   PUT /api/shifts/<id> - обновить смену")
     print("   DELETE /api/shifts/<id> - удалить смену")
+    print("   GET /livez, /readyz[?verbose] - проверки для балансировщика")
     app.run(debug=True, host='0.0.0.0', port=8008)
\ No newline at end of file
@@ -1,16 +1,25 @@
 import logging
-import sqlite3
-import json
 import os
+import sqlite3
 from datetime import datetime, date, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterator
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+from telegram.error import RetryAfter
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, filters,
-    ConversationHandler, ContextTypes, CallbackQueryHandler
+    ConversationHandler, ContextTypes, CallbackQueryHandler, TypeHandler
 )
+from telegram.request import HTTPXRequest
 import re
 from config import TELEGRAM_TOKEN
+from exporters import EXPORT_FORMATS, build_export
+from edit_coalescer import EditCoalescer
+from message_cleaner import MessageCleaner
+import ingress
+from update_processor import PerChatUpdateProcessor
+from sqlite_persistence import SQLitePersistence
+from idle_sweeper import CONVERSATION_TIMEOUT, IdleSweeper
+from rate_gateway import FloodGateway, HTTP_POOL_SIZE, HTTP_POOL_TIMEOUT, PRIORITY_BACKGROUND
 
 # ====== Настройка логирования ======
 logging.basicConfig(
@@ -23,6 +32,10 @@ logging.basicConfig(
 )
 logger=logging.getLogger(__name__)
 
+# Удаление служебных сообщений в фоне и склейка частых правок при вводе с цифровой клавиатуры
+cleaner=MessageCleaner(rate_limit_args=PRIORITY_BACKGROUND)
+edits=EditCoalescer(cleaner)
+
 # ====== Константы ======
 EMOJI={
     "date": "🗓️",
@@ -67,16 +80,55 @@ PROGRAM_BUTTONS=[
     "СВОЙ ВАРИАНТ"
 ]
 
+MONTH_NAMES={
+    1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
+    5: "Май", 6: "Июнь", 7: "Июль", 8: "Август",
+    9: "Сентябрь", 10: "Октябрь", 11: "Ноябрь", 12: "Декабрь"
+}
+
+# Сколько смен показывать на одной странице просмотра
+SHIFTS_PAGE_SIZE=5
+
 # Состояния диалога
 SELECT_DATE, SELECT_ROLE, SELECT_PROGRAM, TYPING_START, TYPING_END, TYPING_SALARY=range(6)
 
 
 # ====== База данных ======
+
+# Начало и конец смены в минутах от полуночи ее даты; конец смены через
+# полночь больше 1440 (22:00–03:00 -> 1320..1620). Колонки вычисляет SQLite,
+# поэтому они верны и после правок из веб-интерфейса.
+_MINUTES_SQL="(CAST(substr({0}, 1, 2) AS INTEGER) * 60 + CAST(substr({0}, 4, 2) AS INTEGER))"
+_TIME_GLOB="GLOB '[0-2][0-9]:[0-5][0-9]'"
+_START_MIN_SQL=f"CASE WHEN start_time {_TIME_GLOB} THEN {_MINUTES_SQL.format('start_time')} END"
+_END_MIN_SQL=(
+    f"CASE WHEN start_time {_TIME_GLOB} AND end_time {_TIME_GLOB} THEN {_MINUTES_SQL.format('start_time')} + "
+    f"({_MINUTES_SQL.format('end_time')} - {_MINUTES_SQL.format('start_time')} + 1440) % 1440 END"
+)
+
+
+def _time_minutes(value: Optional[str]) -> int:
+    """'ЧЧ:ММ' -> минуты от полуночи; -1, если время не указано"""
+    if not value or not re.fullmatch(r"[0-2]\d:[0-5]\d", value):
+        return -1
+    return int(value[:2]) * 60 + int(value[3:])
+
+
+class ShiftOverlapError(Exception):
+    """Смена пересекается по времени с уже сохраненной; conflict — та смена"""
+
+    def __init__(self, conflict: Dict[str, Any]):
+        super().__init__(f"Смена пересекается со сменой {conflict['id']}")
+        self.conflict=conflict
+
+
 class ShiftDatabase:
     """Класс для работы с базой данных смен"""
 
     def __init__(self, db_path: str = "shifts.db"):
         self.db_path=db_path
+        # user_id -> (отметка изменения файла БД, итоги по месяцам)
+        self._month_summaries: Dict[str, tuple]={}
         self.init_database()
 
     def init_database(self):
@@ -96,16 +148,39 @@ class ShiftDatabase:
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 ''')
+                # Вычисляемые колонки (SQLite 3.31+) и индекс для проверки пересечений
+                columns={row[1] for row in conn.execute('PRAGMA table_xinfo(shifts)')}
+                if 'start_min' not in columns:
+                    conn.execute(f'ALTER TABLE shifts ADD COLUMN start_min INTEGER GENERATED ALWAYS AS ({_START_MIN_SQL})')
+                if 'end_min' not in columns:
+                    conn.execute(f'ALTER TABLE shifts ADD COLUMN end_min INTEGER GENERATED ALWAYS AS ({_END_MIN_SQL})')
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_shifts_intervals ON shifts(user_id, date, start_min, end_min)'
+                )
+                # Постраничный просмотр: ключ страницы (COALESCE(date, ''), COALESCE(start_time, ''), id)
+                conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_shifts_page
+                    ON shifts(user_id, COALESCE(date, ''), COALESCE(start_time, ''), id)
+                ''')
                 conn.commit()
             logger.info("База данных инициализирована")
         except Exception as e:
             logger.error(f"Ошибка при инициализации БД: {e}")
             raise
 
-    def add_shift(self, user_id: str, shift_data: Dict[str, Any]) -> bool:
-        """Добавление смены в базу данных"""
+    def add_shift(self, user_id: str, shift_data: Dict[str, Any], allow_overlap: bool = False) -> bool:
+        """Добавление смены в базу данных.
+
+        Если смена пересекается по времени с уже сохраненной, бросает
+        ShiftOverlapError (allow_overlap=True — сохранить все равно).
+        """
         try:
             with sqlite3.connect(self.db_path) as conn:
+                if not allow_overlap:
+                    conn.execute('BEGIN IMMEDIATE')
+                    conflict=self._find_overlap(conn, user_id, shift_data)
+                    if conflict:
+                        raise ShiftOverlapError(conflict)
                 conn.execute('''
                     INSERT INTO shifts (user_id, date, role, program, start_time, end_time, salary)
                     VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -119,12 +194,54 @@ class ShiftDatabase:
                     shift_data.get('salary')
                 ))
                 conn.commit()
+            self._month_summaries.pop(user_id, None)
             logger.info(f"Смена добавлена для пользователя {user_id}")
             return True
+        except ShiftOverlapError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка при добавлении смены: {e}")
             return False
 
+    def _find_overlap(self, conn, user_id: str, shift: Dict[str, Any],
+                      exclude_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Пересекающаяся смена: один диапазонный запрос по индексу за вчера, сегодня и завтра.
+
+        Смена вчерашнего дня может заходить за полночь в этот день, эта
+        смена — в завтрашний. Смены без даты или без времени не проверяются.
+        """
+        start=_time_minutes(shift.get('start_time'))
+        end=_time_minutes(shift.get('end_time'))
+        if not shift.get('date') or start<0 or end<0 or start == end:
+            return None
+        end=start + (end - start) % 1440
+        day=shift['date']
+
+        row=conn.execute('''
+            SELECT id, date, role, program, start_time, end_time, salary FROM (
+                SELECT *, CASE date WHEN :prev THEN -1440 WHEN :next THEN 1440 ELSE 0 END AS shift_offset
+                FROM shifts
+                WHERE user_id = :user_id AND date BETWEEN :prev AND :next
+                  AND end_min IS NOT NULL AND id IS NOT :exclude
+            )
+            WHERE start_min + shift_offset < :end AND end_min + shift_offset > :start
+            ORDER BY date, start_min
+            LIMIT 1
+        ''', {'user_id': user_id, 'prev': (day - timedelta(days=1)).isoformat(),
+              'next': (day + timedelta(days=1)).isoformat(), 'exclude': exclude_id,
+              'start': start, 'end': end}).fetchone()
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'date': datetime.fromisoformat(row[1]).date() if row[1] else None,
+            'role': row[2],
+            'program': row[3],
+            'start_time': row[4],
+            'end_time': row[5],
+            'salary': row[6]
+        }
+
     def get_user_shifts(self, user_id: str) -> List[Dict[str, Any]]:
         """Получение всех смен пользователя"""
         try:
@@ -152,6 +269,127 @@ class ShiftDatabase:
             logger.error(f"Ошибка при получении смен: {e}")
             return []
 
+    def iter_user_shifts(self, user_id: str) -> Iterator[Dict[str, Any]]:
+        """Смены пользователя по одной прямо из курсора (для экспорта)"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor=conn.execute('''
+                SELECT id, date, role, program, start_time, end_time, salary
+                FROM shifts WHERE user_id = ?
+                ORDER BY date, start_time
+            ''', (user_id,))
+            for row in cursor:
+                yield {
+                    'id': row[0],
+                    'date': datetime.fromisoformat(row[1]).date() if row[1] else None,
+                    'role': row[2],
+                    'program': row[3],
+                    'start_time': row[4],
+                    'end_time': row[5],
+                    'salary': row[6]
+                }
+
+    def count_user_shifts(self, user_id: str, date_from: Optional[date] = None,
+                          date_to: Optional[date] = None) -> int:
+        """Количество смен пользователя (опционально — в диапазоне дат)"""
+        query='SELECT COUNT(*) FROM shifts WHERE user_id = ?'
+        params=[user_id]
+        if date_from:
+            query+=' AND date >= ?'
+            params.append(date_from.isoformat())
+        if date_to:
+            query+=' AND date <= ?'
+            params.append(date_to.isoformat())
+
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def get_user_shifts_page(self, user_id: str, date_from: Optional[date] = None,
+                             date_to: Optional[date] = None, after: Optional[tuple] = None,
+                             before: Optional[tuple] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """Страница смен по ключу (date, start_time, id), от старых к новым.
+
+        after — ключ последней смены предыдущей страницы, before — ключ
+        первой смены следующей страницы. Смены без даты идут первыми.
+        Отбор, ключ и сортировка записаны теми же выражениями, что и
+        idx_shifts_page, — страница читается из индекса без сортировки.
+        """
+        query='''
+            SELECT id, date, role, program, start_time, end_time, salary
+            FROM shifts WHERE user_id = ?
+        '''
+        params=[user_id]
+        # Смены без даты ('') не попадают ни в один месяц
+        if date_from:
+            query+=" AND COALESCE(date, '') >= ?"
+            params.append(date_from.isoformat())
+        if date_to:
+            query+=" AND COALESCE(date, '') BETWEEN '0' AND ?"
+            params.append(date_to.isoformat())
+
+        # Сравнение по первому полю ключа задает начало диапазона индекса,
+        # сравнение кортежей — точную границу внутри дня
+        sort_key="(COALESCE(date, ''), COALESCE(start_time, ''), id)"
+        if after:
+            query+=f" AND COALESCE(date, '') >= ? AND {sort_key} > (?, ?, ?)"
+            params.extend([after[0], *after])
+        elif before:
+            query+=f" AND COALESCE(date, '') <= ? AND {sort_key} < (?, ?, ?)"
+            params.extend([before[0], *before])
+
+        order='DESC' if before else 'ASC'
+        query+=f" ORDER BY COALESCE(date, '') {order}, COALESCE(start_time, '') {order}, id {order} LIMIT ?"
+        params.append(limit)
+
+        with sqlite3.connect(self.db_path) as conn:
+            shifts=[{
+                'id': row[0],
+                'date': datetime.fromisoformat(row[1]).date() if row[1] else None,
+                'role': row[2],
+                'program': row[3],
+                'start_time': row[4],
+                'end_time': row[5],
+                'salary': row[6]
+            } for row in conn.execute(query, params)]
+
+        if before:
+            shifts.reverse()
+        return shifts
+
+    def get_month_summary(self, user_id: str) -> List[Dict[str, Any]]:
+        """Месяцы, в которых есть смены: число смен и заработок, от новых к старым.
+
+        Один GROUP BY для навигатора по годам и месяцам. Результат хранится
+        до записи смен этого пользователя ботом; правки из веб-интерфейса
+        замечаются по времени изменения файла БД.
+        """
+        stamp=self._data_stamp()
+        cached=self._month_summaries.get(user_id)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        with sqlite3.connect(self.db_path) as conn:
+            rows=conn.execute('''
+                SELECT CAST(substr(date, 1, 4) AS INTEGER), CAST(substr(date, 6, 2) AS INTEGER),
+                       COUNT(*), COALESCE(SUM(salary), 0)
+                FROM shifts
+                WHERE user_id = ? AND date IS NOT NULL
+                GROUP BY substr(date, 1, 7)
+                ORDER BY substr(date, 1, 7) DESC
+            ''', (user_id,)).fetchall()
+        summary=[{'year': row[0], 'month': row[1], 'count': row[2], 'salary': row[3]} for row in rows]
+        self._month_summaries[user_id]=(stamp, summary)
+        return summary
+
+    def _data_stamp(self) -> tuple:
+        """Время изменения файла БД и WAL: меняется при любой записи, в том числе из app.py"""
+        stamp=[]
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamp.append(0)
+        return tuple(stamp)
+
     def delete_shift(self, user_id: str, shift_id: int) -> bool:
         """Удаление смены"""
         try:
@@ -160,23 +398,39 @@ class ShiftDatabase:
                     DELETE FROM shifts WHERE id = ? AND user_id = ?
                 ''', (shift_id, user_id))
                 conn.commit()
-                return cursor.rowcount>0
+            self._month_summaries.pop(user_id, None)
+            return cursor.rowcount>0
         except Exception as e:
             logger.error(f"Ошибка при удалении смены: {e}")
             return False
 
-    def update_shift(self, user_id: str, shift_id: int, field: str, value: Any) -> bool:
-        """Обновление поля смены"""
+    def update_shift(self, user_id: str, shift_id: int, field: str, value: Any,
+                     allow_overlap: bool = False) -> bool:
+        """Обновление поля смены (с проверкой пересечений при смене даты или времени)"""
         try:
-            if field == 'date' and value:
-                value=value.isoformat()
-
             with sqlite3.connect(self.db_path) as conn:
+                if not allow_overlap and field in ('date', 'start_time', 'end_time'):
+                    conn.execute('BEGIN IMMEDIATE')
+                    row=conn.execute('''
+                        SELECT date, start_time, end_time FROM shifts WHERE id = ? AND user_id = ?
+                    ''', (shift_id, user_id)).fetchone()
+                    if row:
+                        shift={'date': datetime.fromisoformat(row[0]).date() if row[0] else None,
+                               'start_time': row[1], 'end_time': row[2], field: value}
+                        conflict=self._find_overlap(conn, user_id, shift, shift_id)
+                        if conflict:
+                            raise ShiftOverlapError(conflict)
+
+                if field == 'date' and value:
+                    value=value.isoformat()
                 conn.execute(f'''
                     UPDATE shifts SET {field} = ? WHERE id = ? AND user_id = ?
                 ''', (value, shift_id, user_id))
                 conn.commit()
+            self._month_summaries.pop(user_id, None)
             return True
+        except ShiftOverlapError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка при обновлении смены: {e}")
             return False
@@ -249,6 +503,10 @@ def validate_date(date_obj: date) -> bool:
     return min_date<=date_obj<=max_date
 
 
+def format_amount(value) -> str:
+    return f"{value:,.0f}".replace(",", " ")
+
+
 def format_shift_display(shift: Dict[str, Any]) -> str:
     """Форматирование смены для отображения"""
     lines=[]
@@ -276,23 +534,59 @@ def format_shift_display(shift: Dict[str, Any]) -> str:
     return "\n".join(lines)
 
 
-async def safe_delete_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int):
-    """Безопасное удаление сообщения"""
+async def cleanup_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очистка сообщений для удаления (в фоне, следующий ответ не ждет)"""
+    if "to_delete" not in context.user_data:
+        return
+
+    cleaner.delete(context.bot, update.effective_chat.id, context.user_data["to_delete"])
+    context.user_data["to_delete"]=[]
+
+
+def dangling_messages(user_data: dict) -> list:
+    """Служебные сообщения незавершенного ввода, которые остались в чате"""
+    message_ids=list(user_data.get("to_delete", []))
+    if "salary_message_id" in user_data:
+        message_ids.append(user_data["salary_message_id"])
+    return message_ids
+
+
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Диалог брошен на полпути: убрать подсказки и вернуть главное меню"""
     try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        chat_id=update.effective_chat.id
+        cleaner.delete(context.bot, chat_id, dangling_messages(context.user_data))
+        context.user_data.clear()
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"{EMOJI['info']} Ввод смены отменен: долго не было ответа.",
+            reply_markup=get_main_menu_keyboard(),
+            rate_limit_args=PRIORITY_BACKGROUND
+        )
     except Exception as e:
-        logger.warning(f"Не удалось удалить сообщение {message_id}: {e}")
+        logger.error(f"Ошибка в conversation_timeout: {e}")
 
 
-async def cleanup_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Очистка сообщений для удаления"""
-    if "to_delete" not in context.user_data:
-        return
+async def expire_user_data(user_id: int, user_data: dict):
+    """Очистка данных пользователя, неактивного дольше USER_DATA_IDLE"""
+    # В личном чате chat_id совпадает с user_id
+    cleaner.delete(sweeper.application.bot, user_id, dangling_messages(user_data))
+    user_data.clear()
 
-    for msg_id in context.user_data["to_delete"]:
-        await safe_delete_message(context, update.effective_chat.id, msg_id)
 
-    context.user_data["to_delete"]=[]
+sweeper=IdleSweeper(on_expire=expire_user_data)
+
+
+async def post_init(application):
+    """Фоновые задачи после запуска"""
+    sweeper.start(application)
+
+
+async def post_shutdown(application):
+    """Дослать отложенные правки и удаления перед остановкой"""
+    await sweeper.stop()
+    await edits.flush()
+    await cleaner.flush()
 
 
 def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
@@ -540,8 +834,8 @@ async def handle_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if "❌" in char or "отмена" in char:
             return await cancel(update, context)
 
-        # Удаляем сообщение пользователя для чистоты интерфейса
-        await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
+        # Удаляем сообщение пользователя для чистоты интерфейса (пакетом)
+        edits.delete(context.bot, update.effective_chat.id, update.message.message_id)
 
         if char == "пропустить":
             return await skip_time_input(update, context, typing_type)
@@ -626,6 +920,19 @@ async def prompt_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return TYPING_SALARY
 
 
+def update_salary_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Обновить сообщение с гонораром (частые нажатия склеиваются в одну правку)"""
+    if "salary_message_id" in context.user_data:
+        edits.edit(context.bot, update.effective_chat.id, context.user_data["salary_message_id"], text)
+
+
+def drop_salary_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удалить нажатие пользователя и сообщение с гонораром одним пакетом"""
+    edits.delete(context.bot, update.effective_chat.id, update.message.message_id)
+    if "salary_message_id" in context.user_data:
+        edits.delete(context.bot, update.effective_chat.id, context.user_data.pop("salary_message_id"))
+
+
 async def enter_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода зарплаты"""
     try:
@@ -633,134 +940,59 @@ async def enter_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Проверка на отмену
         if "❌" in text or "отмена" in text:
-            # Удаляем сообщение пользователя
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-            # Удаляем сообщение с инструкцией если есть
-            if "salary_message_id" in context.user_data:
-                await safe_delete_message(context, update.effective_chat.id, context.user_data["salary_message_id"])
+            drop_salary_messages(update, context)
             return await cancel(update, context)
 
-        # НЕ удаляем сообщение пользователя до подтверждения
-
         if text == "пропустить":
-            # Удаляем сообщения при пропуске
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-            if "salary_message_id" in context.user_data:
-                await safe_delete_message(context, update.effective_chat.id, context.user_data["salary_message_id"])
+            drop_salary_messages(update, context)
             context.user_data["salary"]=None
             return await save_shift_data(update, context)
 
+        # Нажатие цифровой клавиатуры удаляем сразу (пакетом), а сообщение
+        # с суммой правим с задержкой — в Telegram уходит только итог серии
+        edits.delete(context.bot, update.effective_chat.id, update.message.message_id)
+
         if text == "очистить":
-            # Очищаем буфер
             context.user_data["salary_buffer"]=""
-            # Удаляем сообщение с командой очистки
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-            # Обновляем основное сообщение
-            if "salary_message_id" in context.user_data:
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=update.effective_chat.id,
-                        message_id=context.user_data["salary_message_id"],
-                        text=f"{EMOJI['salary']} Введи гонорар в рублях:\n"
-                             "Используй цифровую клавиатуру"
-                    )
-                except:
-                    pass
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['salary']} Введи гонорар в рублях:\n"
+                                 "Используй цифровую клавиатуру")
             return TYPING_SALARY
 
         if text == "подтвердить":
             # Обрабатываем накопленный буфер
             buffer_value=context.user_data.get("salary_buffer", "")
-            if buffer_value:
-                try:
-                    value=int(buffer_value)
-                    if value<0:
-                        # Удаляем сообщение с подтверждением
-                        await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                        # Обновляем сообщение с ошибкой
-                        if "salary_message_id" in context.user_data:
-                            try:
-                                await context.bot.edit_message_text(
-                                    chat_id=update.effective_chat.id,
-                                    message_id=context.user_data["salary_message_id"],
-                                    text=f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
-                                         "Введите новую сумму:"
-                                )
-                            except:
-                                pass
-                        context.user_data["salary_buffer"]=""
-                        return TYPING_SALARY
-
-                    # Удаляем все сообщения при успешном подтверждении
-                    await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-                    if "salary_message_id" in context.user_data:
-                        await safe_delete_message(context, update.effective_chat.id,
-                                                  context.user_data["salary_message_id"])
-
-                    context.user_data["salary"]=value
-                    return await save_shift_data(update, context)
-                except ValueError:
-                    # Удаляем сообщение с подтверждением
-                    await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                    # Обновляем сообщение с ошибкой
-                    if "salary_message_id" in context.user_data:
-                        try:
-                            await context.bot.edit_message_text(
-                                chat_id=update.effective_chat.id,
-                                message_id=context.user_data["salary_message_id"],
-                                text=f"{EMOJI['warning']} Неверный формат суммы.\n"
-                                     "Введите число:"
-                            )
-                        except:
-                            pass
-                    context.user_data["salary_buffer"]=""
-                    return TYPING_SALARY
-            else:
-                # Удаляем сообщение с подтверждением
-                await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                # Обновляем сообщение
-                if "salary_message_id" in context.user_data:
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=update.effective_chat.id,
-                            message_id=context.user_data["salary_message_id"],
-                            text=f"{EMOJI['warning']} Введите сумму или нажмите 'Пропустить'."
-                        )
-                    except:
-                        pass
+            if not buffer_value:
+                update_salary_prompt(update, context,
+                                     f"{EMOJI['warning']} Введите сумму или нажмите 'Пропустить'.")
                 return TYPING_SALARY
 
-        # Если это цифры или точка - добавляем к буферу
-        if text in ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "."]:
-            if "salary_buffer" not in context.user_data:
+            try:
+                value=int(buffer_value)
+            except ValueError:
+                update_salary_prompt(update, context,
+                                     f"{EMOJI['warning']} Неверный формат суммы.\n"
+                                     "Введите число:")
                 context.user_data["salary_buffer"]=""
+                return TYPING_SALARY
 
-            # Удаляем сообщение с цифрой
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
+            if value<0:
+                update_salary_prompt(update, context,
+                                     f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
+                                     "Введите новую сумму:")
+                context.user_data["salary_buffer"]=""
+                return TYPING_SALARY
 
-            context.user_data["salary_buffer"]+=text
+            drop_salary_messages(update, context)
+            context.user_data["salary"]=value
+            return await save_shift_data(update, context)
 
-            # Обновляем основное сообщение с текущей суммой
-            current_value=context.user_data["salary_buffer"]
-            if "salary_message_id" in context.user_data:
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=update.effective_chat.id,
-                        message_id=context.user_data["salary_message_id"],
-                        text=f"{EMOJI['salary']} Текущая сумма: {current_value} ₽\n"
-                             f"Нажмите 'Подтвердить' для сохранения"
-                    )
-                except:
-                    # Если не удалось отредактировать, отправляем новое
-                    msg=await update.message.reply_text(
-                        f"{EMOJI['salary']} Текущая сумма: {current_value} ₽\n"
-                        f"Нажмите 'Подтвердить' для сохранения"
-                    )
-                    context.user_data["salary_message_id"]=msg.message_id
+        # Если это цифры или точка - добавляем к буферу
+        if text in ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "."]:
+            context.user_data["salary_buffer"]=context.user_data.get("salary_buffer", "") + text
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['salary']} Текущая сумма: {context.user_data['salary_buffer']} ₽\n"
+                                 f"Нажмите 'Подтвердить' для сохранения")
             return TYPING_SALARY
 
         # Если это не команда и не цифра, пробуем обработать как обычный ввод
@@ -768,48 +1000,21 @@ async def enter_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Убираем все кроме цифр и точки/запятой
             cleaned_text=re.sub(r'[^\d.,]', '', text)
             value=float(cleaned_text.replace(",", "."))
-
-            if value<0:
-                # Удаляем сообщение пользователя
-                await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-
-                # Обновляем основное сообщение
-                if "salary_message_id" in context.user_data:
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=update.effective_chat.id,
-                            message_id=context.user_data["salary_message_id"],
-                            text=f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
-                                 "Используйте цифровую клавиатуру"
-                        )
-                    except:
-                        pass
-                return TYPING_SALARY
-
-            # Удаляем сообщения при успешном вводе
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
-            if "salary_message_id" in context.user_data:
-                await safe_delete_message(context, update.effective_chat.id, context.user_data["salary_message_id"])
-
-            context.user_data["salary"]=int(value)
-            return await save_shift_data(update, context)
-
         except ValueError:
-            # Удаляем сообщение пользователя
-            await safe_delete_message(context, update.effective_chat.id, update.message.message_id)
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['warning']} Используйте цифровую клавиатуру или введите число.")
+            return TYPING_SALARY
 
-            # Обновляем основное сообщение
-            if "salary_message_id" in context.user_data:
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=update.effective_chat.id,
-                        message_id=context.user_data["salary_message_id"],
-                        text=f"{EMOJI['warning']} Используйте цифровую клавиатуру или введите число."
-                    )
-                except:
-                    pass
+        if value<0:
+            update_salary_prompt(update, context,
+                                 f"{EMOJI['warning']} Гонорар не может быть отрицательным.\n"
+                                 "Используйте цифровую клавиатуру")
             return TYPING_SALARY
 
+        drop_salary_messages(update, context)
+        context.user_data["salary"]=int(value)
+        return await save_shift_data(update, context)
+
     except Exception as e:
         logger.error(f"Ошибка в enter_salary: {e}")
         await update.message.reply_text(
@@ -831,7 +1036,23 @@ async def save_shift_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "salary": context.user_data.get("salary"),
         }
 
-        if db.add_shift(user_id, shift_data):
+        try:
+            added=db.add_shift(user_id, shift_data)
+        except ShiftOverlapError as e:
+            await display_shift(update, context, shift_data)
+            await cleanup_messages(update, context)
+            msg=await update.message.reply_text(
+                render_overlap_text(e.conflict),
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("💾 Сохранить обе", callback_data="ov|keep"),
+                    InlineKeyboardButton("❌ Отмена", callback_data="ov|cancel")
+                ]])
+            )
+            context.user_data["overlap"]={"action": "add", "shift": shift_data, "message_id": msg.message_id}
+            await update.message.reply_text("Выбери действие выше.", reply_markup=get_main_menu_keyboard())
+            return ConversationHandler.END
+
+        if added:
             await display_shift(update, context, shift_data)
             await cleanup_messages(update, context)
 
@@ -856,6 +1077,41 @@ async def save_shift_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
 
+def render_overlap_text(conflict: Dict[str, Any]) -> str:
+    return (f"{EMOJI['warning']} Смена пересекается по времени с уже сохраненной:\n\n"
+            f"{format_shift_display(conflict)}\n\nСохранить все равно?")
+
+
+async def overlap_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Решение по пересечению смен: ov|keep — сохранить все равно, ov|cancel"""
+    query=update.callback_query
+    try:
+        overlap=context.user_data.get("overlap")
+        if not overlap or overlap["message_id"] != query.message.message_id:
+            await query.answer("Это решение уже принято.")
+            return
+        await query.answer()
+        context.user_data.pop("overlap", None)
+        user_id=str(update.effective_user.id)
+
+        if query.data == "ov|cancel":
+            text=f"{EMOJI['cancel']} Отменено."
+        elif overlap["action"] == "edit":
+            if db.update_shift(user_id, overlap["shift_id"], overlap["field"], overlap["value"], allow_overlap=True):
+                text=f"{EMOJI['success']} Поле обновлено!"
+            else:
+                text=f"{EMOJI['warning']} Ошибка при обновлении."
+        elif db.add_shift(user_id, overlap["shift"], allow_overlap=True):
+            text=f"{EMOJI['success']} Смена успешно добавлена!"
+        else:
+            text=f"{EMOJI['warning']} Ошибка при сохранении смены. Попробуйте еще раз."
+        await query.edit_message_text(text)
+
+    except Exception as e:
+        logger.error(f"Ошибка в overlap_callback: {e}")
+        await query.answer(f"{EMOJI['warning']} Произошла ошибка.")
+
+
 async def display_shift(update: Update, context: ContextTypes.DEFAULT_TYPE, shift: Dict[str, Any]):
     """Отображение информации о смене"""
     try:
@@ -871,40 +1127,51 @@ async def display_shift(update: Update, context: ContextTypes.DEFAULT_TYPE, shif
         logger.error(f"Ошибка в display_shift: {e}")
 
 
+def render_month_picker(user_id: str, year: int = None):
+    """Навигатор по годам и месяцам: только периоды, где есть смены.
+
+    Без year — последний год со сменами. Кнопки месяцев подписаны числом
+    смен и заработком; стрелки листают соседние годы со сменами.
+    """
+    summary=db.get_month_summary(user_id)
+    if not summary:
+        return f"{EMOJI['info']} У тебя пока нет смен.", None
+
+    years=sorted({row["year"] for row in summary})
+    if year not in years:
+        year=years[-1]
+    months=sorted((row for row in summary if row["year"] == year), key=lambda row: row["month"])
+
+    buttons=[
+        InlineKeyboardButton(f"{MONTH_NAMES[row['month']][:3]} · {row['count']} · {format_amount(row['salary'])} ₽",
+                             callback_data=f"month_{year}-{row['month']:02d}")
+        for row in months
+    ]
+    rows=[buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+    index=years.index(year)
+    year_row=[]
+    if index>0:
+        year_row.append(InlineKeyboardButton(f"◀️ {years[index - 1]}", callback_data=f"year|{years[index - 1]}"))
+    if index<len(years) - 1:
+        year_row.append(InlineKeyboardButton(f"{years[index + 1]} ▶️", callback_data=f"year|{years[index + 1]}"))
+    if year_row:
+        rows.append(year_row)
+    rows.append([InlineKeyboardButton("Все смены", callback_data="month_all")])
+
+    count=sum(row["count"] for row in months)
+    salary=sum(row["salary"] for row in months)
+    text=(f"{EMOJI['date']} {year} год: смен — {count}, заработок — {format_amount(salary)} ₽\n\n"
+          "Выбери месяц для просмотра смен:")
+    return text, InlineKeyboardMarkup(rows)
+
+
 async def list_shifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать меню выбора месяца для просмотра смен"""
+    """Показать меню выбора года и месяца для просмотра смен"""
     try:
-        # Создаем кнопки для месяцев
-        month_buttons=InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("Январь", callback_data="month_1"),
-                InlineKeyboardButton("Февраль", callback_data="month_2"),
-                InlineKeyboardButton("Март", callback_data="month_3")
-            ],
-            [
-                InlineKeyboardButton("Апрель", callback_data="month_4"),
-                InlineKeyboardButton("Май", callback_data="month_5"),
-                InlineKeyboardButton("Июнь", callback_data="month_6")
-            ],
-            [
-                InlineKeyboardButton("Июль", callback_data="month_7"),
-                InlineKeyboardButton("Август", callback_data="month_8"),
-                InlineKeyboardButton("Сентябрь", callback_data="month_9")
-            ],
-            [
-                InlineKeyboardButton("Октябрь", callback_data="month_10"),
-                InlineKeyboardButton("Ноябрь", callback_data="month_11"),
-                InlineKeyboardButton("Декабрь", callback_data="month_12")
-            ],
-            [
-                InlineKeyboardButton("Все смены", callback_data="month_all")
-            ]
-        ])
-
-        await update.message.reply_text(
-            f"{EMOJI['date']} Выбери месяц для просмотра смен:",
-            reply_markup=month_buttons
-        )
+        user_id=str(update.effective_user.id)
+        text, markup=render_month_picker(user_id)
+        await update.message.reply_text(text, reply_markup=markup or get_main_menu_keyboard())
 
     except Exception as e:
         logger.error(f"Ошибка в list_shifts: {e}")
@@ -914,89 +1181,124 @@ async def list_shifts(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-async def show_shifts_by_month(update: Update, context: ContextTypes.DEFAULT_TYPE, month: int = None):
-    """Показать смены за определенный месяц или все смены"""
-    try:
-        query=update.callback_query
-        user_id=str(query.from_user.id)
-        shifts=db.get_user_shifts(user_id)
+def shift_sort_key(shift):
+    """Ключ смены для постраничного просмотра: (дата, время начала, id)"""
+    return (
+        shift['date'].isoformat() if shift.get('date') else '',
+        shift.get('start_time') or '',
+        shift['id']
+    )
 
-        if not shifts:
-            await query.edit_message_text(
-                "У тебя пока нет смен.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("◀️ Назад к месяцам", callback_data="back_to_months")
-                ]])
-            )
-            return
 
-        # Фильтруем смены по месяцу если нужно
-        if month is not None:
-            current_year=datetime.now().year
-            filtered_shifts=[]
-            for shift in shifts:
-                if shift.get("date") and shift["date"].month == month and shift["date"].year == current_year:
-                    filtered_shifts.append(shift)
-            shifts=filtered_shifts
-
-        # Сортируем смены: старые сверху, новые снизу
-        if shifts:
-            shifts.sort(key=lambda s: (
-                s.get("date") or date.min,  # Сначала по дате (старые сверху)
-                s.get("start_time") or "00:00"  # Потом по времени (раннее сверху)
-            ))
-
-        if not shifts:
-            month_names={
-                1: "январь", 2: "февраль", 3: "март", 4: "апрель",
-                5: "май", 6: "июнь", 7: "июль", 8: "август",
-                9: "сентябрь", 10: "октябрь", 11: "ноябрь", 12: "декабрь"
-            }
-            month_name=month_names.get(month, "выбранный месяц")
+def scope_bounds(scope: str):
+    """Диапазон дат для 'all' или 'YYYY-MM'"""
+    if scope == "all":
+        return None, None
+    year, month=map(int, scope.split("-"))
+    first=date(year, month, 1)
+    next_month=(first.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return first, next_month - timedelta(days=1)
 
-            await query.edit_message_text(
-                f"У тебя нет смен за {month_name}.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("◀️ Назад к месяцам", callback_data="back_to_months")
-                ]])
-            )
-            return
 
-        # Показываем заголовок
-        if month is not None:
-            month_names={
-                1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
-                5: "Май", 6: "Июнь", 7: "Июль", 8: "Август",
-                9: "Сентябрь", 10: "Октябрь", 11: "Ноябрь", 12: "Декабрь"
-            }
-            header=f"📅 Смены за {month_names[month]} {datetime.now().year}\n\n"
-        else:
-            header="📅 Все твои смены:\n\n"
+def scope_title(scope: str) -> str:
+    if scope == "all":
+        return "📅 Все твои смены"
+    year, month=map(int, scope.split("-"))
+    return f"📅 Смены за {MONTH_NAMES[month]} {year}"
 
-        # Отправляем заголовок с кнопкой "Назад"
-        await query.edit_message_text(
-            header.strip(),
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("◀️ Назад к месяцам", callback_data="back_to_months")
-            ]])
+
+def page_callback(scope: str, page: int, direction: str, key) -> str:
+    """callback_data для перехода по страницам (укладывается в 64 байта)"""
+    return "|".join(["pg", scope, str(page), direction, key[0], key[1], str(key[2])])
+
+
+def parse_page_callback(data: str):
+    _, scope, page, direction, date_key, time_key, shift_id=data.split("|")
+    return scope, int(page), direction, (date_key, time_key, int(shift_id))
+
+
+async def render_shifts_page(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int,
+                             user_id: str, scope: str, page: int = 1, direction: str = None,
+                             key=None, notice: str = None):
+    """Одна страница смен в одном сообщении; навигация редактирует это же сообщение"""
+    date_from, date_to=scope_bounds(scope)
+    back_row=[InlineKeyboardButton("◀️ Назад к месяцам", callback_data=f"back_to_months|{scope[:4]}"
+                                   if scope != "all" else "back_to_months")]
+
+    total=db.count_user_shifts(user_id, date_from, date_to)
+    pages=max(1, -(-total // SHIFTS_PAGE_SIZE))
+    page=min(max(page, 1), pages)
+
+    shifts=db.get_user_shifts_page(
+        user_id, date_from, date_to,
+        after=key if direction == "n" else None,
+        before=key if direction == "p" else None,
+        limit=SHIFTS_PAGE_SIZE
+    )
+    if not shifts and total:
+        # Страница опустела (например, после удаления) — показываем первую
+        page, direction, key=1, None, None
+        shifts=db.get_user_shifts_page(user_id, date_from, date_to, limit=SHIFTS_PAGE_SIZE)
+
+    if not shifts:
+        if scope == "all":
+            text="У тебя пока нет смен."
+        else:
+            text=f"У тебя нет смен за {MONTH_NAMES[int(scope.split('-')[1])].lower()}."
+        if notice:
+            text=f"{notice}\n\n{text}"
+        await context.bot.edit_message_text(
+            text, chat_id=chat_id, message_id=message_id,
+            reply_markup=InlineKeyboardMarkup([back_row])
         )
+        return
 
-        # Показываем смены
-        for shift in shifts:
-            formatted_text=format_shift_display(shift)
+    first_number=(page - 1) * SHIFTS_PAGE_SIZE + 1
+    lines=[scope_title(scope), f"Страница {page} из {pages} · смен: {total}"]
+    if notice:
+        lines.insert(0, notice + "\n")
+
+    keyboard=[]
+    for number, shift in enumerate(shifts, start=first_number):
+        lines.append(f"\n{number}.\n{format_shift_display(shift) or 'Смена без данных'}")
+        keyboard.append([
+            InlineKeyboardButton(f"✏ {number}", callback_data=f"edit_{shift['id']}"),
+            InlineKeyboardButton(f"❌ {number}", callback_data=f"delete_{shift['id']}")
+        ])
 
-            buttons=InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✏ Изменить", callback_data=f"edit_{shift['id']}"),
-                    InlineKeyboardButton("❌ Удалить", callback_data=f"delete_{shift['id']}")
-                ]
-            ])
+    nav_row=[]
+    if page>1:
+        nav_row.append(InlineKeyboardButton("◀️", callback_data=page_callback(
+            scope, page - 1, "p", shift_sort_key(shifts[0]))))
+    nav_row.append(InlineKeyboardButton(f"{page}/{pages}", callback_data="noop"))
+    if page<pages:
+        nav_row.append(InlineKeyboardButton("▶️", callback_data=page_callback(
+            scope, page + 1, "n", shift_sort_key(shifts[-1]))))
+    keyboard.append(nav_row)
+    keyboard.append(back_row)
+
+    await context.bot.edit_message_text(
+        "\n".join(lines), chat_id=chat_id, message_id=message_id,
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=formatted_text if formatted_text else "Смена без данных",
-                reply_markup=buttons
-            )
+    # Запоминаем, что показано в сообщении, чтобы перерисовать его после правки
+    views=context.user_data.setdefault("page_views", {})
+    views.pop(message_id, None)
+    views[message_id]=(scope, page, direction, key)
+    while len(views)>5:
+        views.pop(next(iter(views)))
+
+
+async def show_shifts_by_month(update: Update, context: ContextTypes.DEFAULT_TYPE, scope: str = "all"):
+    """Показать смены за месяц ('YYYY-MM') или все смены (постранично, одним сообщением)"""
+    query=update.callback_query
+    try:
+        user_id=str(query.from_user.id)
+
+        await render_shifts_page(
+            context, query.message.chat_id, query.message.message_id, user_id, scope
+        )
 
     except Exception as e:
         logger.error(f"Ошибка в show_shifts_by_month: {e}")
@@ -1009,58 +1311,67 @@ async def show_shifts_by_month(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Экспорт данных пользователя"""
+    """Выбор формата экспорта данных"""
     try:
         user_id=str(update.effective_user.id)
-        shifts=db.get_user_shifts(user_id)
 
-        if not shifts:
+        if not db.count_user_shifts(user_id):
             await update.message.reply_text(
                 f"{EMOJI['info']} У тебя пока нет смен для экспорта.",
                 reply_markup=get_main_menu_keyboard()
             )
             return
 
-        # Создаем JSON файл
-        export_data_dict={
+        buttons=InlineKeyboardMarkup([[
+            InlineKeyboardButton(title, callback_data=f"export_{fmt}")
+            for fmt, (title, _) in EXPORT_FORMATS.items()
+        ]])
+
+        await update.message.reply_text(
+            f"{EMOJI['info']} Выбери формат экспорта:",
+            reply_markup=buttons
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка в export_data: {e}")
+        await update.message.reply_text(
+            f"{EMOJI['warning']} Произошла ошибка при экспорте данных.",
+            reply_markup=get_main_menu_keyboard()
+        )
+
+
+async def send_export(update: Update, context: ContextTypes.DEFAULT_TYPE, fmt: str):
+    """Экспорт данных пользователя в выбранном формате (без временных файлов)"""
+    query=update.callback_query
+    try:
+        user_id=str(query.from_user.id)
+
+        meta={
             "user_id": user_id,
-            "export_date": datetime.now().isoformat(),
-            "shifts": []
+            "export_date": datetime.now().isoformat()
         }
 
-        for shift in shifts:
-            shift_export={
-                "date": shift['date'].isoformat() if shift['date'] else None,
-                "role": shift['role'],
-                "program": shift['program'],
-                "start_time": shift['start_time'],
-                "end_time": shift['end_time'],
-                "salary": shift['salary']
-            }
-            export_data_dict["shifts"].append(shift_export)
-
-        # Создаем временный файл
-        filename=f"shifts_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(export_data_dict, f, ensure_ascii=False, indent=2)
+        # Смены читаются прямо из курсора и пишутся в буфер в памяти
+        document, filename=build_export(
+            fmt,
+            db.iter_user_shifts(user_id),
+            meta,
+            f"shifts_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
 
-        # Отправляем файл
-        with open(filename, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
+        with document:
+            await query.edit_message_text(f"{EMOJI['success']} Экспорт готов: {filename}")
+            await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=document,
+                filename=filename,
                 caption=f"{EMOJI['success']} Экспорт данных о сменах",
                 reply_markup=get_main_menu_keyboard()
             )
 
-        # Удаляем временный файл
-        os.remove(filename)
-
     except Exception as e:
-        logger.error(f"Ошибка в export_data: {e}")
-        await update.message.reply_text(
-            f"{EMOJI['warning']} Произошла ошибка при экспорте данных.",
-            reply_markup=get_main_menu_keyboard()
-        )
+        logger.error(f"Ошибка в send_export: {e}")
+        await query.edit_message_text(f"{EMOJI['warning']} Произошла ошибка при экспорте данных.")
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1071,7 +1382,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *Основные команды:*
 • Начать смену - добавить новую смену
 • Мои смены - посмотреть все смены
-• Экспорт данных - скачать данные в JSON
+• Экспорт данных - скачать данные в JSON, CSV или iCalendar
 • Помощь - это сообщение
 
 *Как добавить смену:*
@@ -1117,55 +1428,54 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id=str(query.from_user.id)
         data=query.data
 
-        # Обработка выбора месяца
-        if data.startswith("month_"):
-            if data == "month_all":
-                await show_shifts_by_month(update, context, month=None)
-            else:
-                month=int(data.split("_")[1])
-                await show_shifts_by_month(update, context, month=month)
+        # Экспорт в выбранном формате
+        if data.startswith("export_"):
+            fmt=data.split("_", 1)[1]
+            if fmt in EXPORT_FORMATS:
+                await send_export(update, context, fmt)
             return
 
-        # Возврат к меню месяцев
-        elif data == "back_to_months":
-            month_buttons=InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("Январь", callback_data="month_1"),
-                    InlineKeyboardButton("Февраль", callback_data="month_2"),
-                    InlineKeyboardButton("Март", callback_data="month_3")
-                ],
-                [
-                    InlineKeyboardButton("Апрель", callback_data="month_4"),
-                    InlineKeyboardButton("Май", callback_data="month_5"),
-                    InlineKeyboardButton("Июнь", callback_data="month_6")
-                ],
-                [
-                    InlineKeyboardButton("Июль", callback_data="month_7"),
-                    InlineKeyboardButton("Август", callback_data="month_8"),
-                    InlineKeyboardButton("Сентябрь", callback_data="month_9")
-                ],
-                [
-                    InlineKeyboardButton("Октябрь", callback_data="month_10"),
-                    InlineKeyboardButton("Ноябрь", callback_data="month_11"),
-                    InlineKeyboardButton("Декабрь", callback_data="month_12")
-                ],
-                [
-                    InlineKeyboardButton("Все смены", callback_data="month_all")
-                ]
-            ])
+        # Обработка выбора месяца
+        elif data.startswith("month_"):
+            scope=data.split("_", 1)[1]
+            if scope.isdigit():
+                scope=f"{datetime.now().year}-{int(scope):02d}"
+            await show_shifts_by_month(update, context, scope)
+            return
 
-            await query.edit_message_text(
-                f"{EMOJI['date']} Выбери месяц для просмотра смен:",
-                reply_markup=month_buttons
+        # Переход по страницам смен
+        elif data.startswith("pg|"):
+            scope, page, direction, key=parse_page_callback(data)
+            await render_shifts_page(
+                context, query.message.chat_id, query.message.message_id,
+                user_id, scope, page, direction, key
             )
             return
 
+        elif data == "noop":
+            return
+
+        # Возврат к меню месяцев и переход по годам
+        elif data.startswith("back_to_months") or data.startswith("year|"):
+            year=data.split("|")[1] if "|" in data else None
+            text, markup=render_month_picker(user_id, int(year) if year else None)
+            await query.edit_message_text(text, reply_markup=markup)
+            return
+
         # Удаление смены
         elif data.startswith("delete_"):
             shift_id=int(data.split("_")[1])
+            view=context.user_data.get("page_views", {}).get(query.message.message_id)
 
             if db.delete_shift(user_id, shift_id):
-                await query.edit_message_text(f"{EMOJI['success']} Смена удалена.")
+                if view:
+                    # Перерисовываем ту же страницу в том же сообщении
+                    await render_shifts_page(
+                        context, query.message.chat_id, query.message.message_id,
+                        user_id, *view, notice=f"{EMOJI['success']} Смена удалена."
+                    )
+                else:
+                    await query.edit_message_text(f"{EMOJI['success']} Смена удалена.")
                 logger.info(f"Пользователь {user_id} удалил смену {shift_id}")
             else:
                 await query.edit_message_text(f"{EMOJI['warning']} Ошибка при удалении смены.")
@@ -1212,6 +1522,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             context.user_data["edit_shift_id"]=shift_id
             context.user_data["edit_field"]=field
+            context.user_data["edit_message_id"]=query.message.message_id
 
             field_names={
                 "date": "дату (формат ДДММ, например: 1503)",
@@ -1230,6 +1541,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Отмена редактирования
         elif data.startswith("cancel_edit_"):
             shift_id=int(data.split("_")[2])
+            view=context.user_data.get("page_views", {}).get(query.message.message_id)
+            if view:
+                await render_shifts_page(
+                    context, query.message.chat_id, query.message.message_id, user_id, *view
+                )
+                return
+
             shifts=db.get_user_shifts(user_id)
             shift=next((s for s in shifts if s['id'] == shift_id), None)
 
@@ -1315,8 +1633,33 @@ async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:  # role, program
             processed_value=None if new_value.lower() == "пропустить" else new_value
 
+        message_id=context.user_data.get("edit_message_id")
+        view=context.user_data.get("page_views", {}).get(message_id)
+
         # Обновляем в базе данных
-        if db.update_shift(user_id, shift_id, field, processed_value):
+        try:
+            updated=db.update_shift(user_id, shift_id, field, processed_value)
+        except ShiftOverlapError as e:
+            msg=await update.message.reply_text(
+                render_overlap_text(e.conflict),
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("💾 Сохранить", callback_data="ov|keep"),
+                    InlineKeyboardButton("❌ Отмена", callback_data="ov|cancel")
+                ]])
+            )
+            context.user_data["overlap"]={"action": "edit", "shift_id": shift_id, "field": field,
+                                          "value": processed_value, "message_id": msg.message_id}
+            for key in ("edit_shift_id", "edit_field", "edit_message_id"):
+                context.user_data.pop(key, None)
+            return
+
+        if updated and view:
+            # Смена открыта со страницы — возвращаем страницу в том же сообщении
+            await render_shifts_page(
+                context, update.effective_chat.id, message_id, user_id, *view,
+                notice=f"{EMOJI['success']} Поле обновлено!"
+            )
+        elif updated:
             # Получаем обновленную смену
             shifts=db.get_user_shifts(user_id)
             updated_shift=next((s for s in shifts if s['id'] == shift_id), None)
@@ -1350,6 +1693,7 @@ async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Очищаем данные редактирования
         context.user_data.pop("edit_shift_id", None)
         context.user_data.pop("edit_field", None)
+        context.user_data.pop("edit_message_id", None)
 
     except Exception as e:
         logger.error(f"Ошибка в handle_edit_input: {e}")
@@ -1415,7 +1759,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Начать смену - добавить новую смену
 • Мои смены - посмотреть все смены
 • 🌐 Открыть панель смен - веб-интерфейс в Telegram
-• Экспорт данных - скачать данные в JSON
+• Экспорт данных - скачать данные в JSON, CSV или iCalendar
 • Помощь - это сообщение
 
 *Как добавить смену:*
@@ -1457,6 +1801,10 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Глобальный обработчик ошибок"""
     logger.error(f"Ошибка: {context.error}")
 
+    # Ответ на флуд-контроль только добавил бы запросов
+    if isinstance(context.error, RetryAfter):
+        return
+
     if update and update.effective_message:
         await update.effective_message.reply_text(
             f"{EMOJI['warning']} Произошла непредвиденная ошибка. Попробуйте еще раз.",
@@ -1464,58 +1812,80 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-def main():
-    """Основная функция запуска бота"""
-    try:
-        # Инициализируем приложение
-        application=ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-
-        # Создаем обработчик диалогов для добавления смены
-        conv_handler=ConversationHandler(
-            entry_points=[
-                MessageHandler(filters.Regex(r'^Начать смену'), start_shift_creation)
-            ],
-            states={
-                SELECT_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_date)],
-                SELECT_ROLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_role)],
-                SELECT_PROGRAM: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_program)],
-                TYPING_START: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
-                TYPING_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
-                TYPING_SALARY: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_salary)],
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-        )
+def build_application():
+    """Приложение со всеми обработчиками (без запуска приема апдейтов)"""
+    # Инициализируем приложение; user_data и диалоги хранятся в той же базе
+    persistence=SQLitePersistence(db.db_path)
+    application=ingress.configure_builder(ApplicationBuilder()) \
+        .token(TELEGRAM_TOKEN) \
+        .request(HTTPXRequest(connection_pool_size=HTTP_POOL_SIZE, pool_timeout=HTTP_POOL_TIMEOUT)) \
+        .rate_limiter(FloodGateway()) \
+        .concurrent_updates(PerChatUpdateProcessor()) \
+        .persistence(persistence) \
+        .post_init(post_init) \
+        .post_shutdown(post_shutdown) \
+        .build()
+    persistence.attach(application)
+
+    # Создаем обработчик диалогов для добавления смены
+    conv_handler=ConversationHandler(
+        entry_points=[
+            MessageHandler(filters.Regex(r'^Начать смену'), start_shift_creation)
+        ],
+        states={
+            SELECT_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_date)],
+            SELECT_ROLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_role)],
+            SELECT_PROGRAM: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_program)],
+            TYPING_START: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
+            TYPING_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_input)],
+            TYPING_SALARY: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_salary)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
+        },
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="shift_creation",
+        persistent=True,
+    )
+
+    # Добавляем обработчики в правильном порядке (от более специфичных к общим)
 
-        # Добавляем обработчики в правильном порядке (от более специфичных к общим)
+    # 0. Отсев повторных апдейтов
+    ingress.add_dedup_handler(application)
 
-        # 1. Команды
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("cancel", cancel))
+    # 1. Команды
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("cancel", cancel))
 
-        # 2. Обработчик диалогов
-        application.add_handler(conv_handler)
+    # 2. Обработчик диалогов
+    application.add_handler(conv_handler)
 
-        # 3. Обработчик inline кнопок
-        application.add_handler(CallbackQueryHandler(button_handler))
+    # 3. Обработчик inline кнопок
+    application.add_handler(CallbackQueryHandler(overlap_callback, pattern=r"^ov\|"))
+    application.add_handler(CallbackQueryHandler(button_handler))
 
-        # 4. Обработчик кнопок главного меню и текстовых сообщений
-        application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            handle_menu_buttons
-        ))
+    # 4. Обработчик кнопок главного меню и текстовых сообщений
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND,
+        handle_menu_buttons
+    ))
 
-        # 5. Глобальный обработчик ошибок
-        application.add_error_handler(error_handler)
+    # 5. Глобальный обработчик ошибок
+    application.add_error_handler(error_handler)
+
+    return application
+
+
+def main():
+    """Основная функция запуска бота"""
+    try:
+        application=build_application()
 
         logger.info("Бот запущен и готов к работе...")
         print(f"{EMOJI['success']} Бот запущен успешно!")
 
-        # Запускаем бота
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        # Запускаем бота (long polling или webhook, см. BOT_MODE)
+        ingress.run(application)
 
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске бота: {e}")
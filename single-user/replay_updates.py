@@ -0,0 +1,261 @@
+# replay_updates.py - Локальная заглушка Bot API и прогон записанных апдейтов
+#
+# Бот запускается против заглушки:
+#   BOT_API_BASE_URL=http://127.0.0.1:8081/bot BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443 \
+#   WEBHOOK_SECRET=test python bot_multiuser.py
+# и затем:
+#   python replay_updates.py --mode webhook --secret test --count 500
+# В режиме polling апдейты отдаются боту через getUpdates заглушки.
+# Итог: апдейтов в секунду и задержка от отправки апдейта до ответа бота (p50/p95/p99).
+# Нагрузка от многих пользователей: --users 200 --count 2000
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER={"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+
+
+class StubState:
+    """Общее состояние заглушки: очередь getUpdates и задержки ответов.
+
+    Апдейты одного чата обрабатываются по порядку, поэтому i-й ответ в чат
+    сопоставляется i-му отправленному в него апдейту.
+    """
+
+    def __init__(self):
+        self.lock=threading.Condition()
+        self.updates=[]
+        self.sent_at=defaultdict(deque)
+        self.latencies=[]
+        self.last_reply=None
+        self.replies=0
+        self.message_ids=itertools.count(1000)
+        self.ready=threading.Event()  # Бот вызвал setWebhook или getUpdates
+
+    def mark_sent(self, chat_id: int):
+        with self.lock:
+            self.sent_at[chat_id].append(time.monotonic())
+
+    def mark_replied(self, chat_id: int):
+        with self.lock:
+            now=time.monotonic()
+            self.replies+=1
+            self.last_reply=now
+            if self.sent_at[chat_id]:
+                self.latencies.append(now - self.sent_at[chat_id].popleft())
+
+
+class StubServer(ThreadingHTTPServer):
+    # Очередь соединений по умолчанию (5) под нагрузкой дает повторы SYN и лишнюю секунду задержки
+    request_queue_size=256
+    daemon_threads=True
+
+
+class StubBotAPI(BaseHTTPRequestHandler):
+    state: StubState=None
+    delay=0.0  # Имитация сетевой задержки до api.telegram.org
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        method=self.path.rstrip("/").rsplit("/", 1)[-1]
+        length=int(self.headers.get("Content-Length") or 0)
+        params=self._parse(self.rfile.read(length))
+
+        if method == "getMe":
+            result=BOT_USER
+        elif method == "setWebhook":
+            self.state.ready.set()
+            result=True
+        elif method == "getUpdates":
+            self.state.ready.set()
+            result=self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        elif method in ("sendMessage", "editMessageText", "sendDocument"):
+            time.sleep(self.delay)
+            result=self._reply(params)
+        else:
+            result=True
+
+        body=json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse(self, raw: bytes) -> dict:
+        content_type=self.headers.get("Content-Type", "")
+        if "json" in content_type:
+            return json.loads(raw or b"{}")
+        if "multipart" in content_type:
+            return {m.group(1).decode(): m.group(2).decode("utf-8", "replace")
+                    for m in re.finditer(rb'name="(\w+)"\r\n\r\n([^\r]*)', raw)}
+        return {key: values[0] for key, values in parse_qs(raw.decode("utf-8")).items()}
+
+    def _get_updates(self, offset: int, timeout: float):
+        state=self.state
+        with state.lock:
+            state.updates=[u for u in state.updates if u["update_id"]>=offset]
+            if not state.updates and timeout:
+                state.lock.wait(timeout)
+            return state.updates[:100]
+
+    def _reply(self, params: dict):
+        chat_id=int(params.get("chat_id") or 0)
+        self.state.mark_replied(chat_id)
+        return {
+            "message_id": next(self.state.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+
+def _chat_id(update: dict) -> int:
+    message=update.get("message") or update.get("callback_query", {}).get("message") or {}
+    return message.get("chat", {}).get("id", 0)
+
+
+def make_updates(count: int, text: str, start_id: int, users: int):
+    """Синтетические апдейты от users пользователей (каждый пишет в свой чат)"""
+    now=int(time.time())
+    for i in range(count):
+        user_id=10_000_000 + start_id + i % users
+        yield {
+            "update_id": start_id + i,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{i % users}"},
+                "text": text,
+            },
+        }
+
+
+def load_updates(path: str):
+    """Записанные апдейты: один JSON на строку"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def post_webhook(url: str, secret: str, update: dict):
+    request=urllib.request.Request(
+        url,
+        data=json.dumps(update).encode("utf-8"),
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret},
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+
+
+def percentile(values, share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def report(state: StubState, expected: int, started: float, duplicates: int, rejected: int):
+    latencies=sorted(state.latencies)
+    elapsed=max((state.last_reply or started) - started, 1e-9)
+
+    print(f"Апдейтов: {expected} (+{duplicates} повторов), ответов: {state.replies}")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.1f} апдейтов/с")
+    if latencies:
+        print(f"Задержка до ответа: p50 {percentile(latencies, 0.5) * 1000:.0f} мс, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f} мс, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.0f} мс, max {latencies[-1] * 1000:.0f} мс")
+    if rejected:
+        print(f"Отклонено вебхуком: {rejected}")
+
+
+def send_stream(args, state: StubState, updates) -> tuple:
+    """Апдейты одного пользователя по порядку; возвращает (повторы, отклоненные)"""
+    duplicates=rejected=0
+    for update in updates:
+        state.mark_sent(_chat_id(update))
+        for copy in range(2 if args.duplicates else 1):
+            duplicates+=copy
+            if args.mode == "webhook":
+                try:
+                    post_webhook(args.webhook_url, args.secret, update)
+                except urllib.error.HTTPError as e:
+                    # 403 — неверный секрет, 503 — очередь бота переполнена
+                    rejected+=1
+                    print(f"Апдейт {update['update_id']} отклонен: {e.code} {e.reason}")
+            else:
+                with state.lock:
+                    state.updates.append(update)
+                    state.lock.notify_all()
+        if args.rate:
+            time.sleep(1 / args.rate)
+    return duplicates, rejected
+
+
+def main():
+    parser=argparse.ArgumentParser(description="Прогон апдейтов через бота с заглушкой Bot API")
+    parser.add_argument("--mode", choices=["webhook", "polling"], default="webhook")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", help="файл с записанными апдейтами (JSON Lines)")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1, help="сколько пользователей пишут одновременно")
+    parser.add_argument("--text", default="Помощь")
+    parser.add_argument("--rate", type=float, default=0, help="апдейтов в секунду на пользователя (0 — без паузы)")
+    parser.add_argument("--duplicates", action="store_true", help="отправлять каждый апдейт дважды")
+    parser.add_argument("--api-delay", type=float, default=0.05, help="задержка ответа заглушки, с")
+    parser.add_argument("--wait", type=float, default=10, help="сколько ждать ответов после отправки")
+    parser.add_argument("--linger", type=float, default=0,
+                        help="сколько еще держать заглушку после отчета (отложенные запросы бота)")
+    parser.add_argument("--start-id", type=int, default=int(time.time()))
+    args=parser.parse_args()
+
+    state=StubState()
+    StubBotAPI.state=state
+    StubBotAPI.delay=args.api_delay
+    server=StubServer(("127.0.0.1", args.api_port), StubBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Заглушка Bot API: http://127.0.0.1:{args.api_port}/bot")
+
+    updates=load_updates(args.updates) if args.updates \
+        else list(make_updates(args.count, args.text, args.start_id, args.users))
+    streams=defaultdict(list)
+    for update in updates:
+        streams[_chat_id(update)].append(update)
+
+    print("Ожидание бота...")
+    state.ready.wait()
+    time.sleep(0.5)
+
+    started=time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(len(streams), 256) or 1) as pool:
+        results=list(pool.map(lambda stream: send_stream(args, state, stream), streams.values()))
+    duplicates=sum(r[0] for r in results)
+    rejected=sum(r[1] for r in results)
+
+    deadline=time.monotonic() + args.wait
+    while time.monotonic()<deadline and len(state.latencies)<len(updates) - rejected:
+        time.sleep(0.1)
+
+    report(state, len(updates), started, duplicates, rejected)
+    if args.linger:
+        replies=state.replies
+        time.sleep(args.linger)
+        print(f"Отложенных ответов за {args.linger:.0f} c: {state.replies - replies}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
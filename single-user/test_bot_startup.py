@@ -0,0 +1,71 @@
+# test_bot_startup.py - Запуск бота до приема апдейтов: post_init с настоящим persistent-диалогом
+#
+#   python -m pytest -q test_bot_startup.py
+# Сеть не нужна: вместо getMe подставляется заглушка инициализации бота.
+import asyncio
+import importlib.util
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+# Бот пишет shifts.db и bot.log в текущий каталог
+os.chdir(tempfile.mkdtemp())
+# config.py с токеном в репозиторий не входит
+if importlib.util.find_spec("config") is None:
+    sys.modules["config"]=types.SimpleNamespace(TELEGRAM_TOKEN="123456:TEST")
+
+from telegram.ext import ExtBot
+
+import bot
+
+
+async def _noop(self):
+    pass
+
+
+class StartupTest(unittest.TestCase):
+
+    def run_app(self, scenario):
+        async def main():
+            application=bot.build_application()
+            with mock.patch.object(ExtBot, "initialize", _noop), mock.patch.object(ExtBot, "shutdown", _noop):
+                await application.initialize()
+                try:
+                    await application.post_init(application)
+                    await scenario(application)
+                finally:
+                    await application.post_shutdown(application)
+                    await application.shutdown()
+        asyncio.run(main())
+
+    def test_post_init_starts_sweeper(self):
+        async def scenario(application):
+            self.assertIs(bot.sweeper.application, application)
+
+        self.run_app(scenario)
+
+    def test_eviction_ends_conversation_and_timeout(self):
+        async def scenario(application):
+            conv=bot.sweeper.conversation_handlers(application)[0]
+            self.assertTrue(conv.persistent)
+            job=application.job_queue.run_once(lambda context: None, 600)
+            conv._conversations[(7, 7)]=bot.TYPING_SALARY
+            conv.timeout_jobs[(7, 7)]=job
+
+            self.assertEqual(bot.sweeper.end_conversations(7), 1)
+            self.assertNotIn((7, 7), conv._conversations)
+            self.assertNotIn((7, 7), conv.timeout_jobs)
+            self.assertTrue(job.removed)
+
+            await application.update_persistence()
+            await application.persistence.flush()
+            self.assertEqual(await application.persistence.get_conversations(conv.name), {})
+
+        self.run_app(scenario)
+
+
+if __name__ == "__main__":
+    unittest.main()
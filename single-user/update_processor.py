@@ -0,0 +1,74 @@
+# update_processor.py - Параллельная обработка апдейтов с порядком внутри чата
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Dict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger=logging.getLogger(__name__)
+
+# Сколько апдейтов обрабатывается одновременно
+UPDATE_WORKERS=int(os.getenv("UPDATE_WORKERS", "32"))
+# Сколько апдейтов может ждать своей очереди (в том числе за апдейтами своего чата)
+UPDATE_MAX_PENDING=int(os.getenv("UPDATE_MAX_PENDING", "1024"))
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Разные чаты обрабатываются параллельно, один чат — строго по порядку.
+
+    Диалоги (ConversationHandler) и user_data одного пользователя не видят
+    гонок, а медленный экспорт одного пользователя не задерживает кнопки
+    остальных. Апдейт сначала встает в очередь своего чата и только потом
+    занимает обработчик, поэтому ждущие апдейты не держат воркеров.
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, max_pending: int = UPDATE_MAX_PENDING):
+        super().__init__(max_pending)
+        self.workers=workers
+        self._worker_slots=asyncio.Semaphore(workers)
+        self._chat_locks: Dict[Any, asyncio.Lock]={}
+        self._chat_waiters: Dict[Any, int]={}
+
+    @staticmethod
+    def _key(update: object):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return ("user", update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key=self._key(update)
+        if key is None:
+            async with self._worker_slots:
+                await coroutine
+            return
+
+        lock=self._chat_locks.get(key)
+        if lock is None:
+            lock=self._chat_locks[key]=asyncio.Lock()
+        self._chat_waiters[key]=self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._worker_slots:
+                    await coroutine
+        finally:
+            # Замок чата живет, только пока у чата есть апдейты
+            self._chat_waiters[key]-=1
+            if not self._chat_waiters[key]:
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    @property
+    def active_chats(self) -> int:
+        """Чатов с апдейтами в обработке или в очереди"""
+        return len(self._chat_locks)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass